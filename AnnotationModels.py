@@ -92,3 +92,63 @@ class AnnotationPriorBinary(AnnotationPriorBase):
         else:
             raise ValueError('The trueLabel argument must be in of {}.'.format(
                 AnnotationPriorBinary.validLabels))
+
+
+class AnnotationModelCategorical(AnnotationModelBase):
+    """Implements a confusion matrix model of a classifier assigning
+    annotationLabel when the true label is trueLabel.
+
+    Classifier skills are dictionaries mapping (trueLabel, annotationLabel)
+    pairs to probabilities, as written by ClassifierSkillEngineCategorical.
+    """
+
+    def __init__(self, labels=None, **args):
+        """Arguments:
+        -- labels - Sequence of the valid labels. Pairs missing from a
+        classifier's skills have probability 1 / len(labels).
+        """
+        super().__init__(**args)
+        self.validLabels = list(labels) if labels is not None else []
+
+    def __call__(self, trueLabel, annotation):
+        """Computes the probability of a classifier assigning annotation.label
+        when trueLabel is true.
+        """
+        return annotation.classifier.skills.get(
+            (trueLabel, annotation.label), 1.0 / max(len(self.validLabels), 1))
+
+
+class AnnotationPriorCategorical(AnnotationPriorBase):
+    """Implements a categorical prior over the true label of a subject.
+    """
+
+    def __init__(self, labels=None, probs=None, **args):
+        """Arguments:
+        -- labels - Sequence of the valid labels.
+        -- probs - Optional sequence of prior probabilities, one per label.
+        Defaults to uniform.
+        """
+        super().__init__(**args)
+        self.validLabels = list(labels) if labels is not None else []
+        if probs is None:
+            probs = np.ones(len(self.validLabels))
+        probs = np.asarray(probs, dtype=float)
+        if probs.shape != (len(self.validLabels), ):
+            raise ValueError(
+                'The probs argument must have one entry per label. {} entries '
+                'passed for {} labels.'.format(probs.size,
+                                               len(self.validLabels)))
+        self._priorsForLabels = dict(zip(self.validLabels, probs / probs.sum()))
+
+    @property
+    def probs(self):
+        return [self._priorsForLabels[label] for label in self.validLabels]
+
+    def __call__(self, trueLabel):
+        """Return probability obtaining trueLabel.
+        """
+        if trueLabel in self._priorsForLabels:
+            return self._priorsForLabels[trueLabel]
+        else:
+            raise ValueError('The trueLabel argument must be one of {}.'.format(
+                self.validLabels))
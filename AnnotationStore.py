@@ -0,0 +1,503 @@
+import numpy as np
+
+from Annotations import AnnotationBase, Annotations
+from Classifiers import Classifier
+from Labels import BoolValuedLabelType
+from Subjects import Subject, Subjects
+
+
+class AnnotationStore():
+    """Columnar (struct-of-arrays) storage for annotations.
+
+    Each annotation occupies one position in four parallel NumPy arrays holding
+    the dense subject index, the dense classifier index, the encoded label and
+    the annotation id. Subject ids, classifier ids and label values are mapped
+    to dense integer codes so that models can operate on the arrays directly
+    using grouped (bincount-style) operations.
+
+    A missing label (e.g. an annotation for a different task) is encoded as -1,
+    as is an unknown subject true label.
+    """
+
+    missingCode = -1
+    positionIndexMinTail = 4096
+
+    def __init__(self, labels=None, labelType=BoolValuedLabelType, capacity=1024):
+        """Arguments:
+        -- labels - Optional sequence of valid label values. Labels are assigned
+        codes in the order given. Unseen labels are appended as they arrive. For
+        binary tasks pass [False, True] so that codes match label values.
+        -- labelType - LabelType subclass reported by annotation views.
+        -- capacity - Initial number of annotations allocated.
+        """
+        self._labelType = labelType
+        self._size = 0
+        capacity = max(int(capacity), 1)
+        self._subjectIndex = np.empty(capacity, dtype=np.int64)
+        self._classifierIndex = np.empty(capacity, dtype=np.int64)
+        self._labelCodes = np.empty(capacity, dtype=np.int16)
+        self._annotationIds = np.empty(capacity, dtype=np.int64)
+
+        self._subjectIds = []
+        self._subjectIdMap = {}
+        self._trueLabelCodes = np.full(capacity, self.missingCode, dtype=np.int16)
+
+        self._classifierIds = []
+        self._classifierIdMap = {}
+
+        self._labels = []
+        self._labelCodeMap = {}
+        for label in (labels if labels is not None else []):
+            self.labelCode(label)
+
+        self._positionIndices = {}
+        self._positionTails = {}
+        self._version = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def labelType(self):
+        return self._labelType
+
+    @property
+    def numAnnotations(self):
+        return self._size
+
+    @property
+    def version(self):
+        """Counter incremented whenever annotations are appended or true labels
+        are set.
+        """
+        return self._version
+
+    @property
+    def numSubjects(self):
+        return len(self._subjectIds)
+
+    @property
+    def numClassifiers(self):
+        return len(self._classifierIds)
+
+    @property
+    def numLabels(self):
+        return len(self._labels)
+
+    @property
+    def subjectIndex(self):
+        return self._subjectIndex[:self._size]
+
+    @property
+    def classifierIndex(self):
+        return self._classifierIndex[:self._size]
+
+    @property
+    def labelCodes(self):
+        return self._labelCodes[:self._size]
+
+    @property
+    def annotationIds(self):
+        return self._annotationIds[:self._size]
+
+    @property
+    def subjectIds(self):
+        return self._subjectIds
+
+    @property
+    def classifierIds(self):
+        return self._classifierIds
+
+    @property
+    def labels(self):
+        return self._labels
+
+    @property
+    def subjectIdMap(self):
+        """Dictionary mapping subject ids to dense subject indices.
+        """
+        return self._subjectIdMap
+
+    @property
+    def classifierIdMap(self):
+        """Dictionary mapping classifier ids to dense classifier indices.
+        """
+        return self._classifierIdMap
+
+    @property
+    def labelCodeMap(self):
+        """Dictionary mapping label values to label codes.
+        """
+        return self._labelCodeMap
+
+    @property
+    def trueLabelCodes(self):
+        return self._trueLabelCodes[:self.numSubjects]
+
+    def subjectCode(self, subjectId, create=True):
+        """Return the dense index of subjectId, registering it if required.
+        """
+        code = self._subjectIdMap.get(subjectId)
+        if code is None:
+            if not create:
+                raise KeyError(
+                    'Subject {} is not present in the store.'.format(subjectId))
+            code = len(self._subjectIds)
+            self._subjectIdMap[subjectId] = code
+            self._subjectIds.append(subjectId)
+            if code >= self._trueLabelCodes.size:
+                self._trueLabelCodes = np.concatenate([
+                    self._trueLabelCodes,
+                    np.full(
+                        self._trueLabelCodes.size,
+                        self.missingCode,
+                        dtype=self._trueLabelCodes.dtype)
+                ])
+        return code
+
+    def classifierCode(self, classifierId, create=True):
+        """Return the dense index of classifierId, registering it if required.
+        """
+        code = self._classifierIdMap.get(classifierId)
+        if code is None:
+            if not create:
+                raise KeyError('Classifier {} is not present in the store.'.
+                               format(classifierId))
+            code = len(self._classifierIds)
+            self._classifierIdMap[classifierId] = code
+            self._classifierIds.append(classifierId)
+        return code
+
+    def labelCode(self, label, create=True):
+        """Return the code for label, registering it if required. A label of
+        None maps to missingCode.
+        """
+        if label is None:
+            return self.missingCode
+        code = self._labelCodeMap.get(label)
+        if code is None:
+            if not create:
+                raise KeyError(
+                    'Label {} is not present in the store.'.format(label))
+            code = len(self._labels)
+            self._labelCodeMap[label] = code
+            self._labels.append(label)
+        return code
+
+    def decodeLabel(self, code):
+        return None if code == self.missingCode else self._labels[code]
+
+    def _reserve(self, count):
+        required = self._size + count
+        if required <= self._subjectIndex.size:
+            return
+        capacity = max(self._subjectIndex.size, 1)
+        while capacity < required:
+            capacity *= 2
+        for name in ('_subjectIndex', '_classifierIndex', '_labelCodes',
+                     '_annotationIds'):
+            column = getattr(self, name)
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            setattr(self, name, grown)
+
+    def append(self, annotationId, subjectId, classifierId, label):
+        """Append a single annotation. Returns its position in the store.
+        """
+        self._reserve(1)
+        position = self._size
+        self._subjectIndex[position] = self.subjectCode(subjectId)
+        self._classifierIndex[position] = self.classifierCode(classifierId)
+        self._labelCodes[position] = self.labelCode(label)
+        self._annotationIds[position] = annotationId
+        self._size += 1
+        self._version += 1
+        self._extendPositionTails(slice(position, position + 1))
+        return position
+
+    def extend(self, annotationIds, subjectIds, classifierIds, labels):
+        """Append annotations in bulk from parallel sequences of raw ids and
+        label values. Returns the slice of positions occupied.
+        """
+        return self.extendEncoded(
+            annotationIds,
+            [self.subjectCode(subjectId) for subjectId in subjectIds],
+            [
+                self.classifierCode(classifierId)
+                for classifierId in classifierIds
+            ], [self.labelCode(label) for label in labels])
+
+    def extendEncoded(self, annotationIds, subjectIndex, classifierIndex,
+                      labelCodes):
+        """Append annotations in bulk from parallel arrays that are already
+        encoded with this store's subject, classifier and label codes. Returns
+        the slice of positions occupied.
+        """
+        annotationIds = np.asarray(annotationIds, dtype=np.int64)
+        count = annotationIds.size
+        self._reserve(count)
+        start, stop = self._size, self._size + count
+        self._subjectIndex[start:stop] = subjectIndex
+        self._classifierIndex[start:stop] = classifierIndex
+        self._labelCodes[start:stop] = labelCodes
+        self._annotationIds[start:stop] = annotationIds
+        self._size = stop
+        self._version += 1
+        self._extendPositionTails(slice(start, stop))
+        return slice(start, stop)
+
+    def setTrueLabel(self, subjectId, trueLabel):
+        self._trueLabelCodes[self.subjectCode(subjectId)] = self.labelCode(
+            trueLabel)
+        self._version += 1
+
+    def getTrueLabel(self, subjectId):
+        return self.decodeLabel(
+            self._trueLabelCodes[self.subjectCode(subjectId, create=False)])
+
+    def setTrueLabelCodes(self, trueLabelCodes, subjectCodes=None):
+        """Set the true label codes of all subjects, or of the subjects with the
+        dense indices subjectCodes.
+        """
+        if subjectCodes is None:
+            self._trueLabelCodes[:self.numSubjects] = trueLabelCodes
+        else:
+            self._trueLabelCodes[subjectCodes] = trueLabelCodes
+        self._version += 1
+
+    def _extendPositionTails(self, positions):
+        # Positions appended after an index was built are listed per code
+        # until the next rebuild, so that lookups never scan the tail.
+        for columnName, tail in self._positionTails.items():
+            column = (self._subjectIndex
+                      if columnName == 'subject' else self._classifierIndex)
+            for position, code in enumerate(column[positions].tolist(),
+                                            positions.start):
+                tail.setdefault(code, []).append(position)
+
+    def _positionIndex(self, columnName, rebuild=False):
+        """Return (order, offsets, indexedSize) such that
+        order[offsets[g]:offsets[g + 1]] lists the positions below indexedSize of
+        all annotations in group g of the named column ('subject' or
+        'classifier'). The positions appended since are held per group in
+        self._positionTails[columnName].
+
+        The index is rebuilt only once the number of annotations appended since
+        the last build exceeds a quarter of the indexed size (or if rebuild is
+        True), so that the rebuild cost is amortized over the appended data.
+        """
+        index = self._positionIndices.get(columnName)
+        if index is None or rebuild or self._size - index[2] > max(
+                self.positionIndexMinTail, index[2] // 4):
+            if columnName == 'subject':
+                column, numGroups = self.subjectIndex, self.numSubjects
+            else:
+                column, numGroups = self.classifierIndex, self.numClassifiers
+            order = np.argsort(column, kind='stable')
+            offsets = np.zeros(numGroups + 1, dtype=np.int64)
+            np.cumsum(
+                np.bincount(column, minlength=numGroups), out=offsets[1:])
+            index = (order, offsets, self._size)
+            self._positionIndices[columnName] = index
+            self._positionTails[columnName] = {}
+        return index
+
+    def _positions(self, columnName, code):
+        order, offsets, indexedSize = self._positionIndex(columnName)
+        if code + 1 < offsets.size:
+            head = order[offsets[code]:offsets[code + 1]]
+        else:
+            head = order[:0]
+        tail = self._positionTails[columnName].get(code)
+        if tail is None:
+            return head
+        return np.concatenate([head, np.asarray(tail, dtype=head.dtype)])
+
+    def subjectPositions(self, subjectCode):
+        """Return the positions of all annotations of the subject with dense
+        index subjectCode.
+        """
+        return self._positions('subject', subjectCode)
+
+    def classifierPositions(self, classifierCode):
+        """Return the positions of all annotations by the classifier with dense
+        index classifierCode.
+        """
+        return self._positions('classifier', classifierCode)
+
+    def annotationView(self, position, classifier=None):
+        return AnnotationView(self, position, classifier)
+
+    @classmethod
+    def fromColumns(cls,
+                    annotationIds,
+                    subjectIndex,
+                    classifierIndex,
+                    labelCodes,
+                    subjectIds,
+                    classifierIds,
+                    labels,
+                    trueLabelCodes=None,
+                    **args):
+        """Build a store that adopts existing (e.g. memory-mapped) columns
+        without copying them. The columns are copied into newly allocated
+        arrays only when further annotations are appended.
+
+        Arguments:
+        -- subjectIds, classifierIds - Sequences of ids in dense index order.
+        -- labels - Sequence of label values in label code order.
+        -- trueLabelCodes - Optional array of subject true label codes.
+        """
+        store = cls(labels=labels, capacity=1, **args)
+        store._annotationIds = np.asarray(annotationIds)
+        store._subjectIndex = np.asarray(subjectIndex)
+        store._classifierIndex = np.asarray(classifierIndex)
+        store._labelCodes = np.asarray(labelCodes)
+        store._size = store._annotationIds.size
+        store._subjectIds = list(subjectIds)
+        store._subjectIdMap = {
+            subjectId: code
+            for code, subjectId in enumerate(store._subjectIds)
+        }
+        store._classifierIds = list(classifierIds)
+        store._classifierIdMap = {
+            classifierId: code
+            for code, classifierId in enumerate(store._classifierIds)
+        }
+        store._trueLabelCodes = np.full(
+            max(len(store._subjectIds), 1), cls.missingCode, dtype=np.int16)
+        if trueLabelCodes is not None:
+            store._trueLabelCodes[:len(trueLabelCodes)] = trueLabelCodes
+        return store
+
+    @classmethod
+    def fromSubjects(cls, subjects, labels=None, **args):
+        """Build a store from an object graph of Subject instances. Subject true
+        labels are copied into the store.
+        """
+        if not isinstance(subjects, Subjects):
+            raise TypeError(
+                'The subjects argument must be of type {}. Type {} passed.'.
+                format(type(Subjects), type(subjects)))
+        store = cls(labels=labels, **args)
+        annotationIds, subjectIds, classifierIds, annotationLabels = [], [], [], []
+        for subject in subjects.items():
+            store.subjectCode(subject.id)
+            if subject.trueLabel is not None:
+                store.setTrueLabel(subject.id, subject.trueLabel)
+            for annotation in subject.annotations.items():
+                annotationIds.append(annotation.id)
+                subjectIds.append(subject.id)
+                classifierIds.append(annotation.classifier.id)
+                annotationLabels.append(annotation.label)
+        store.extend(annotationIds, subjectIds, classifierIds, annotationLabels)
+        return store
+
+    @classmethod
+    def forSubjects(cls, subjects, labels=None, **args):
+        """Return the store backing subjects (see Subjects.attachStore) if its
+        labels begin with labels, otherwise a store built with fromSubjects.
+        """
+        store = subjects.store
+        if store is not None and (labels is None or
+                                  store.labels[:len(labels)] == list(labels)):
+            return store
+        return cls.fromSubjects(subjects, labels=labels, **args)
+
+    def toSubjects(self, classifiers=None, **classifierArgs):
+        """Return a Subjects collection whose annotations are thin views over
+        this store. The collection is backed by this store, so subjects and
+        annotations merged into it are appended to the store and true labels
+        set on its subjects are written to the store (see
+        Subjects.attachStore).
+
+        Arguments:
+        -- classifiers - Optional iterable of Classifier instances that the views
+        should reference. Classifiers not present are created once per
+        classifier id using classifierArgs.
+        -- classifierArgs - Arguments forwarded to the Classifier constructor.
+        """
+        classifierLookup = {
+            classifier.id: classifier
+            for classifier in (classifiers if classifiers is not None else [])
+        }
+        classifierObjects = [
+            classifierLookup.get(classifierId) or Classifier(
+                id=classifierId, **classifierArgs)
+            for classifierId in self.classifierIds
+        ]
+        order, offsets, _ = self._positionIndex('subject', rebuild=True)
+        classifierIndex = self.classifierIndex
+        subjects = Subjects([
+            Subject(
+                id=subjectId,
+                annotations=Annotations([
+                    AnnotationView(self, position,
+                                   classifierObjects[classifierIndex[position]])
+                    for position in order[offsets[code]:offsets[code + 1]]
+                ]),
+                trueLabel=self.decodeLabel(self._trueLabelCodes[code]))
+            for code, subjectId in enumerate(self.subjectIds)
+        ])
+        subjects.attachStore(self)
+        return subjects
+
+
+class AnnotationView(AnnotationBase):
+    """Read-only view of a single annotation held in an AnnotationStore. Exposes
+    the same interface as the concrete AnnotationBase subclasses so that the
+    object-based models can consume store-backed annotations.
+    """
+
+    def __init__(self, store, position, classifier=None):
+        super().__init__(store.labelType)
+        self._store = store
+        self._position = position
+        self._classifier = classifier
+
+    @property
+    def store(self):
+        return self._store
+
+    @property
+    def position(self):
+        return self._position
+
+    @property
+    def id(self):
+        return int(self._store.annotationIds[self._position])
+
+    @property
+    def subjectId(self):
+        return self._store.subjectIds[self._store.subjectIndex[self._position]]
+
+    @property
+    def classifierId(self):
+        return self._store.classifierIds[self._store.classifierIndex[
+            self._position]]
+
+    @property
+    def label(self):
+        return self._store.decodeLabel(self._store.labelCodes[self._position])
+
+    @property
+    def classifier(self):
+        if self._classifier is None:
+            self._classifier = Classifier(id=self.classifierId)
+        return self._classifier
+
+    @classifier.setter
+    def classifier(self, classifier):
+        if not isinstance(classifier, Classifier):
+            raise TypeError(
+                'The classifier argument must be of type {}. Type {} passed.'.
+                format(type(Classifier), type(classifier)))
+        self._classifier = classifier
+
+    def __str__(self):
+        return '\n'.join([
+            '-~~AnnotationView~~-', 'id => {}'.format(self.id),
+            'subjectId => {}'.format(self.subjectId),
+            'classifierId => {}'.format(self.classifierId),
+            'label => {}'.format(self.label), '-~~AnnotationView~~-'
+        ])
@@ -92,13 +92,23 @@ class AnnotationBinary(AnnotationBase):
         self._zooniverseAnnotations = zooniverseAnnotations
 
     def extractLabel(self):
-        if self.taskName in self.zooniverseAnnotations:
-            # print(self.zooniverseAnnotations)
-            annotationValue = self.zooniverseAnnotations[self.taskName][0][
-                'value']
-            if self.trueValue is not None and annotationValue == self.trueValue:
+        return self.labelFromExtract(self.zooniverseAnnotations, self.taskName,
+                                     self.trueValue, self.falseValue)
+
+    @staticmethod
+    def labelFromExtract(zooniverseAnnotations,
+                         taskName=None,
+                         trueValue=None,
+                         falseValue=None,
+                         **kwargs):
+        """Extract the binary label from the annotations of a Zooniverse
+        extract without instantiating an AnnotationBinary.
+        """
+        if taskName in zooniverseAnnotations:
+            annotationValue = zooniverseAnnotations[taskName][0]['value']
+            if trueValue is not None and annotationValue == trueValue:
                 return True
-            if self.trueValue is not None and annotationValue == self.falseValue:
+            if trueValue is not None and annotationValue == falseValue:
                 return False
         return None
 
@@ -109,6 +119,102 @@ class AnnotationBinary(AnnotationBase):
         ] + ['-~~AnnotationBinary~~-'])
 
 
+class AnnotationCategorical(AnnotationBase):
+    """Annotation of a single-choice question with more than two answers.
+    """
+
+    def __init__(self,
+                 id,
+                 classifier=None,
+                 zooniverseAnnotations=None,
+                 taskName=None,
+                 values=None,
+                 **kwargs):
+        """Arguments:
+        -- values - Optional sequence of the valid answer values. Other values
+        are treated as missing. By default every value is valid.
+        """
+        super().__init__(CategoricalLabelType)
+        if not isinstance(classifier, Classifier):
+            raise TypeError(
+                'The classifier argument must be of type {}. Type {} passed.'.
+                format(type(Classifier), type(classifier)))
+        self._id = id
+        self._classifier = classifier
+        self._zooniverseAnnotations = zooniverseAnnotations
+        self._taskName = taskName
+        self._values = values
+        self._label = self.extractLabel()
+
+    @property
+    def id(self):
+        return self._id
+
+    @property
+    def label(self):
+        return self._label
+
+    @label.setter
+    def label(self, label):
+        self._label = label
+
+    @property
+    def classifier(self):
+        return self._classifier
+
+    @classifier.setter
+    def classifier(self, classifier):
+        if not isinstance(classifier, Classifier):
+            raise TypeError(
+                'The classifier argument must be of type {}. Type {} passed.'.
+                format(type(Classifier), type(classifier)))
+        self._classifier = classifier
+
+    @property
+    def taskName(self):
+        return self._taskName
+
+    @taskName.setter
+    def taskName(self, taskName):
+        self._taskName = taskName
+
+    @property
+    def zooniverseAnnotations(self):
+        return self._zooniverseAnnotations
+
+    @zooniverseAnnotations.setter
+    def zooniverseAnnotations(self, zooniverseAnnotations):
+        self._zooniverseAnnotations = zooniverseAnnotations
+
+    @property
+    def values(self):
+        return self._values
+
+    def extractLabel(self):
+        return self.labelFromExtract(self.zooniverseAnnotations, self.taskName,
+                                     self.values)
+
+    @staticmethod
+    def labelFromExtract(zooniverseAnnotations,
+                         taskName=None,
+                         values=None,
+                         **kwargs):
+        """Extract the answer value from the annotations of a Zooniverse
+        extract without instantiating an AnnotationCategorical.
+        """
+        if taskName in zooniverseAnnotations:
+            annotationValue = zooniverseAnnotations[taskName][0]['value']
+            if values is None or annotationValue in values:
+                return annotationValue
+        return None
+
+    def __str__(self):
+        return '\n'.join(['-~~AnnotationCategorical~~-'] + [
+            '{} => {}'.format(name[1:], value)
+            for name, value in vars(self).items()
+        ] + ['-~~AnnotationCategorical~~-'])
+
+
 class AnnotationKeyPoint(AnnotationBase):
     def __init__(self, x=None, y=None, label=None, classifier=None):
         self._x = x
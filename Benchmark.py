@@ -0,0 +1,573 @@
+# Scaling benchmarks for the stages of the Compute.py flow using simulated
+# campaigns generated by BinarySimulationReceiver.
+#
+# Example:
+#   python Benchmark.py --quick --output bench.json
+#   python Benchmark.py --sizes 1e3 1e5 1e7 --engine batch --classifiers 5000
+#   python Benchmark.py --receiver --sizes 1e4 --duplicate-prob 0.05
+#   python Benchmark.py --decoders --extracts recorded.jsonl
+
+import argparse
+import collections
+import hashlib
+import json
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+
+from AnnotationModels import AnnotationModelBinary, AnnotationPriorBinary
+from Annotations import AnnotationBinary
+from AnnotationStore import AnnotationStore
+from Classifiers import Classifiers
+from Deduplication import ClassificationIdIndex
+from ExtractDecoders import ExtractDecoder, SelectiveExtractDecoder, jsonBackend
+from ClassifierSkillModels import ClassifierSkillEngineBinary
+from IO import BinarySimulationReceiver, CaesarSQSReceiver
+from Posteriors import PosteriorEngineBinary
+from Queues import LocalQueueBackend, loadExtracts
+from ResultCache import SubjectResultCache
+from Risk import LossModelBinary, Risk
+from Subjects import Subjects
+
+defaultSizes = [1e3, 1e4, 1e5, 1e6, 1e7]
+quickSizes = [1e3, 1e4]
+stageNames = ['merge', 'skillPriors', 'skills', 'trueLabels', 'risk']
+
+
+class StageTimer():
+    """Records the wall time and (optionally) the peak traced memory
+    allocation of each benchmark stage.
+    """
+
+    def __init__(self, traceMemory=True):
+        self._traceMemory = traceMemory
+        self._stages = {}
+
+    @property
+    def stages(self):
+        return self._stages
+
+    def __call__(self, name, function, *args, **kwargs):
+        if self._traceMemory:
+            tracemalloc.start()
+        startTime = time.perf_counter()
+        result = function(*args, **kwargs)
+        seconds = time.perf_counter() - startTime
+        peakMemoryBytes = None
+        if self._traceMemory:
+            peakMemoryBytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self._stages[name] = {
+            'seconds': seconds,
+            'peakMemoryBytes': peakMemoryBytes
+        }
+        return result
+
+
+def simulate(numAnnotations, numClassifiers, numAnnotationsPerSubject, seed):
+    """Generate a simulated campaign with approximately numAnnotations
+    annotations.
+
+    Returns: Tuple of (Subjects, Classifiers).
+    """
+    rng = np.random.default_rng(seed)
+    numAnnotationsPerSubject = min(numAnnotationsPerSubject, numClassifiers)
+    receiver = BinarySimulationReceiver(
+        numClassifiers=numClassifiers,
+        numSubjects=max(int(numAnnotations) // numAnnotationsPerSubject, 1),
+        numAnnotationsPerSubject=numAnnotationsPerSubject,
+        trueProb=0.6,
+        successProb=rng.uniform(low=0.5, high=0.95, size=numClassifiers),
+        seed=rng.integers(2**32))
+    store = receiver.genStore()
+    # The benchmark infers labels, so discard the simulated truth.
+    store.setTrueLabelCodes(store.missingCode)
+    receiver.genClassifiers()
+    subjects = store.toSubjects(receiver.classifiers.items())
+    return subjects, receiver.classifiers
+
+
+def batches(subjects, batchSize):
+    subjects = subjects.subjects
+    for start in range(0, len(subjects), batchSize):
+        yield Subjects(subjects[start:start + batchSize])
+
+
+def runObjectPipeline(subjects, classifiers, timer, batchSize):
+    """Time the object-based Compute.py flow.
+    """
+    annotationModel = AnnotationModelBinary()
+    annotationPriorModel = AnnotationPriorBinary()
+    lossModel = LossModelBinary(falsePosLoss=1, falseNegLoss=1)
+
+    knownSubjects = Subjects([])
+    knownClassifiers = Classifiers([])
+    # Populated by the first pass and reused by the cached cycle.
+    cache = SubjectResultCache(maxSize=None)
+
+    def merge():
+        for batch in batches(subjects, batchSize):
+            knownSubjects.merge(batch, classifiers=knownClassifiers)
+
+    def skills():
+        for classifier in knownClassifiers.items():
+            classifier.computeSkills(
+                knownSubjects, classifiers=knownClassifiers)
+
+    def trueLabels():
+        # Results of subjects annotated by classifiers whose skills changed
+        # are stale.
+        cache.invalidateClassifiers(knownClassifiers, knownSubjects)
+        for subject in knownSubjects.items():
+            subject.computeTrueLabel(
+                annotationModel=annotationModel,
+                annotationPriorModel=annotationPriorModel,
+                cache=cache)
+
+    def risk():
+        riskEvaluator = Risk(cache=cache)
+        return [
+            riskEvaluator(
+                annotations=subject.annotations,
+                subject=subject,
+                lossModel=lossModel,
+                annotationModel=annotationModel,
+                annotationPriorModel=annotationPriorModel)
+            for subject in knownSubjects.items()
+        ]
+
+    timer('merge', merge)
+    sharedSkillPriors = knownClassifiers.sharedSkillPriors
+    sharedSkillPriors.skillPriorModel = classifiers.classifiers[
+        0]._skillPriorModel
+    skillPriors = timer('skillPriors', sharedSkillPriors.compute,
+                        knownSubjects)
+    for classifier in knownClassifiers.items():
+        classifier.skillPriors = skillPriors
+    timer('skills', skills)
+    timer('trueLabels', trueLabels)
+    timer('risk', risk)
+
+    def cachedCycle():
+        # Nothing changed since the first pass, so every subject is a hit.
+        trueLabels()
+        return risk()
+
+    timer('cachedCycle', cachedCycle)
+
+
+def runBatchPipeline(subjects, classifiers, timer, batchSize):
+    """Time the same flow using the columnar store and batch engines.
+    """
+    annotationPriorModel = AnnotationPriorBinary()
+    lossModel = LossModelBinary(falsePosLoss=1, falseNegLoss=1)
+    skillEngine = ClassifierSkillEngineBinary()
+    posteriorEngine = PosteriorEngineBinary()
+    store = AnnotationStore(labels=[False, True])
+
+    def merge():
+        for batch in batches(subjects, batchSize):
+            annotationIds, subjectIds, classifierIds, labels = [], [], [], []
+            for subject in batch.items():
+                for annotation in subject.annotations.items():
+                    annotationIds.append(annotation.id)
+                    subjectIds.append(subject.id)
+                    classifierIds.append(annotation.classifier.id)
+                    labels.append(annotation.label)
+            store.extend(annotationIds, subjectIds, classifierIds, labels)
+
+    timer('merge', merge)
+    counts = skillEngine.counts(store)
+    priors = timer('skillPriors', skillEngine.priors, store, counts=counts)
+    skills = timer(
+        'skills', skillEngine, store, priors=priors, counts=counts)
+    summary = timer('trueLabels', posteriorEngine, store, skills,
+                    annotationPriorModel)
+    store.setTrueLabelCodes(summary.mapLabelCodes)
+    timer(
+        'risk',
+        posteriorEngine,
+        store,
+        skills,
+        annotationPriorModel,
+        lossModel,
+        predictedLabelCodes=summary.mapLabelCodes)
+
+
+pipelines = {'objects': runObjectPipeline, 'batch': runBatchPipeline}
+
+
+def benchmark(numAnnotations,
+              numClassifiers=1000,
+              numAnnotationsPerSubject=20,
+              engine='batch',
+              seed=0,
+              batchSize=10,
+              traceMemory=True):
+    """Run a single benchmark and return a dictionary of results.
+    """
+    startTime = time.perf_counter()
+    subjects, classifiers = simulate(numAnnotations, numClassifiers,
+                                     numAnnotationsPerSubject, seed)
+    generateSeconds = time.perf_counter() - startTime
+
+    timer = StageTimer(traceMemory=traceMemory)
+    pipelines[engine](subjects, classifiers, timer, batchSize)
+
+    return {
+        'engine': engine,
+        'numAnnotations': len(subjects.annotations.annotations),
+        'numSubjects': len(subjects),
+        'numClassifiers': numClassifiers,
+        'numAnnotationsPerSubject': min(numAnnotationsPerSubject,
+                                        numClassifiers),
+        'batchSize': batchSize,
+        'seed': seed,
+        'generateSeconds': generateSeconds,
+        'stages': timer.stages
+    }
+
+
+def simulateExtracts(numExtracts, numClassifiers, numAnnotationsPerSubject,
+                     seed):
+    """Generate Caesar-style extracts with binary answers to task T0.
+    """
+    rng = np.random.RandomState(seed)
+    numAnnotationsPerSubject = min(numAnnotationsPerSubject, numClassifiers)
+    return [{
+        'classification_id': classificationId,
+        'subject_id': classificationId // numAnnotationsPerSubject,
+        'user_id': int(rng.randint(numClassifiers)),
+        'data': {
+            'classification': {
+                'annotations': {
+                    'T0': [{
+                        'value': int(rng.randint(2))
+                    }]
+                }
+            }
+        }
+    } for classificationId in range(int(numExtracts))]
+
+
+def benchmarkReceiver(numExtracts,
+                      numClassifiers=1000,
+                      numAnnotationsPerSubject=20,
+                      duplicateProb=0.0,
+                      duplicateDelay=0.0,
+                      numPollers=8,
+                      maxMessages=1000,
+                      columnar=False,
+                      dedup=False,
+                      seed=0):
+    """Replay simulated extracts through a LocalQueueBackend and drain it with
+    CaesarSQSReceiver.extractBatch, merging and acknowledging each batch as
+    Compute.py does. If columnar is True, CaesarSQSReceiver.extractStore
+    appends each batch to an AnnotationStore instead. If dedup is True, an
+    in-memory ClassificationIdIndex discards duplicates across batches.
+
+    Returns: Dictionary of throughput and duplication statistics.
+    numDuplicatesMerged counts annotations merged more than once, which should
+    be zero if deduplication is correct.
+    """
+    extracts = simulateExtracts(numExtracts, numClassifiers,
+                                numAnnotationsPerSubject, seed)
+    queue = LocalQueueBackend(
+        duplicateProb=duplicateProb, duplicateDelay=duplicateDelay, seed=seed)
+    queue.replay(extracts)
+
+    knownSubjects = Subjects([])
+    knownClassifiers = Classifiers([])
+    store = AnnotationStore(labels=[False, True])
+    receiver = CaesarSQSReceiver(
+        None,
+        annotationType=AnnotationBinary,
+        classifiers=knownClassifiers,
+        sqsClient=queue,
+        dedupIndex=ClassificationIdIndex() if dedup else None)
+
+    numBatches = 0
+    numFailedDeletes = 0
+    startTime = time.perf_counter()
+    receiveArgs = dict(
+        numPollers=numPollers,
+        maxMessages=maxMessages,
+        waitTimeSeconds=0 if duplicateDelay == 0 else 1,
+        taskName='T0',
+        trueValue=1,
+        falseValue=0)
+    while queue.numVisible or queue.numInFlight:
+        if columnar:
+            positions, receiptHandles = receiver.extractStore(
+                store, **receiveArgs)
+            receiver.commitExtracts(store.annotationIds[positions])
+        else:
+            subjects, receiptHandles = receiver.extractBatch(**receiveArgs)
+            knownSubjects.merge(subjects, classifiers=knownClassifiers)
+            receiver.commitExtracts([
+                annotation.id for subject in subjects.items()
+                for annotation in subject.annotations.items()
+            ])
+        numFailedDeletes += len(receiver.sqsDeleteBatch(receiptHandles))
+        numBatches += 1
+    seconds = time.perf_counter() - startTime
+
+    if columnar:
+        annotationIds = store.annotationIds
+    else:
+        annotationIds = [
+            annotation.id
+            for annotation in knownSubjects.annotations.annotations
+        ]
+    numMerged = len(annotationIds)
+    numUniqueMerged = len(np.unique(annotationIds))
+    return {
+        'columnar': columnar,
+        'dedup': dedup,
+        'numExtracts': len(extracts),
+        'numSent': queue.numSent,
+        'duplicateProb': duplicateProb,
+        'duplicateDelay': duplicateDelay,
+        'numPollers': numPollers,
+        'maxMessages': maxMessages,
+        'numBatches': numBatches,
+        'seconds': seconds,
+        'messagesPerSecond': queue.numSent / seconds if seconds else None,
+        'numMerged': numMerged,
+        'numDuplicatesMerged': numMerged - numUniqueMerged,
+        'numMissing': len(extracts) - numUniqueMerged,
+        'numFailedDeletes': numFailedDeletes
+    }
+
+
+def padExtract(extract, seed):
+    """Add metadata resembling that of real Caesar extracts, which the
+    models do not use.
+    """
+    extract = dict(extract)
+    extract['data'] = {
+        'classification': dict(
+            extract['data']['classification'],
+            metadata={
+                'source': 'api',
+                'session': '{:064x}'.format(seed),
+                'viewport': {
+                    'width': 1440,
+                    'height': 900
+                },
+                'started_at': '2017-11-03T10:21:09.142Z',
+                'finished_at': '2017-11-03T10:21:14.871Z',
+                'user_agent': 'Mozilla/5.0 (X11; Linux x86_64) '
+                'AppleWebKit/537.36 (KHTML, like Gecko) Chrome/62.0 '
+                'Safari/537.36',
+                'utc_offset': '0',
+                'subject_dimensions': [{
+                    'clientWidth': 520,
+                    'clientHeight': 520,
+                    'naturalWidth': 440,
+                    'naturalHeight': 440
+                }] * 4,
+                'subject_selection_state': {
+                    'retired': False,
+                    'selected_at': '2017-11-03T10:20:58.017Z',
+                    'already_seen': False,
+                    'selection_state': 'normal',
+                    'finished_workflow': False,
+                    'user_has_finished_workflow': False
+                },
+                'workflow_version': '41.12',
+                'interventions': {
+                    'opt_in': True,
+                    'messageShown': False
+                }
+            }),
+        'subject_metadata': {
+            '#ra': 34.8121 + seed % 100,
+            '#dec': -4.1124,
+            '#image': 'image_{}.png'.format(seed),
+            '#training_subject': False
+        }
+    }
+    return extract
+
+
+def benchmarkDecoders(numExtracts=None, extractsPath=None, repeats=3, seed=0):
+    """Measure the CPU time per message of verifying and decoding extracts
+    with each decoder configuration.
+
+    Arguments:
+    -- numExtracts - Number of simulated extracts (padded with realistic
+    metadata) to decode, if extractsPath is not given.
+    -- extractsPath - Optional file of recorded extracts (see loadExtracts).
+
+    Returns: Dictionary of results.
+    """
+    if extractsPath is not None:
+        bodies = loadExtracts(extractsPath)
+    else:
+        bodies = [
+            json.dumps(padExtract(extract, position))
+            for position, extract in enumerate(
+                simulateExtracts(numExtracts, 1000, 20, seed))
+        ]
+    digests = [hashlib.md5(body.encode()).hexdigest() for body in bodies]
+    taskName = next(iter(json.loads(bodies[0])['data']['classification'][
+        'annotations'])) if bodies else 'T0'
+
+    decoders = collections.OrderedDict([
+        ('full', ExtractDecoder()),
+        ('full, no integrity check', ExtractDecoder(verifyIntegrity=False)),
+        ('selective', SelectiveExtractDecoder(taskName)),
+        ('selective, no integrity check',
+         SelectiveExtractDecoder(taskName, verifyIntegrity=False)),
+    ])
+    results = collections.OrderedDict()
+    for name, decoder in decoders.items():
+        bestSeconds = None
+        for _ in range(repeats):
+            startTime = time.process_time()
+            for body, digest in zip(bodies, digests):
+                if decoder.verify(body, digest):
+                    decoder(body)
+            seconds = time.process_time() - startTime
+            bestSeconds = seconds if bestSeconds is None else min(
+                bestSeconds, seconds)
+        results[name] = {
+            'seconds': bestSeconds,
+            'microsecondsPerMessage': 1e6 * bestSeconds / max(len(bodies), 1)
+        }
+    return {
+        'jsonBackend': jsonBackend,
+        'numExtracts': len(bodies),
+        'meanBodyBytes': float(np.mean([len(body) for body in bodies]))
+        if bodies else 0.0,
+        'decoders': results
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the retirement pipeline on simulated campaigns.')
+    parser.add_argument(
+        '--sizes',
+        nargs='+',
+        type=float,
+        default=None,
+        help='Approximate numbers of annotations to simulate.')
+    parser.add_argument(
+        '--quick',
+        action='store_true',
+        help='Run only small campaigns ({}).'.format(
+            ', '.join('{:.0e}'.format(size) for size in quickSizes)))
+    parser.add_argument('--classifiers', type=int, default=1000)
+    parser.add_argument('--annotations-per-subject', type=int, default=20)
+    parser.add_argument(
+        '--engine',
+        nargs='+',
+        choices=sorted(pipelines),
+        default=['batch'])
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=10,
+        help='Number of subjects merged per simulated receive.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--no-memory',
+        action='store_true',
+        help='Skip memory profiling, which slows down the stages.')
+    parser.add_argument(
+        '--receiver',
+        action='store_true',
+        help='Benchmark the receiver path against a local queue instead.')
+    parser.add_argument(
+        '--duplicate-prob',
+        type=float,
+        default=0.0,
+        help='Probability that the local queue delivers a message twice.')
+    parser.add_argument(
+        '--duplicate-delay',
+        type=float,
+        default=0.0,
+        help='Maximum delay in seconds before a duplicate becomes visible.')
+    parser.add_argument('--pollers', type=int, default=8)
+    parser.add_argument(
+        '--columnar',
+        action='store_true',
+        help='Receive into an AnnotationStore rather than Subjects.')
+    parser.add_argument(
+        '--dedup',
+        action='store_true',
+        help='Deduplicate across batches with a ClassificationIdIndex.')
+    parser.add_argument(
+        '--decoders',
+        action='store_true',
+        help='Benchmark the per-message cost of the extract decoders.')
+    parser.add_argument(
+        '--extracts',
+        default=None,
+        help='File of recorded extracts for --decoders. By default '
+        'simulated extracts are used.')
+    parser.add_argument('--output', default='benchmark.json')
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes if args.sizes is not None else (
+        quickSizes if args.quick else defaultSizes)
+
+    runs = []
+    if args.decoders:
+        for size in [None] if args.extracts is not None else sizes:
+            result = benchmarkDecoders(
+                numExtracts=size, extractsPath=args.extracts, seed=args.seed)
+            runs.append(result)
+            print('decoders ({jsonBackend}), {numExtracts} extracts of '
+                  '{meanBodyBytes:.0f} bytes: '.format(**result) + ', '.join(
+                      '{} {:.1f}us'.format(name, decoder[
+                          'microsecondsPerMessage'])
+                      for name, decoder in result['decoders'].items()))
+    for size in sizes if args.receiver and not args.decoders else []:
+        result = benchmarkReceiver(
+            size,
+            numClassifiers=args.classifiers,
+            numAnnotationsPerSubject=args.annotations_per_subject,
+            duplicateProb=args.duplicate_prob,
+            duplicateDelay=args.duplicate_delay,
+            numPollers=args.pollers,
+            columnar=args.columnar,
+            dedup=args.dedup,
+            seed=args.seed)
+        runs.append(result)
+        print('receiver {numSent} messages: {messagesPerSecond:.0f}/s, '
+              '{numDuplicatesMerged} duplicates merged, '
+              '{numMissing} missing'.format(**result))
+    for engine in [] if args.receiver or args.decoders else args.engine:
+        for size in sizes:
+            result = benchmark(
+                size,
+                numClassifiers=args.classifiers,
+                numAnnotationsPerSubject=args.annotations_per_subject,
+                engine=engine,
+                seed=args.seed,
+                batchSize=args.batch_size,
+                traceMemory=not args.no_memory)
+            runs.append(result)
+            print('{engine} {numAnnotations} annotations: '.format(**result) +
+                  ', '.join('{} {:.3f}s'.format(name, stage['seconds'])
+                            for name, stage in result['stages'].items()))
+
+    with open(args.output, 'w') as outputFile:
+        json.dump({
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'runs': runs
+        },
+                  outputFile,
+                  indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 import numpy as np
 import scipy.stats as scistats
 
+from AnnotationStore import AnnotationStore
 from Subjects import Subjects
 
 
@@ -8,7 +9,286 @@ class ClassifierSkillPriorBase():
     pass
 
 
+class ClassifierSkillCountsBinary():
+    """Running per-classifier and global count tables holding the sufficient
+    statistics of the binary skill and skill prior models for the annotations
+    in an AnnotationStore.
+
+    update() folds in annotations appended to the store since the previous call
+    and relabel() moves the annotations of subjects whose true (or consensus)
+    label changes between the columns of the tables. The cost of each is
+    proportional to the new or changed data rather than to the full annotation
+    history.
+    """
+
+    # relabel() recounts from scratch once more subjects than this, or than an
+    # eighth of all subjects, change label.
+    maxRelabelSubjects = 1024
+
+    def __init__(self, store):
+        if not isinstance(store, AnnotationStore):
+            raise TypeError(
+                'The store argument must be of type {}. Type {} passed.'.
+                format(type(AnnotationStore), type(store)))
+        self._store = store
+        self._numProcessed = 0
+        # True label codes of each subject as currently reflected in the tables.
+        # The tables start from the labels the store already holds.
+        self._trueLabelCodes = store.trueLabelCodes.astype(np.int16)
+        self._numLabelled = np.zeros((0, 0), dtype=np.int64)
+        self._numCorrect = np.zeros((0, 0), dtype=np.int64)
+        self._numUsed = np.zeros((0, 0), dtype=np.int64)
+        self._version = 0
+        # Store version the tables were last synchronised with.
+        self._syncedVersion = None
+        self.update()
+
+    @property
+    def store(self):
+        return self._store
+
+    @property
+    def version(self):
+        """Counter incremented whenever the tables change.
+        """
+        return self._version
+
+    @property
+    def numLabelled(self):
+        """Number of annotations by each classifier (rows) for subjects with
+        each true label (columns).
+        """
+        return self._numLabelled
+
+    @property
+    def numCorrect(self):
+        """Number of annotations by each classifier (rows) that match the true
+        label (columns) of the annotated subject.
+        """
+        return self._numCorrect
+
+    @property
+    def numUsed(self):
+        """Number of annotations by each classifier (rows) assigning each label
+        (columns).
+        """
+        return self._numUsed
+
+    def tables(self):
+        """Return (numLabelled, numCorrect, numUsed) in the form produced by
+        ClassifierSkillEngineBinary.counts.
+        """
+        return self._numLabelled, self._numCorrect, self._numUsed
+
+    def _grow(self):
+        store = self._store
+        shape = (store.numClassifiers, store.numLabels)
+        for name in ('_numLabelled', '_numCorrect', '_numUsed'):
+            table = getattr(self, name)
+            if table.shape != shape:
+                grown = np.zeros(shape, dtype=table.dtype)
+                grown[:table.shape[0], :table.shape[1]] = table
+                setattr(self, name, grown)
+        if self._trueLabelCodes.size < store.numSubjects:
+            self._trueLabelCodes = np.concatenate([
+                self._trueLabelCodes,
+                np.full(
+                    store.numSubjects - self._trueLabelCodes.size,
+                    store.missingCode,
+                    dtype=self._trueLabelCodes.dtype)
+            ])
+
+    def _accumulate(self, classifierIndex, labelCodes, trueLabelCodes, sign):
+        labelled = (labelCodes != self._store.missingCode) & (
+            trueLabelCodes != self._store.missingCode)
+        cells = (classifierIndex[labelled], trueLabelCodes[labelled])
+        np.add.at(self._numLabelled, cells, sign)
+        np.add.at(self._numCorrect, cells,
+                  sign * (labelCodes[labelled] == trueLabelCodes[labelled]))
+
+    def update(self):
+        """Add the annotations appended to the store since the previous update.
+
+        Returns: Array of the codes of classifiers whose counts changed.
+        """
+        store = self._store
+        self._grow()
+        positions = slice(self._numProcessed, store.numAnnotations)
+        classifierIndex = store.classifierIndex[positions]
+        labelCodes = store.labelCodes[positions].astype(np.int64)
+        valid = labelCodes != store.missingCode
+        np.add.at(self._numUsed, (classifierIndex[valid], labelCodes[valid]),
+                  1)
+        self._accumulate(
+            classifierIndex, labelCodes,
+            self._trueLabelCodes[store.subjectIndex[positions]].astype(
+                np.int64), 1)
+        if positions.start != store.numAnnotations:
+            self._version += 1
+        self._numProcessed = store.numAnnotations
+        return np.unique(classifierIndex)
+
+    def relabel(self, subjectCodes, trueLabelCodes):
+        """Set the true label codes of the given subjects, both in the store and
+        in the tables.
+
+        Returns: Array of the codes of classifiers whose counts changed.
+        """
+        store = self._store
+        self.update()
+        subjectCodes = np.atleast_1d(np.asarray(subjectCodes, dtype=np.int64))
+        trueLabelCodes = np.broadcast_to(
+            np.asarray(trueLabelCodes, dtype=np.int64), subjectCodes.shape)
+        # Only the last assignment to a repeated subject takes effect.
+        _, lastIndices = np.unique(subjectCodes[::-1], return_index=True)
+        keep = subjectCodes.size - 1 - lastIndices
+        subjectCodes, trueLabelCodes = subjectCodes[keep], trueLabelCodes[keep]
+        store.setTrueLabelCodes(trueLabelCodes, subjectCodes)
+
+        previousCodes = self._trueLabelCodes[subjectCodes].astype(np.int64)
+        changed = previousCodes != trueLabelCodes
+        if not changed.any():
+            return np.empty(0, dtype=np.int64)
+        subjectCodes = subjectCodes[changed]
+        previousCodes = previousCodes[changed]
+        trueLabelCodes = trueLabelCodes[changed]
+        self._trueLabelCodes[subjectCodes] = trueLabelCodes
+        self._version += 1
+
+        if subjectCodes.size > max(self.maxRelabelSubjects,
+                                   store.numSubjects // 8):
+            # Looking up each subject's annotations costs more than recounting
+            # once many subjects change (e.g. in the first EM iteration).
+            return self._recount()
+
+        subjectPositions = [
+            store.subjectPositions(code) for code in subjectCodes
+        ]
+        numPositions = [positions.size for positions in subjectPositions]
+        positions = np.concatenate(subjectPositions).astype(np.int64)
+        classifierIndex = store.classifierIndex[positions]
+        labelCodes = store.labelCodes[positions].astype(np.int64)
+        self._accumulate(classifierIndex, labelCodes,
+                         np.repeat(previousCodes, numPositions), -1)
+        self._accumulate(classifierIndex, labelCodes,
+                         np.repeat(trueLabelCodes, numPositions), 1)
+        return np.unique(classifierIndex)
+
+    def _recount(self):
+        """Recompute the labelled and correct tables from the whole store.
+
+        Returns: Array of the codes of classifiers whose counts changed.
+        """
+        store = self._store
+        previous = self._numLabelled, self._numCorrect
+        shape = self._numLabelled.shape
+        positions = slice(0, self._numProcessed)
+        labelCodes = store.labelCodes[positions].astype(np.int64)
+        trueLabelCodes = self._trueLabelCodes[
+            store.subjectIndex[positions]].astype(np.int64)
+        labelled = (labelCodes != store.missingCode) & (
+            trueLabelCodes != store.missingCode)
+        cells = (store.classifierIndex[positions][labelled] * shape[1] +
+                 trueLabelCodes[labelled])
+        self._numLabelled = np.bincount(
+            cells, minlength=shape[0] * shape[1]).reshape(shape)
+        self._numCorrect = np.bincount(
+            cells,
+            weights=labelCodes[labelled] == trueLabelCodes[labelled],
+            minlength=shape[0] * shape[1]).astype(np.int64).reshape(shape)
+        return np.flatnonzero(
+            np.any((self._numLabelled != previous[0]) |
+                   (self._numCorrect != previous[1]),
+                   axis=1))
+
+    def sync(self):
+        """Bring the tables in line with the annotations and true labels
+        currently held by the store. Returns at once if the store is unchanged
+        since the previous call (see AnnotationStore.version).
+
+        Returns: Array of the codes of classifiers whose counts changed.
+        """
+        if self._syncedVersion == self._store.version:
+            return np.empty(0, dtype=np.int64)
+        affected = self.update()
+        storeCodes = self._store.trueLabelCodes
+        changed = np.flatnonzero(self._trueLabelCodes != storeCodes)
+        affected = np.union1d(affected,
+                              self.relabel(changed, storeCodes[changed]))
+        self._syncedVersion = self._store.version
+        return affected
+
+    def check(self, subjects):
+        """Synchronise the tables (see sync) for evaluating models of subjects.
+        Raises ValueError unless subjects is backed by the store of the tables
+        (see Subjects.attachStore), since the tables would not reflect its
+        annotations and true labels otherwise.
+        """
+        if subjects.store is not self._store:
+            raise ValueError(
+                'The subjects argument must be backed by the store of the '
+                'counts. Call subjects.attachStore() and count its store.')
+        self.sync()
+
+    def skillPriors(self, initMode=False, **args):
+        """Evaluate ClassifierSkillPriorBinary from the global totals.
+
+        Returns: Dictionary with labels as keys and computed skill priors as
+        values.
+        """
+        nBeta = args.get('nBeta', 5.0)
+        lowCountProb = args.get('lowCountProb', 0.8)
+
+        labels = self._store.labels
+        observed = np.flatnonzero(self._numUsed.sum(axis=0) > 0)
+        if initMode:
+            return {labels[code]: 1.0 / len(observed) for code in observed}
+        numLabelled = self._numLabelled.sum(axis=0)
+        numCorrect = self._numCorrect.sum(axis=0)
+        return {
+            labels[code]: (nBeta * lowCountProb + numCorrect[code]) /
+            (nBeta + numLabelled[code])
+            for code in observed
+        }
+
+    def skills(self, classifierId, priors, **args):
+        """Evaluate ClassifierSkillModelBinary for a single classifier from its
+        row of the tables.
+
+        Returns: Dictionary with labels as keys and computed skills as values.
+        """
+        nBeta = args.get('nBeta', 5.0)
+
+        store = self._store
+        code = store.classifierIdMap.get(classifierId)
+        if code is None or code >= self._numUsed.shape[0]:
+            return {}
+        return {
+            store.labels[labelCode]:
+            (nBeta * priors[store.labels[labelCode]] +
+             self._numCorrect[code, labelCode]) /
+            (nBeta + self._numLabelled[code, labelCode])
+            for labelCode in np.flatnonzero(self._numUsed[code] > 0)
+        }
+
+
 class ClassifierSkillPriorBinary(ClassifierSkillPriorBase):
+    def __init__(self, counts=None):
+        """Arguments:
+        -- counts - Optional ClassifierSkillCountsBinary. If supplied, the prior
+        is evaluated from its running totals instead of by scanning subjects,
+        which must then be backed by the store of the counts.
+        """
+        self._counts = counts
+
+    @property
+    def counts(self):
+        return self._counts
+
+    @counts.setter
+    def counts(self, counts):
+        self._counts = counts
+
     def __call__(self, subjects, initMode, **args):
         """Evaluate a beta PDF prior for all (should be 2!) labels.
         The prior is evaluated by summing over all classifiers and subjects.
@@ -34,6 +314,10 @@ class ClassifierSkillPriorBinary(ClassifierSkillPriorBase):
                 'The subjects argument must be of type {}. Type {} passed.'.
                 format(type(Subjects), type(subjects)))
 
+        if self.counts is not None:
+            self.counts.check(subjects)
+            return self.counts.skillPriors(initMode=initMode, **args)
+
         nBeta = args.get('nBeta', 5.0)
         lowCountProb = args.get('lowCountProb', 0.8)
         lowCountThreshold = args.get('lowCountThreshold', 2)
@@ -83,6 +367,22 @@ class ClassifierSkillModelBinary(ClassifierSkillPriorBase):
     """For a binary classification task, the probability model is Bernoulli.
     """
 
+    def __init__(self, counts=None):
+        """Arguments:
+        -- counts - Optional ClassifierSkillCountsBinary. If supplied, skills are
+        evaluated from the classifier's row of its tables instead of by scanning
+        subjects, which must then be backed by the store of the counts.
+        """
+        self._counts = counts
+
+    @property
+    def counts(self):
+        return self._counts
+
+    @counts.setter
+    def counts(self, counts):
+        self._counts = counts
+
     def __call__(self, classifier, subjects, priors, initMode, **args):
         """Evaluate a Beta PDF skill model for all (should be 2!) labels
         for a single classfier.
@@ -121,53 +421,52 @@ class ClassifierSkillModelBinary(ClassifierSkillPriorBase):
         if initMode:
             return priors
 
+        if self.counts is not None:
+            self.counts.check(subjects)
+            return self.counts.skills(classifier.id, priors, **args)
+
         nBeta = args.get('nBeta', 5.0)
         lowCountProb = args.get('lowCountProb', 0.8)
         lowCountThreshold = args.get('lowCountThreshold', 2)
 
-        # Get annotations for this classifier
-        classifierAnnotations = np.asarray([
-            annotation for subject in subjects.items()
-            for annotation in subject.annotations.items()
-            if annotation.classifier.id == classifier.id
-        ])
-
-        # print('classifierAnnotations => {}'.format(classifierAnnotations))
-
-        # Get unique labels for this classifier
-        uniqueLabels = np.unique([
-            annotation.label for subject in subjects.items()
-            for annotation in classifierAnnotations
-        ])
-
-        # print('uniqueLabels => {}'.format(uniqueLabels))
-
-        # Get subjects with annotations provided by this classifier
-        classifierSubjects = Subjects([
-            subject for subject in subjects.items() if id(classifier) in [
-                id(annotation.classifier)
+        # Get annotations for this classifier, paired with the true (or
+        # consensus) labels of the subjects they belong to. Prefer the
+        # registry maintained by a Classifiers collection if one is supplied.
+        classifiers = args.get('classifiers')
+        if classifiers is not None and classifiers.isIndexed(
+                classifier.id, subjects):
+            classifierAnnotations = [
+                (subjects.subjects[subjectPosition].trueLabel,
+                 subjects.subjects[subjectPosition].annotations.annotations[
+                     annotationPosition])
+                for subjectPosition, annotationPosition in
+                classifiers.annotationPositions(classifier.id)
+            ]
+        else:
+            classifierAnnotations = [
+                (subject.trueLabel, annotation)
+                for subject in subjects.items()
                 for annotation in subject.annotations.items()
+                if annotation.classifier.id == classifier.id
             ]
-        ])
 
-        skills = {uniqueLabel: None for uniqueLabel in uniqueLabels}
+        # Get unique labels for this classifier
+        uniqueLabels = np.unique(
+            [annotation.label for _, annotation in classifierAnnotations])
 
-        # print('skills => '.format(skills))
+        skills = {uniqueLabel: None for uniqueLabel in uniqueLabels}
 
         #TODO: Does the this formulation assume a value of lowCountThreshold?
         # Subsequent line differs from the prior model since only a single
         # classifier's annotations are considered.
         for trueLabel in uniqueLabels:
-            # Obtain a list of subjects with true (or consensus) label matching trueLabel.
-            subjectsMatchingTrueLabel = classifierSubjects.subset(
-                trueLabel=trueLabel)
             # Obtain the list of all (matching and non-matching) labels for subjects
             # with true (or consensus) label matching trueLabel.
             labelsForSubjectsMatchingTrueLabel = np.asarray([
                 annotation.label
-                for subject in subjectsMatchingTrueLabel.items()
-                for annotation in subject.annotations.items()
-                if annotation.classifier.id == classifier.id
+                for subjectTrueLabel, annotation in classifierAnnotations
+                if subjectTrueLabel is not None
+                and subjectTrueLabel == trueLabel
             ])
             # Count the total number of (matching and non-matching) predictions.
             nLabelsForSubjectsMatchingTrueLabel = labelsForSubjectsMatchingTrueLabel.size
@@ -175,10 +474,281 @@ class ClassifierSkillModelBinary(ClassifierSkillPriorBase):
             nCorrectLabelsForSubjectsMatchingTrueLabel = np.sum(
                 labelsForSubjectsMatchingTrueLabel == trueLabel)
             # Compute the value of the model.
-            # print('priors => {}'.format(priors))
             skills.update({
                 trueLabel: (nBeta * priors[trueLabel] +
                             nCorrectLabelsForSubjectsMatchingTrueLabel) /
                 (nBeta + nLabelsForSubjectsMatchingTrueLabel)
             })
         return skills
+
+
+class ClassifierSkillEngineBinary():
+    """Computes the Beta-smoothed skills of every classifier in a single pass
+    over an AnnotationStore.
+
+    The skill and prior formulae are identical to those implemented by
+    ClassifierSkillModelBinary and ClassifierSkillPriorBinary, but the
+    per-classifier, per-label annotation counts are obtained with grouped
+    counts over (classifier, true label) pairs rather than by rescanning all
+    subjects for each classifier. Annotations with a missing label and
+    subjects without a true (or consensus) label do not contribute.
+    """
+
+    def counts(self, store):
+        """Tabulate the sufficient statistics of the skill model.
+
+        Returns: Tuple of three integer arrays with shape
+        (numClassifiers, numLabels):
+        -- numLabelled - Number of annotations by each classifier for subjects
+        with each true label.
+        -- numCorrect - Number of those annotations that match the true label.
+        -- numUsed - Number of annotations by each classifier assigning each
+        label, irrespective of the true label.
+        """
+        numClassifiers, numLabels = store.numClassifiers, store.numLabels
+        size = numClassifiers * numLabels
+        labelCodes = store.labelCodes
+        valid = labelCodes != store.missingCode
+        classifierIndex = store.classifierIndex[valid]
+        labelCodes = labelCodes[valid]
+        trueLabelCodes = store.trueLabelCodes[store.subjectIndex[valid]]
+
+        numUsed = np.bincount(
+            classifierIndex * numLabels + labelCodes, minlength=size)
+
+        labelled = trueLabelCodes != store.missingCode
+        cells = classifierIndex[labelled] * numLabels + trueLabelCodes[labelled]
+        numLabelled = np.bincount(cells, minlength=size)
+        numCorrect = np.bincount(
+            cells,
+            weights=labelCodes[labelled] == trueLabelCodes[labelled],
+            minlength=size).astype(np.int64)
+
+        return tuple(
+            count.reshape(numClassifiers, numLabels)
+            for count in (numLabelled, numCorrect, numUsed))
+
+    def priors(self, store, initMode=False, counts=None, **args):
+        """Evaluate the skill prior for every label.
+
+        Keyword arguments are as for ClassifierSkillPriorBinary.
+
+        Returns: Array with one entry per label code. Labels that have never
+        been assigned by any classifier are NaN.
+        """
+        nBeta = args.get('nBeta', 5.0)
+        lowCountProb = args.get('lowCountProb', 0.8)
+
+        if counts is None:
+            counts = self.counts(store)
+        numLabelled, numCorrect, numUsed = counts
+        observed = numUsed.sum(axis=0) > 0
+        if initMode:
+            priors = np.full(store.numLabels, 1.0 / max(observed.sum(), 1))
+        else:
+            priors = (nBeta * lowCountProb + numCorrect.sum(axis=0)) / (
+                nBeta + numLabelled.sum(axis=0))
+        return np.where(observed, priors, np.nan)
+
+    def __call__(self, store, priors=None, initMode=False, counts=None,
+                 **args):
+        """Evaluate the skill model for every classifier and label.
+
+        Keyword arguments are as for ClassifierSkillModelBinary.
+
+        Returns: Array with shape (numClassifiers, numLabels). Entries for labels
+        that a classifier has never assigned are NaN.
+        """
+        if not isinstance(store, AnnotationStore):
+            raise TypeError(
+                'The store argument must be of type {}. Type {} passed.'.
+                format(type(AnnotationStore), type(store)))
+
+        nBeta = args.get('nBeta', 5.0)
+
+        counts = counts if counts is not None else self.counts(store)
+        if priors is None:
+            priors = self.priors(store, initMode=initMode, counts=counts, **args)
+        numLabelled, numCorrect, numUsed = counts
+
+        if initMode:
+            skills = np.broadcast_to(priors, numUsed.shape).copy()
+        else:
+            skills = (nBeta * priors + numCorrect) / (nBeta + numLabelled)
+        return np.where(numUsed > 0, skills, np.nan)
+
+    def assign(self, store, skills, priors, classifiers):
+        """Write computed skills and priors back to Classifier instances as
+        dictionaries keyed on label, in the form produced by
+        ClassifierSkillModelBinary.
+        """
+        priorDict = {
+            store.labels[code]: float(prior)
+            for code, prior in enumerate(priors) if not np.isnan(prior)
+        }
+        skillDicts = [{
+            store.labels[code]: float(skill)
+            for code, skill in enumerate(row) if not np.isnan(skill)
+        } for row in skills]
+        for classifier in classifiers:
+            code = store.classifierIdMap.get(classifier.id)
+            classifier.skillPriors = dict(priorDict)
+            classifier.skills = dict(
+                skillDicts[code]) if code is not None else {}
+
+    def computeSkills(self, subjects, classifiers=None, initMode=False,
+                      **args):
+        """Compute the skills of all classifiers that have annotated subjects
+        and write them back to the Classifier instances.
+
+        Arguments:
+        -- subjects - Subjects collection or AnnotationStore.
+        -- classifiers - Optional iterable of Classifier instances to update. By
+        default every Classifier instance referenced by an annotation of
+        subjects is updated.
+
+        Returns: The AnnotationStore used for the computation.
+        """
+        if isinstance(subjects, Subjects):
+            store = AnnotationStore.forSubjects(
+                subjects, labels=[False, True])
+            if classifiers is None:
+                classifiers = {
+                    id(annotation.classifier): annotation.classifier
+                    for subject in subjects.items()
+                    for annotation in subject.annotations.items()
+                }.values()
+        else:
+            store = subjects
+        counts = self.counts(store)
+        priors = self.priors(store, initMode=initMode, counts=counts, **args)
+        skills = self(
+            store, priors=priors, initMode=initMode, counts=counts, **args)
+        if classifiers is not None:
+            self.assign(store, skills, priors, classifiers)
+        return store
+
+
+class ClassifierSkillEngineCategorical():
+    """Computes a Dirichlet-smoothed confusion matrix for every classifier in a
+    single pass over an AnnotationStore.
+
+    Entry [c, t, k] of the skills is the probability that classifier c assigns
+    label code k to a subject whose true label code is t. Row t of each matrix
+    is the classifier's counts of (t, k) pairs smoothed towards the
+    corresponding row of a population prior with weight nDirichlet. The prior
+    is itself the pooled counts of all classifiers, smoothed towards a matrix
+    with lowCountProb on the diagonal and the remaining mass spread evenly over
+    the other labels, mirroring the Beta prior of the binary models.
+
+    Counts are obtained with a single bincount over flattened
+    (classifier, true label, label) cells, so the cost is linear in the number
+    of annotations and independent of the number of labels except for the
+    numClassifiers x K x K output.
+    """
+
+    def counts(self, store):
+        """Tabulate the sufficient statistics of the skill model.
+
+        Returns: Tuple of two integer arrays:
+        -- confusion - Array with shape (numClassifiers, numLabels, numLabels)
+        counting the annotations by each classifier assigning each label
+        (last axis) to subjects with each true label (middle axis).
+        -- numUsed - Array with shape (numClassifiers, numLabels) counting the
+        annotations by each classifier assigning each label, irrespective of
+        the true label.
+        """
+        numClassifiers, numLabels = store.numClassifiers, store.numLabels
+        labelCodes = store.labelCodes
+        valid = labelCodes != store.missingCode
+        classifierIndex = store.classifierIndex[valid]
+        labelCodes = labelCodes[valid].astype(np.int64)
+        trueLabelCodes = store.trueLabelCodes[store.subjectIndex[valid]].astype(
+            np.int64)
+
+        numUsed = np.bincount(
+            classifierIndex * numLabels + labelCodes,
+            minlength=numClassifiers * numLabels)
+
+        labelled = trueLabelCodes != store.missingCode
+        cells = ((classifierIndex[labelled] * numLabels +
+                  trueLabelCodes[labelled]) * numLabels + labelCodes[labelled])
+        confusion = np.bincount(
+            cells, minlength=numClassifiers * numLabels * numLabels)
+
+        return (confusion.reshape(numClassifiers, numLabels, numLabels),
+                numUsed.reshape(numClassifiers, numLabels))
+
+    def baseMatrix(self, numLabels, lowCountProb=0.8):
+        """Return the matrix towards which the population prior is smoothed.
+        """
+        if numLabels < 2:
+            return np.ones((numLabels, numLabels))
+        base = np.full((numLabels, numLabels),
+                       (1.0 - lowCountProb) / (numLabels - 1))
+        np.fill_diagonal(base, lowCountProb)
+        return base
+
+    def priors(self, store, initMode=False, counts=None, **args):
+        """Evaluate the population confusion matrix.
+
+        Keyword arguments:
+        -- nDirichlet - Weight of the prior in pseudo-counts per row (default
+        5).
+        -- lowCountProb - Diagonal of the matrix towards which the prior is
+        smoothed (default 0.8).
+
+        Returns: Array with shape (numLabels, numLabels) whose rows sum to one.
+        In initMode every entry is 1 / numLabels.
+        """
+        nDirichlet = args.get('nDirichlet', 5.0)
+        lowCountProb = args.get('lowCountProb', 0.8)
+
+        numLabels = store.numLabels
+        if initMode:
+            return np.full((numLabels, numLabels), 1.0 / max(numLabels, 1))
+        if counts is None:
+            counts = self.counts(store)
+        pooled = counts[0].sum(axis=0)
+        return (nDirichlet * self.baseMatrix(numLabels, lowCountProb) + pooled
+                ) / (nDirichlet + pooled.sum(axis=1, keepdims=True))
+
+    def __call__(self, store, priors=None, initMode=False, counts=None,
+                 **args):
+        """Evaluate the confusion matrix of every classifier.
+
+        Keyword arguments are as for priors().
+
+        Returns: Array with shape (numClassifiers, numLabels, numLabels) whose
+        rows sum to one. Classifiers without labelled annotations have the
+        prior.
+        """
+        if not isinstance(store, AnnotationStore):
+            raise TypeError(
+                'The store argument must be of type {}. Type {} passed.'.
+                format(type(AnnotationStore), type(store)))
+
+        nDirichlet = args.get('nDirichlet', 5.0)
+
+        counts = counts if counts is not None else self.counts(store)
+        if priors is None:
+            priors = self.priors(store, initMode=initMode, counts=counts, **args)
+        confusion = counts[0]
+        if initMode:
+            return np.broadcast_to(priors, confusion.shape).copy()
+        return (nDirichlet * priors + confusion) / (
+            nDirichlet + confusion.sum(axis=2, keepdims=True))
+
+    def assign(self, store, skills, priors, classifiers):
+        """Write computed skills and priors back to Classifier instances as
+        dictionaries keyed on (trueLabel, label) pairs, as read by
+        AnnotationModelCategorical.
+        """
+        labels = store.labels
+        pairs = [(trueLabel, label) for trueLabel in labels for label in labels]
+        priorDict = dict(zip(pairs, priors.ravel().tolist()))
+        for classifier in classifiers:
+            code = store.classifierIdMap.get(classifier.id)
+            classifier.skillPriors = dict(priorDict)
+            classifier.skills = (dict(zip(pairs, skills[code].ravel().tolist()))
+                                 if code is not None else {})
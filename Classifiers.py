@@ -12,8 +12,11 @@ class Classifier():
         self._skillPriorModel = skillPriorModel
         self._skillPriors = None
         self._skills = None
+        self._skillVersion = 0
+        self._keyPointSkills = None
 
-        # TODO: Should classifier maintain a list of their annotations for computational efficiency?
+        # NOTE: The positions of a classifier's annotations are maintained by the
+        # registry of the Classifiers collection rather than by the classifier.
 
     def __eq__(self, other):
         return self.id == other.id
@@ -37,6 +40,31 @@ class Classifier():
             )
         return self._skills
 
+    @skills.setter
+    def skills(self, skills):
+        if skills != self._skills:
+            self._skillVersion += 1
+        self._skills = skills
+
+    @property
+    def skillVersion(self):
+        """Counter incremented whenever the classifier's skills change.
+        """
+        return self._skillVersion
+
+    @property
+    def keyPointSkills(self):
+        """Dictionary with keys 'precision' and 'variance' describing the
+        classifier's keypoint marks (see KeyPointSkillEngine), or None if they
+        have not been estimated. Kept apart from skills, which belong to the
+        classifier's label skill model.
+        """
+        return self._keyPointSkills
+
+    @keyPointSkills.setter
+    def keyPointSkills(self, keyPointSkills):
+        self._keyPointSkills = keyPointSkills
+
     @property
     def skillPriors(self):
         if self._skillPriors is None:
@@ -45,6 +73,10 @@ class Classifier():
             )
         return self._skillPriors
 
+    @skillPriors.setter
+    def skillPriors(self, skillPriors):
+        self._skillPriors = skillPriors
+
     @property
     def skillModel(self):
         return self._skillModel
@@ -69,8 +101,8 @@ class Classifier():
         if self._skillPriors is None:
             self.computeSkillPriors(subjects, initMode=initMode, **args)
             # print('self.skillPriors => {}'.format(self.skillPriors))
-        self._skills = self.skillModel(self, subjects, self.skillPriors,
-                                       initMode, **args)
+        self.skills = self.skillModel(self, subjects, self.skillPriors,
+                                      initMode, **args)
 
     def getSkill(self, trueLabel):
         if self.skills is None:
@@ -93,12 +125,110 @@ class Classifier():
         ] + ['-**Classifier**-'])
 
 
+class SharedSkillPriors():
+    """Classifier skill priors computed once per model round and shared by
+    every classifier in a Classifiers collection.
+
+    The priors produced by ClassifierSkillPriorBinary do not depend on the
+    classifier, so they are evaluated at most once for each version of the
+    subjects (see Subjects.version) and reused until the subjects' labels or
+    annotations change. EMEngine evaluates them from its running count tables
+    instead (see computeFromCounts). Each recomputation increments version.
+    """
+
+    def __init__(self, skillPriorModel=None):
+        self._skillPriorModel = skillPriorModel
+        self._skillPriors = None
+        self._key = None
+        self._version = 0
+
+    @property
+    def skillPriorModel(self):
+        return self._skillPriorModel
+
+    @skillPriorModel.setter
+    def skillPriorModel(self, skillPriorModel):
+        self._skillPriorModel = skillPriorModel
+        self.invalidate()
+
+    @property
+    def skillPriors(self):
+        if self._skillPriors is None:
+            raise RuntimeError(
+                'Shared skill priors have not been computed. Call compute() first.'
+            )
+        return self._skillPriors
+
+    @property
+    def version(self):
+        return self._version
+
+    def invalidate(self):
+        self._key = None
+
+    def compute(self, subjects, initMode=False, **args):
+        """Return the skill priors for subjects, recomputing them only if the
+        subjects or the prior arguments have changed since the previous call.
+        """
+        key = (id(subjects), subjects.version, initMode,
+               args.get('nBeta', 5.0), args.get('lowCountProb', 0.8))
+        if key != self._key:
+            self._skillPriors = self._skillPriorModel(
+                subjects, initMode=initMode, **args)
+            self._key = key
+            self._version += 1
+        return self._skillPriors
+
+    def computeFromCounts(self, counts, initMode=False, **args):
+        """Return the skill priors given by the totals of counts (a
+        ClassifierSkillCountsBinary), recomputing them only if the tables or
+        the prior arguments have changed since the previous call.
+        """
+        key = (id(counts), counts.version, initMode, args.get('nBeta', 5.0),
+               args.get('lowCountProb', 0.8))
+        if key != self._key:
+            self._skillPriors = counts.skillPriors(initMode=initMode, **args)
+            self._key = key
+            self._version += 1
+        return self._skillPriors
+
+
 class Classifiers():
+    """Collection of classifiers that also maintains a registry mapping each
+    classifier id to the positions of its annotations within a Subjects
+    collection, so that a classifier's annotation history can be retrieved in
+    time proportional to its own annotation count.
+
+    Each classifier id maps to a single Classifier instance (see intern() and
+    canonical()), so skills are computed once per volunteer.
+
+    Positions are (subjectPosition, annotationPosition) pairs indexing
+    subjects.subjects and subject.annotations.annotations respectively. The
+    registry is populated by indexSubjects() and kept up to date by
+    Subjects.merge() when this collection is passed to it. It is stamped with
+    the Subjects collection and the collectionVersion it covers, so any other
+    change to the collection (e.g. Subjects.append, or a merge without this
+    collection) marks it stale and isIndexed() reports False until it is
+    rebuilt. Annotations appended directly to member subjects are not
+    detected; call indexSubjects() after doing so.
+    """
+
     def __init__(self, classifiers=[]):
-        self._classifiers = [
-            classifier for classifier in classifiers
-            if isinstance(classifier, Classifier)
-        ]
+        self._classifiers = []
+        self._classifierLookup = {}
+        self._annotationPositions = {}
+        self._subjectPositions = {}
+        # Subjects collection, and its collectionVersion, the registry covers.
+        self._indexedSubjects = None
+        self._indexedVersion = None
+        self._sharedSkillPriors = SharedSkillPriors()
+        for classifier in classifiers:
+            if isinstance(classifier, Classifier):
+                self._add(classifier)
+
+    @property
+    def sharedSkillPriors(self):
+        return self._sharedSkillPriors
 
     @property
     def classifiers(self):
@@ -106,22 +236,153 @@ class Classifiers():
 
     @classifiers.setter
     def classifiers(self, classifiers):
-        self._classifiers = [
-            classifier for classifier in classifiers
-            if isinstance(classifier, Classifier)
-        ]
+        self._classifiers = []
+        self._classifierLookup = {}
+        self._annotationPositions = {}
+        self._subjectPositions = {}
+        self._indexedSubjects = None
+        self._indexedVersion = None
+        for classifier in classifiers:
+            if isinstance(classifier, Classifier):
+                self._add(classifier)
+
+    def _add(self, classifier):
+        # The lookup refers to the first classifier appended with each id.
+        self._classifierLookup.setdefault(classifier.id, classifier)
+        self._classifiers.append(classifier)
+        self._annotationPositions.setdefault(classifier.id, [])
+        self._subjectPositions.setdefault(classifier.id, {})
 
     def items(self):
         for classifier in self.classifiers:
             yield classifier
 
+    def __len__(self):
+        return len(self._classifiers)
+
     def append(self, classifier):
-        if isinstance(type(classifier), Classifier):
-            self.classifiers.append(classifier)
+        if isinstance(classifier, Classifier):
+            self._add(classifier)
         else:
             raise TypeError(
                 'The classfier argument must an instance of type {}. Type {} passed.'.
                 format(type(Classifier), type(classifier)))
 
+    def __contains__(self, classifierId):
+        return classifierId in self._classifierLookup
+
+    def get(self, classifierId, default=None):
+        """Return the classifier with classifierId, or default if there is no
+        such classifier.
+        """
+        return self._classifierLookup.get(classifierId, default)
+
+    def intern(self, classifierId, **kwargs):
+        """Return the unique classifier with classifierId, creating and
+        appending a new Classifier constructed with kwargs if it is not yet
+        known. Receivers use this so that each volunteer maps to a single
+        shared Classifier across batches.
+        """
+        classifier = self._classifierLookup.get(classifierId)
+        if classifier is None:
+            classifier = Classifier(id=classifierId, **kwargs)
+            self._add(classifier)
+        return classifier
+
+    def canonical(self, classifier):
+        """Return the known classifier that shares the id of classifier,
+        appending classifier itself if its id is not yet known.
+        """
+        knownClassifier = self._classifierLookup.get(classifier.id)
+        if knownClassifier is None:
+            self._add(classifier)
+            knownClassifier = classifier
+        return knownClassifier
+
+    def register(self, classifierId, subjectPosition, annotationPosition):
+        """Record that the annotation at annotationPosition of the subject at
+        subjectPosition was provided by the classifier with classifierId.
+        """
+        self._annotationPositions.setdefault(classifierId, []).append(
+            (subjectPosition, annotationPosition))
+        self._subjectPositions.setdefault(classifierId,
+                                          {})[subjectPosition] = None
+
+    def indexSubjects(self, subjects):
+        """Rebuild the registry from all annotations of subjects.
+        """
+        self.markIndexed(subjects)
+        self._annotationPositions = {
+            classifier.id: []
+            for classifier in self.classifiers
+        }
+        self._subjectPositions = {
+            classifier.id: {}
+            for classifier in self.classifiers
+        }
+        for subjectPosition, subject in enumerate(subjects.items()):
+            for annotationPosition, annotation in enumerate(
+                    subject.annotations.items()):
+                self.register(annotation.classifier.id, subjectPosition,
+                              annotationPosition)
+
+    def markIndexed(self, subjects):
+        """Record that the registry covers the current state of subjects.
+        """
+        self._indexedSubjects = subjects
+        self._indexedVersion = subjects.collectionVersion
+
+    def indexes(self, subjects):
+        """Return True if the registry is up to date with subjects.
+        """
+        return (self._indexedSubjects is subjects
+                and self._indexedVersion == subjects.collectionVersion)
+
+    def isIndexed(self, classifierId, subjects):
+        """Return True if the registry holds the up to date positions of the
+        annotations by the classifier with classifierId within subjects.
+        """
+        return (classifierId in self._annotationPositions
+                and self.indexes(subjects))
+
+    def annotationPositions(self, classifierId):
+        """Return the list of (subjectPosition, annotationPosition) pairs of all
+        annotations by the classifier with classifierId.
+        """
+        return self._annotationPositions.get(classifierId, [])
+
+    def subjectPositions(self, classifierId):
+        """Return the positions of the subjects annotated by the classifier with
+        classifierId.
+        """
+        return list(self._subjectPositions.get(classifierId, {}))
+
+    def computeSkills(self, subjects, initMode=False, cache=None, **args):
+        """Compute the skills of every classifier in the collection, using the
+        registry to look up each classifier's annotations.
+
+        The skill priors are computed once, using the prior model of the first
+        classifier, and shared by all classifiers. They are reused by later
+        calls until the labels or annotations of subjects change.
+
+        Arguments:
+        -- cache - Optional SubjectResultCache. The results of subjects
+        annotated by classifiers whose skills changed are discarded (see
+        SubjectResultCache.invalidateClassifiers).
+        """
+        if len(self.classifiers) == 0:
+            return
+        if self.sharedSkillPriors.skillPriorModel is None:
+            self.sharedSkillPriors.skillPriorModel = self.classifiers[
+                0]._skillPriorModel
+        skillPriors = self.sharedSkillPriors.compute(
+            subjects, initMode=initMode, **args)
+        for classifier in self.items():
+            classifier.skillPriors = skillPriors
+            classifier.computeSkills(
+                subjects, initMode=initMode, classifiers=self, **args)
+        if cache is not None:
+            cache.invalidateClassifiers(self, subjects)
+
     def __str__(self):
         return '\n'.join(str(classifier) for classifier in self.classifiers)
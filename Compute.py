@@ -1,14 +1,20 @@
 # Execute Algorithm 1 from "Lean Crowdsourcing: Combining Humans and Machines in an Online System"
 # (http://openaccess.thecvf.com/content_cvpr_2017/papers/Branson_Lean_Crowdsourcing_Combining_CVPR_2017_paper.pdf)
 
+import os
+
 from AnnotationModels import AnnotationModelBinary, AnnotationPriorBinary
 from Annotations import AnnotationBinary
 from Classifiers import Classifiers
 from ClassifierSkillModels import (ClassifierSkillModelBinary,
                                    ClassifierSkillPriorBinary)
-from IO import CaesarSQSReceiver
-from Risk import LossModelBinary, Risk
-from Subjects import Subjects
+from Deduplication import ClassificationIdIndex
+from EMEngine import EMEngine
+from IO import CaesarSQSReceiver, CaesarTransmitter, SQLiteStorage
+from Pipeline import Pipeline
+from ResultCache import SubjectResultCache
+from Retirement import RetirementEngine
+from Risk import LossModelBinary
 
 # Model and Prior Model instances
 annotationModel = AnnotationModelBinary()
@@ -18,51 +24,139 @@ classifierPriorModel = ClassifierSkillPriorBinary()
 lossModel = LossModelBinary(
     falsePosLoss=1, falseNegLoss=1)  # FP and FN just as bad as each other!
 
-# LOOP OVER:
-knownSubjects = Subjects([])
-for loop in range(5):
-    # 1. Obtain annotations
-    receiver = CaesarSQSReceiver(
-        "https://sqs.us-east-1.amazonaws.com/927935712646/CaesarSpaceWarpsStaging",
-        annotationType=AnnotationBinary)
-    subjects = receiver.extracts(
+# Resume from the subjects, classifications and skills saved by earlier runs.
+storage = SQLiteStorage('retirement.db')
+knownSubjects, knownClassifiers = storage.loadSubjects(
+    skillModel=classifierModel, skillPriorModel=classifierPriorModel)
+
+receiver = CaesarSQSReceiver(
+    "https://sqs.us-east-1.amazonaws.com/927935712646/CaesarSpaceWarpsStaging",
+    annotationType=AnnotationBinary,
+    # Discard extracts redelivered by SQS, including across restarts.
+    dedupIndex=ClassificationIdIndex('classificationIds'))
+emEngine = EMEngine(
+    annotationPriorModel=annotationPriorModel,
+    lossModel=lossModel,
+    maxIterations=20,
+    sharedSkillPriors=knownClassifiers.sharedSkillPriors)
+retirementEngine = RetirementEngine(
+    riskThreshold=0.05, maxAnnotations=50, minAnnotations=3)
+# Per-subject results, kept valid across EM runs as skills change.
+resultCache = SubjectResultCache()
+
+
+# 1. Obtain annotations. Runs in the receiver thread of the pipeline.
+def receive():
+    # knownClassifiers is only touched by the updater thread, so each batch is
+    # built against its own Classifiers. Subjects.merge interns them.
+    receiver.classifiers = Classifiers()
+    return receiver.extractBatch(
+        numPollers=8,
+        maxMessages=1000,
         taskName='T0',
         trueValue=1,
         falseValue=0,
         skillModel=classifierModel,
         skillPriorModel=classifierPriorModel)
-    knownSubjects.merge(subjects)
 
-# 3. Compute classifier skills (based on previously annotated subjects)
-knownClassifiers = Classifiers([
-    annotation.classifier for annotation in knownSubjects.annotations
-])
 
-for classifier in knownClassifiers.items():
-    classifier.computeSkills(knownSubjects)
+transmitter = None
+if 'CAESAR_REDUCTIONS_URL' in os.environ:
+    # Reductions are sent by a background thread, so queueing them does not
+    # block the updater.
+    transmitter = CaesarTransmitter(
+        os.environ['CAESAR_REDUCTIONS_URL'],
+        authToken=os.environ.get('CAESAR_AUTH_TOKEN'))
+
+
+# Update the model with each batch. Runs in the updater thread while the next
+# batch is received.
+def update(batch):
+    subjects, receiptHandles = batch
+    # Drop extracts committed by an earlier batch after this one was received.
+    subjects = receiver.uncommittedSubjects(subjects)
+    if len(subjects) == 0:
+        receiver.sqsDeleteBatch(receiptHandles)
+        return
+    mergeCounts = knownSubjects.merge(subjects, classifiers=knownClassifiers)
+    print('Merged {} new subjects, {} updated'.format(mergeCounts.new,
+                                                      mergeCounts.updated))
+
+    # 3. Compute classifier skills (based on previously annotated subjects)
+    # and best estimate of true labels, iterating until convergence.
+    # knownSubjects keeps its store across batches, so the EM engine's counts
+    # and accumulator only fold in this batch and start from the previous
+    # batch's skills.
+    summary = emEngine.run(
+        knownSubjects, classifiers=knownClassifiers, cache=resultCache)
+    for iteration in emEngine.iterations:
+        print('EM iteration {}: {} label changes, max skill change {:.2e}, '
+              '{:.3f}s'.format(iteration.iteration, iteration.labelChanges,
+                               iteration.maxSkillDelta,
+                               iteration.skillTime + iteration.labelTime))
+
+    # 2. Compute subject difficulties.
+    # TODO: Not currently implemented
+
+    # 4. Compute subject risks. Rows of the summary follow the store's
+    # subject codes.
+    rows = knownSubjects.store.subjectIdMap
+    for subject in subjects.items():
+        print('Subject {}: Risk {}'.format(subject.id,
+                                           summary.risks[rows[subject.id]]))
+
+    # 5. Identify subjects for retirement/redployment etc. Decisions are made
+    # only for subjects whose risk or annotation count changed.
+    decisions = retirementEngine.update(
+        [subject.id for subject in knownSubjects.items()], summary.risks,
+        [len(subject.annotations.annotations)
+         for subject in knownSubjects.items()])
+    for decision in decisions:
+        print('Subject {}: {} ({})'.format(decision.subjectId,
+                                           decision.decision, decision.reason))
 
-# Compute best estimate of true labels
-for subject in knownSubjects.items():
-    subject.computeTrueLabel(
-        annotationModel=annotationModel,
-        annotationPriorModel=annotationPriorModel)
+    # 6. Save results. Only subjects and skills that changed since the last
+    # save are written.
+    storage.saveSubjects(knownSubjects)
+    storage.saveClassifiers(knownClassifiers.items())
+    storage.savePosteriors(knownSubjects.store, summary)
+    # Record this batch's classification ids, and acknowledge its messages,
+    # only once its extracts have been persisted.
+    receiver.commitExtracts([
+        annotation.id for subject in subjects.items()
+        for annotation in subject.annotations.items()
+    ])
+    receiver.sqsDeleteBatch(receiptHandles)
 
-# 2. Compute subject difficulties.
-# TODO: Not currently implemented
+    # 7. Transmit results if required. Only subjects with a new decision are
+    # transmitted.
+    if transmitter is not None:
+        decisionRows = [rows[decision.subjectId] for decision in decisions]
+        transmitter.reductions(
+            [decision.subjectId for decision in decisions],
+            labels=[False, True],
+            posteriors=summary.posteriors[decisionRows],
+            risks=[decision.risk for decision in decisions],
+            decisions=[decision.decision for decision in decisions])
 
-# 4. Compute subject risks
-riskEvaluator = Risk()
-for subject in knownSubjects.items():
-    risk = riskEvaluator(
-        annotations=subject.annotations,
-        subject=subject,
-        lossModel=lossModel,
-        annotationModel=annotationModel,
-        annotationPriorModel=annotationPriorModel)
-    print('Subject {}: Risk {}'.format(subject.id, risk))
 
-# 5. Identify subjects for retirement/redployment etc.
+# The receiver stops polling while two batches await the updater.
+pipeline = Pipeline(
+    receive,
+    update,
+    maxQueueSize=2,
+    sizeOf=lambda batch: len(batch[1]),
+    maxBatches=5,
+    maxIdlePolls=5)
+pipeline.run()
+print(pipeline.receiverStats)
+print(pipeline.updaterStats)
+print('Peak backlog: {} batches'.format(pipeline.maxQueueDepth))
+print('Result cache: {}'.format(resultCache))
 
-# 6. Save results if required.
+if not pipeline.updaterStats.numBatches:
+    print('No extracts were received.')
 
-# 7. Transmit results if required.
+if transmitter is not None:
+    transmitter.close()
+    print('Transmitted reductions: {}'.format(transmitter.stats))
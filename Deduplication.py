@@ -0,0 +1,178 @@
+import collections
+import json
+import os
+import threading
+
+import numpy as np
+
+
+class ClassificationIdIndex():
+    """Persistent set of the classification ids that have already been
+    ingested, used to discard extracts redelivered by SQS across polls.
+
+    Ids are recorded in a bitmap split into fixed-size chunks, each covering a
+    contiguous range of chunkBits ids. Zooniverse classification ids are
+    allocated sequentially, so chunks are dense and a billion ids occupy
+    roughly 125MB on disk. At most maxResidentChunks unmodified chunks are held
+    in memory; the least recently used are evicted, so memory use is bounded
+    while lookups remain O(1) amortized. Modified chunks stay resident until
+    flush() writes them, so nothing recorded reaches disk before the caller
+    has persisted the corresponding extracts.
+
+    If path is None the index is held in memory only.
+    """
+
+    manifestName = 'index.json'
+
+    def __init__(self, path=None, chunkBits=1 << 23, maxResidentChunks=16):
+        """Arguments:
+        -- path - Optional directory in which the index is persisted. An
+        existing index in this directory is reopened.
+        -- chunkBits - Number of ids covered by each chunk. Must be a multiple
+        of 8. Ignored when reopening an existing index.
+        -- maxResidentChunks - Maximum number of chunks held in memory. Ignored
+        if path is None.
+        """
+        self._path = path
+        self._chunkBits = chunkBits
+        self._maxResidentChunks = maxResidentChunks
+        self._chunks = collections.OrderedDict()
+        self._dirtyChunks = set()
+        self._storedChunks = set()
+        self._count = 0
+        self._lock = threading.Lock()
+
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            manifestPath = os.path.join(path, self.manifestName)
+            if os.path.exists(manifestPath):
+                with open(manifestPath) as manifestFile:
+                    manifest = json.load(manifestFile)
+                self._chunkBits = manifest['chunkBits']
+                self._count = manifest['count']
+                self._storedChunks = set(manifest['chunks'])
+
+        if self._chunkBits % 8:
+            raise ValueError(
+                'The chunkBits argument must be a multiple of 8. {} passed.'.
+                format(self._chunkBits))
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, classificationId):
+        return not self.filterNew([classificationId], record=False)[0]
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def chunkBits(self):
+        return self._chunkBits
+
+    @property
+    def numResidentChunks(self):
+        return len(self._chunks)
+
+    def _chunkPath(self, chunkNumber):
+        return os.path.join(self._path, 'chunk-{}.npy'.format(chunkNumber))
+
+    def _chunk(self, chunkNumber, create):
+        """Return the bitmap of chunkNumber, loading it from disk if required.
+        Returns None if the chunk does not exist and create is False.
+        """
+        chunk = self._chunks.get(chunkNumber)
+        if chunk is not None:
+            self._chunks.move_to_end(chunkNumber)
+            return chunk
+        if chunkNumber in self._storedChunks:
+            chunk = np.load(self._chunkPath(chunkNumber))
+        elif create:
+            chunk = np.zeros(self._chunkBits // 8, dtype=np.uint8)
+        else:
+            return None
+        self._evict(len(self._chunks) + 1 - self._maxResidentChunks)
+        self._chunks[chunkNumber] = chunk
+        return chunk
+
+    def _evict(self, excess=None):
+        if self._path is None:
+            return
+        if excess is None:
+            excess = len(self._chunks) - self._maxResidentChunks
+        if excess <= 0:
+            return
+        # Dirty chunks are pending until the next flush(), so only clean
+        # chunks are evicted, least recently used first.
+        clean = [
+            chunkNumber for chunkNumber in self._chunks
+            if chunkNumber not in self._dirtyChunks
+        ]
+        for chunkNumber in clean[:excess]:
+            del self._chunks[chunkNumber]
+
+    def _writeChunk(self, chunkNumber, chunk):
+        np.save(self._chunkPath(chunkNumber), chunk)
+        self._dirtyChunks.discard(chunkNumber)
+        self._storedChunks.add(chunkNumber)
+
+    def filterNew(self, classificationIds, record=True):
+        """Return a boolean array that is True for each id that has not been
+        seen before. Within classificationIds only the first occurrence of an
+        id is considered new.
+
+        Arguments:
+        -- classificationIds - Sequence of integer classification ids.
+        -- record - If True (the default), the new ids are added to the index.
+        """
+        classificationIds = np.asarray(classificationIds, dtype=np.int64)
+        isNew = np.zeros(classificationIds.size, dtype=bool)
+        if not classificationIds.size:
+            return isNew
+        isNew[np.unique(classificationIds, return_index=True)[1]] = True
+
+        chunkNumbers, offsets = np.divmod(classificationIds, self._chunkBits)
+        byteIndices, bitMasks = offsets >> 3, np.left_shift(
+            1, offsets & 7).astype(np.uint8)
+        with self._lock:
+            for chunkNumber in np.unique(chunkNumbers):
+                inChunk = np.flatnonzero(chunkNumbers == chunkNumber)
+                chunk = self._chunk(int(chunkNumber), create=record)
+                if chunk is None:
+                    continue
+                seen = chunk[byteIndices[inChunk]] & bitMasks[inChunk] > 0
+                isNew[inChunk[seen]] = False
+                if record:
+                    added = inChunk[isNew[inChunk]]
+                    np.bitwise_or.at(chunk, byteIndices[added], bitMasks[added])
+                    if added.size:
+                        self._dirtyChunks.add(int(chunkNumber))
+            if record:
+                self._count += int(isNew.sum())
+        return isNew
+
+    def add(self, classificationId):
+        """Record classificationId. Returns True if it had not been seen
+        before.
+        """
+        return bool(self.filterNew([classificationId])[0])
+
+    def flush(self):
+        """Write modified chunks and the manifest to disk. Call this only once
+        the extracts recorded in the index have themselves been persisted.
+        """
+        if self._path is None:
+            return
+        with self._lock:
+            for chunkNumber in list(self._dirtyChunks):
+                self._writeChunk(chunkNumber, self._chunks[chunkNumber])
+            manifestPath = os.path.join(self._path, self.manifestName)
+            with open(manifestPath + '.tmp', 'w') as manifestFile:
+                json.dump({
+                    'chunkBits': self._chunkBits,
+                    'count': self._count,
+                    'chunks': sorted(self._storedChunks)
+                }, manifestFile)
+            os.replace(manifestPath + '.tmp', manifestPath)
+            self._evict()
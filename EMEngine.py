@@ -0,0 +1,354 @@
+import collections
+import time
+
+import numpy as np
+
+from AnnotationStore import AnnotationStore
+from Classifiers import Classifiers, SharedSkillPriors
+from ClassifierSkillModels import (ClassifierSkillCountsBinary,
+                                   ClassifierSkillEngineBinary)
+from Posteriors import LogOddsAccumulatorBinary, PosteriorEngineBinary
+from ResultCache import SubjectResult, SubjectResultCache
+from Subjects import Subjects
+
+EMIteration = collections.namedtuple(
+    'EMIteration',
+    ['iteration', 'skillTime', 'labelTime', 'labelChanges', 'maxSkillDelta'])
+"""Diagnostics recorded for each iteration of EMEngine.
+
+-- iteration - Zero-based iteration number.
+-- skillTime - Wall time in seconds spent computing skills.
+-- labelTime - Wall time in seconds spent computing posteriors and labels.
+-- labelChanges - Number of subjects whose MAP label changed.
+-- maxSkillDelta - Largest absolute change of any classifier skill relative
+to the previous iteration (or the previous round for the first iteration).
+NaN if there is nothing to compare against.
+"""
+
+
+class EMEngine():
+    """Alternates classifier skill estimation and subject true label inference
+    (Algorithm 1 of Branson et al. 2017) until the labels reach a fixed point,
+    the skills stop changing, or an iteration budget is exhausted.
+
+    The engine retains the skills of the previous round. When called again
+    (e.g. after new annotations arrive) labels already held in the store are
+    reused, and subjects without a label are first labelled using the previous
+    round's skills, so that few iterations are typically required.
+
+    With the default binary skill engine the count tables are maintained by a
+    ClassifierSkillCountsBinary, so each iteration updates them only for the
+    subjects whose label changed, and repeated calls on the same store only
+    fold in the annotations appended since. The skill priors are then
+    evaluated from the tables through a SharedSkillPriors, which can be shared
+    with a Classifiers collection.
+
+    With the default binary posterior engine the final posteriors are held by
+    a LogOddsAccumulatorBinary (see accumulator). When the engine is called
+    again on the same store, the warm start labels new subjects from it after
+    folding in only the annotations appended since.
+    """
+
+    def __init__(self,
+                 annotationPriorModel,
+                 lossModel=None,
+                 maxIterations=20,
+                 skillTolerance=1e-4,
+                 skillEngine=None,
+                 posteriorEngine=None,
+                 sharedSkillPriors=None,
+                 **skillArgs):
+        """Arguments:
+        -- annotationPriorModel - Subclass of AnnotationPriorBase giving the prior
+        probability of each true label.
+        -- lossModel - Optional subclass of LossModelBase used to evaluate risks
+        once iteration stops.
+        -- maxIterations - Maximum number of skill/label iterations per call.
+        Must be at least 1.
+        -- skillTolerance - Iteration stops once no skill changes by more than
+        this amount.
+        -- skillEngine - Defaults to ClassifierSkillEngineBinary. Pass
+        ClassifierSkillEngineCategorical, with PosteriorEngineCategorical, for
+        multi-class tasks.
+        -- posteriorEngine - Defaults to PosteriorEngineBinary.
+        -- sharedSkillPriors - Optional SharedSkillPriors through which the
+        binary skill priors are computed, e.g. the sharedSkillPriors of a
+        Classifiers collection. Defaults to a private instance.
+        -- skillArgs - Keyword arguments forwarded to the skill engine (nBeta or
+        nDirichlet, lowCountProb).
+        """
+        self._annotationPriorModel = annotationPriorModel
+        self._lossModel = lossModel
+        self.maxIterations = maxIterations
+        self._skillTolerance = skillTolerance
+        self._skillEngine = (skillEngine if skillEngine is not None else
+                             ClassifierSkillEngineBinary())
+        self._posteriorEngine = (posteriorEngine
+                                 if posteriorEngine is not None else
+                                 PosteriorEngineBinary())
+        self._sharedSkillPriors = (sharedSkillPriors
+                                   if sharedSkillPriors is not None else
+                                   SharedSkillPriors())
+        self._skillArgs = skillArgs
+
+        self._skills = None
+        self._skillPriors = None
+        self._classifierIds = None
+        self._counts = None
+        self._accumulator = None
+        self._summary = None
+        self._iterations = []
+        self._converged = False
+
+    @property
+    def maxIterations(self):
+        return self._maxIterations
+
+    @maxIterations.setter
+    def maxIterations(self, maxIterations):
+        if maxIterations < 1:
+            raise ValueError(
+                'The maxIterations argument must be at least 1. {} passed.'.
+                format(maxIterations))
+        self._maxIterations = maxIterations
+
+    @property
+    def skillTolerance(self):
+        return self._skillTolerance
+
+    @skillTolerance.setter
+    def skillTolerance(self, skillTolerance):
+        self._skillTolerance = skillTolerance
+
+    @property
+    def sharedSkillPriors(self):
+        return self._sharedSkillPriors
+
+    @property
+    def skills(self):
+        return self._skills
+
+    @property
+    def skillPriors(self):
+        return self._skillPriors
+
+    @property
+    def summary(self):
+        return self._summary
+
+    @property
+    def accumulator(self):
+        """LogOddsAccumulatorBinary holding the posteriors of the most recent
+        call under its final skills, or None if the posterior engine is not
+        binary.
+        """
+        return self._accumulator
+
+    @property
+    def iterations(self):
+        """List of EMIteration records for the most recent call.
+        """
+        return self._iterations
+
+    @property
+    def converged(self):
+        return self._converged
+
+    def _previousSkills(self, store):
+        """Align the previous round's skills with the classifiers and labels of
+        store. Classifiers or labels unseen in the previous round are NaN.
+        Returns None before the first round.
+        """
+        if self._skills is None:
+            # The shape of the skills is unknown before the first round.
+            return None
+        # Skills have one label axis (binary models) or two (confusion
+        # matrices).
+        labelAxes = self._skills.ndim - 1
+        skills = np.full((store.numClassifiers, ) +
+                         (store.numLabels, ) * labelAxes, np.nan)
+        numLabels = min(self._skills.shape[1], store.numLabels)
+        labelSlice = (slice(0, numLabels), ) * labelAxes
+        for row, classifierId in enumerate(self._classifierIds):
+            code = store.classifierIdMap.get(classifierId)
+            if code is not None:
+                skills[(code, ) + labelSlice] = self._skills[(row, ) +
+                                                             labelSlice]
+        return skills
+
+    def _skillCounts(self, store):
+        """Return the skill engine's count tables for the current labels of
+        store, updating the running counts incrementally where supported.
+        """
+        if type(self._skillEngine) is not ClassifierSkillEngineBinary:
+            self._counts = None
+            return self._skillEngine.counts(store)
+        if self._counts is None or self._counts.store is not store:
+            self._counts = ClassifierSkillCountsBinary(store)
+        self._counts.sync()
+        return self._counts.tables()
+
+    def _priors(self, store, counts):
+        if self._counts is None:
+            return self._skillEngine.priors(
+                store, counts=counts, **self._skillArgs)
+        priors = self._sharedSkillPriors.computeFromCounts(
+            self._counts, **self._skillArgs)
+        return np.array(
+            [priors.get(label, np.nan) for label in store.labels])
+
+    def __call__(self, store):
+        """Run EM over store, updating its true labels in place.
+
+        Returns: PosteriorSummary for the final labels.
+        """
+        if not isinstance(store, AnnotationStore):
+            raise TypeError(
+                'The store argument must be of type {}. Type {} passed.'.
+                format(type(AnnotationStore), type(store)))
+
+        self._iterations = []
+        self._converged = False
+        labelCodes = store.trueLabelCodes.copy()
+        previousSkills = self._previousSkills(store)
+
+        # Warm start: label new subjects using the previous round's skills.
+        unlabelled = labelCodes == store.missingCode
+        if self._skills is not None and unlabelled.any():
+            if (self._accumulator is not None
+                    and self._accumulator.store is store):
+                # Only the annotations appended since the previous round need
+                # to be accounted for.
+                labelCodes[unlabelled] = self._accumulator.summary(
+                    np.flatnonzero(unlabelled)).mapLabelCodes
+            else:
+                summary = self._posteriorEngine(store, previousSkills,
+                                                self._annotationPriorModel)
+                labelCodes[unlabelled] = summary.mapLabelCodes[unlabelled]
+            store.setTrueLabelCodes(labelCodes)
+
+        for iteration in range(self.maxIterations):
+            startTime = time.perf_counter()
+            counts = self._skillCounts(store)
+            priors = self._priors(store, counts)
+            skills = self._skillEngine(
+                store, priors=priors, counts=counts, **self._skillArgs)
+            skillTime = time.perf_counter() - startTime
+
+            startTime = time.perf_counter()
+            summary = self._posteriorEngine(store, skills,
+                                            self._annotationPriorModel)
+            labelTime = time.perf_counter() - startTime
+
+            labelChanges = int(np.sum(summary.mapLabelCodes != labelCodes))
+            maxSkillDelta = np.nan
+            if previousSkills is not None:
+                with np.errstate(invalid='ignore'):
+                    skillDeltas = np.abs(skills - previousSkills)
+                if np.any(~np.isnan(skillDeltas)):
+                    maxSkillDelta = np.nanmax(skillDeltas)
+            self._iterations.append(
+                EMIteration(iteration, skillTime, labelTime, labelChanges,
+                            maxSkillDelta))
+
+            labelCodes = summary.mapLabelCodes
+            previousSkills = skills
+            store.setTrueLabelCodes(labelCodes)
+            if labelChanges == 0 or maxSkillDelta < self.skillTolerance:
+                self._converged = True
+                break
+
+        self._skills = skills
+        self._skillPriors = priors
+        self._classifierIds = list(store.classifierIds)
+        posteriorEngine = self._posteriorEngine
+        if (type(posteriorEngine) is PosteriorEngineBinary
+                and store.numLabels == 2):
+            if (self._accumulator is None
+                    or self._accumulator.store is not store):
+                self._accumulator = LogOddsAccumulatorBinary(
+                    store,
+                    self._annotationPriorModel,
+                    self._lossModel,
+                    skills=skills,
+                    observedLabelsOnly=posteriorEngine.observedLabelsOnly)
+            else:
+                self._accumulator.setSkills(skills)
+            if self._lossModel is not None:
+                summary = self._accumulator.summary()
+        else:
+            self._accumulator = None
+            if self._lossModel is not None:
+                summary = self._posteriorEngine(
+                    store, skills, self._annotationPriorModel,
+                    self._lossModel)
+        self._summary = summary
+        return summary
+
+    def run(self, subjects, classifiers=None, labels=None, cache=None):
+        """Run EM over a Subjects collection and write the resulting skills,
+        skill priors and true labels back to the Classifier and Subject
+        instances.
+
+        A collection without a backing store is given one (see
+        Subjects.attachStore), and the store is reused by later calls, so that
+        the running counts and the accumulator only fold in the annotations
+        and true labels that changed in between. Only subjects whose true label
+        changed during the call are written back.
+
+        Arguments:
+        -- subjects - Subjects collection.
+        -- classifiers - Optional Classifiers collection or iterable of
+        Classifier instances to update. By default every Classifier instance
+        referenced by an annotation is updated.
+        -- labels - Optional sequence of valid labels. Defaults to
+        [False, True].
+        -- cache - Optional SubjectResultCache. The results of subjects
+        annotated by classifiers whose skills changed are discarded (see
+        SubjectResultCache.invalidateClassifiers), and the results of this run
+        are then cached for every subject. Pass classifiers as a Classifiers
+        collection indexed over subjects to avoid scanning the subjects.
+
+        Returns: PosteriorSummary whose rows follow the order of subjects.
+        """
+        if not isinstance(subjects, Subjects):
+            raise TypeError(
+                'The subjects argument must be of type {}. Type {} passed.'.
+                format(type(Subjects), type(subjects)))
+        if cache is not None and not isinstance(cache, SubjectResultCache):
+            raise TypeError(
+                'The cache argument must be of type {}. Type {} passed.'.
+                format(SubjectResultCache.__name__, type(cache)))
+        labels = labels if labels is not None else [False, True]
+        if subjects.store is None:
+            subjects.attachStore(labels=labels)
+        store = AnnotationStore.forSubjects(subjects, labels=labels)
+        if classifiers is None:
+            classifiers = {
+                id(annotation.classifier): annotation.classifier
+                for subject in subjects.items()
+                for annotation in subject.annotations.items()
+            }.values()
+        if not isinstance(classifiers, Classifiers):
+            classifiers = Classifiers(list(classifiers))
+        previousCodes = store.trueLabelCodes.copy()
+        summary = self(store)
+        self._skillEngine.assign(store, self._skills, self._skillPriors,
+                                 classifiers.items())
+        for code in np.flatnonzero(store.trueLabelCodes != previousCodes):
+            subjects.get(store.subjectIds[code]).trueLabel = summary.mapLabels[
+                code]
+        if cache is not None:
+            # Also records the new skill versions, so that later calls only
+            # discard results for skills changed after this run.
+            cache.invalidateClassifiers(classifiers, subjects)
+            risks = (summary.risks.tolist() if summary.risks is not None else
+                     [None] * len(subjects))
+            for subject, posteriors, mapLabel, risk in zip(
+                    subjects.items(), summary.posteriors.tolist(),
+                    summary.mapLabels, risks):
+                cache.put(
+                    subject,
+                    SubjectResult(dict(zip(store.labels, posteriors)),
+                                  mapLabel, risk))
+        return summary
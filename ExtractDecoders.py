@@ -0,0 +1,142 @@
+# Decoders turning SQS message bodies into the extract dictionaries consumed
+# by CaesarSQSReceiver.parseExtractSummary.
+
+import hashlib
+import json
+import re
+
+# Optional faster JSON backends, used when installed.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+if orjson is not None:
+    jsonBackend = 'orjson'
+    jsonLoads = orjson.loads
+elif ujson is not None:
+    jsonBackend = 'ujson'
+    jsonLoads = ujson.loads
+else:
+    jsonBackend = 'json'
+    jsonLoads = json.loads
+
+
+class ExtractDecoder():
+    """Decodes the full message body, using the fastest available JSON
+    backend.
+    """
+
+    def __init__(self, verifyIntegrity=True):
+        """Arguments:
+        -- verifyIntegrity - If True (the default), bodies whose MD5 digest does
+        not match the MD5OfBody reported by SQS are rejected.
+        """
+        self._verifyIntegrity = verifyIntegrity
+
+    @property
+    def verifyIntegrity(self):
+        return self._verifyIntegrity
+
+    @verifyIntegrity.setter
+    def verifyIntegrity(self, verifyIntegrity):
+        self._verifyIntegrity = verifyIntegrity
+
+    def verify(self, body, md5OfBody):
+        """Return True if body passes the integrity check (or checking is
+        disabled).
+        """
+        if not self.verifyIntegrity:
+            return True
+        return hashlib.md5(body.encode()).hexdigest() == md5OfBody
+
+    def __call__(self, body):
+        return jsonLoads(body)
+
+
+class SelectiveExtractDecoder(ExtractDecoder):
+    """Decodes only the fields used by the models: classification_id,
+    subject_id, user_id and the annotations of one task. The remaining
+    metadata of the extract is never parsed.
+
+    The keys are located in a single regular expression pass over the body,
+    and only the values that follow them are decoded. Within the annotations
+    object only the value of the task is decoded if its key opens the object,
+    as it does when the task is the first of the workflow; the values of the
+    other tasks are then skipped. A task absent from the annotations is
+    detected without decoding them. Otherwise the annotations object is
+    decoded in full, since locating a later key reliably costs as much as
+    decoding the values before it. If a key is absent or occurs more than
+    once (e.g. because nested metadata reuses it), the body is fully decoded
+    instead, so the result always matches that of ExtractDecoder.
+    """
+
+    idKeys = ['classification_id', 'subject_id', 'user_id']
+    keyPattern = re.compile(
+        r'"(classification_id|subject_id|user_id|annotations)"\s*:\s*')
+
+    def __init__(self, taskName, verifyIntegrity=True):
+        """Arguments:
+        -- taskName - Name of the task whose annotations are extracted.
+        """
+        super().__init__(verifyIntegrity)
+        self._taskName = taskName
+        self._taskPattern = re.compile(
+            re.escape(json.dumps(taskName)) + r'\s*:\s*')
+        self._scanValue = json.JSONDecoder().scan_once
+
+    @property
+    def taskName(self):
+        return self._taskName
+
+    def __call__(self, body):
+        # Find the value offsets of all required keys in a single pass.
+        offsets = {}
+        for match in self.keyPattern.finditer(body):
+            key = match.group(1)
+            if key in offsets:
+                return super().__call__(body)
+            offsets[key] = match.end()
+        if len(offsets) < len(self.idKeys) + 1:
+            return super().__call__(body)
+        if not body.startswith('{', offsets['annotations']):
+            return super().__call__(body)
+        try:
+            extract = {
+                key: self._scanValue(body, offsets[key])[0]
+                for key in self.idKeys
+            }
+            annotations = self._taskAnnotations(body, offsets['annotations'])
+        except (StopIteration, ValueError):
+            return super().__call__(body)
+        if not isinstance(annotations, dict):
+            return super().__call__(body)
+        extract['data'] = {
+            'classification': {
+                'annotations': {
+                    task: value
+                    for task, value in annotations.items()
+                    if task == self.taskName
+                }
+            }
+        }
+        return extract
+
+    def _taskAnnotations(self, body, start):
+        """Return a dictionary holding the entry of the task in the annotations
+        object that opens at start.
+        """
+        match = self._taskPattern.search(body, start)
+        if match is None:
+            # Nothing after the annotations object opens names the task.
+            return {}
+        if (not body[start + 1:match.start()].strip()
+                and self._taskPattern.search(body, match.end()) is None):
+            # The task is the first key of the object, and the only one.
+            return {self.taskName: self._scanValue(body, match.end())[0]}
+        return self._scanValue(body, start)[0]
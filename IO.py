@@ -1,17 +1,28 @@
 # I/O functionality for Bayesian Retrement code
 
-import hashlib
+import concurrent.futures
+import itertools
 import json
 import collections
+import http.client
+import http.server
+import os
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
 
 import numpy as np
 import scipy.stats as scistats
 
-import boto3
 from Annotations import AnnotationBinary, Annotations
+from AnnotationStore import AnnotationStore
 from Classifiers import Classifier, Classifiers
 from ClassifierSkillModels import (ClassifierSkillModelBinary,
                                    ClassifierSkillPriorBinary)
+from ExtractDecoders import ExtractDecoder
+from Queues import SQSQueueBackend
 from Subjects import Subject, Subjects
 
 
@@ -53,12 +64,62 @@ class UniqueSQSMessage(object):
         return hash(self.classification_id)
 
 
+ReceivedMessages = collections.namedtuple(
+    'ReceivedMessages', ['messages', 'receiptHandles', 'numReceived'])
+"""Result of CaesarSQSReceiver.sqsReceiveConcurrent.
+
+-- messages - List of parsed message bodies, deduplicated on
+classification_id (see CaesarSQSReceiver.uniqueMessages).
+-- receiptHandles - Receipt handles of every received message that passed
+the integrity check, including duplicates. These should be passed to
+sqsDeleteBatch once the extracts have been merged.
+-- numReceived - Total number of messages received.
+"""
+
+ExtractRow = collections.namedtuple(
+    'ExtractRow',
+    ['classificationId', 'subjectCode', 'classifierCode', 'labelCode'])
+"""Compact representation of one extract, encoded against an
+AnnotationStore. See CaesarSQSReceiver.extractRows.
+"""
+
+
 class CaesarSQSReceiver(Receiver):
-    def __init__(self, queueUrl, annotationType=None):
+    # Maximum number of entries SQS accepts in one receive or delete batch.
+    sqsMaxBatchSize = 10
+
+    def __init__(self,
+                 queueUrl,
+                 annotationType=None,
+                 classifiers=None,
+                 sqsClient=None,
+                 dedupIndex=None,
+                 decoder=None):
+        """Arguments:
+        -- queueUrl - URL of the queue to receive extracts from.
+        -- annotationType - Annotation class used to wrap extracted labels.
+        -- classifiers - Optional Classifiers collection into which classifiers
+        are interned.
+        -- sqsClient - Optional QueueBackend (or boto3 SQS client). Defaults to
+        an SQSQueueBackend. Pass a LocalQueueBackend to run offline.
+        -- dedupIndex - Optional ClassificationIdIndex. If supplied, extracts
+        whose classification id has been received before, in any earlier batch
+        or run, are discarded. Otherwise duplicates are only removed within a
+        batch.
+        -- decoder - Optional ExtractDecoder used to verify and decode message
+        bodies. Defaults to a full decoder that verifies MD5 digests. A
+        SelectiveExtractDecoder decodes only the fields the models use.
+        """
         # Create immutable SQS client
-        self._sqs = boto3.client('sqs')
+        self._sqs = sqsClient if sqsClient is not None else SQSQueueBackend()
         self._queueUrl = queueUrl
         self._annotationType = annotationType
+        # Classifiers are interned so that each user id maps to exactly one
+        # Classifier across batches.
+        self._classifiers = (classifiers
+                             if classifiers is not None else Classifiers())
+        self._dedupIndex = dedupIndex
+        self._decoder = decoder if decoder is not None else ExtractDecoder()
 
     @property
     def sqs(self):
@@ -80,6 +141,30 @@ class CaesarSQSReceiver(Receiver):
     def annotationType(self, taskNames):
         self._annotationType = annotationType
 
+    @property
+    def classifiers(self):
+        return self._classifiers
+
+    @classifiers.setter
+    def classifiers(self, classifiers):
+        self._classifiers = classifiers
+
+    @property
+    def dedupIndex(self):
+        return self._dedupIndex
+
+    @dedupIndex.setter
+    def dedupIndex(self, dedupIndex):
+        self._dedupIndex = dedupIndex
+
+    @property
+    def decoder(self):
+        return self._decoder
+
+    @decoder.setter
+    def decoder(self, decoder):
+        self._decoder = decoder
+
     def extracts(self, **extraArgs):
         """ Receive new annotations and return a new Subjects list
         Subjects implicitly encapsulate a list of annotations and annotations
@@ -93,12 +178,39 @@ class CaesarSQSReceiver(Receiver):
 
         Arguments:
         -- extraArgs - Arguments forwarded to the conrete AnnotationBase
-        subclass's constructor and the Classifier constructor.
+        subclass's constructor and the Classifier constructor. Classifiers are
+        interned in self.classifiers, so the Classifier constructor is only
+        invoked for previously unseen user ids.
         """
         uniqueMessages = self.sqsReceive()[0]
+        return self.subjectsFromMessages(uniqueMessages, **extraArgs)
+
+    def extractBatch(self,
+                     numPollers=4,
+                     maxMessages=1000,
+                     waitTimeSeconds=1,
+                     **extraArgs):
+        """High-throughput variant of extracts() that receives using several
+        concurrent pollers (see sqsReceiveConcurrent).
+
+        Received messages are not deleted from the queue. Pass the returned
+        receipt handles to sqsDeleteBatch once the subjects have been merged, so
+        that messages are only acknowledged after they are safely stored.
+
+        Returns: Tuple of (Subjects, list of receipt handles).
+        """
+        received = self.sqsReceiveConcurrent(
+            numPollers=numPollers,
+            maxMessages=maxMessages,
+            waitTimeSeconds=waitTimeSeconds)
+        return self.subjectsFromMessages(received.messages,
+                                         **extraArgs), received.receiptHandles
+
+    def subjectsFromMessages(self, messages, **extraArgs):
+        """Build a Subjects list holding one annotation per parsed message.
+        """
         extractSummaries = [
-            self.parseExtractSummary(uniqueMessage)
-            for uniqueMessage in uniqueMessages
+            self.parseExtractSummary(message) for message in messages
         ]
         # NOTE: Current design passes extracted annotations data to the
         # AnnotationBase subclass's constructor for processing.
@@ -108,7 +220,8 @@ class CaesarSQSReceiver(Receiver):
                 annotations=Annotations([
                     self.annotationType(
                         id=classificationId,
-                        classifier=Classifier(id=classifierId, **extraArgs),
+                        classifier=self.classifiers.intern(
+                            classifierId, **extraArgs),
                         zooniverseAnnotations=zooniverseAnnotations,
                         **extraArgs)
                 ])) for classificationId, subjectId, classifierId,
@@ -117,47 +230,252 @@ class CaesarSQSReceiver(Receiver):
 
         return subjects
 
-    def sqsReceive(self):
+    def extractStore(self,
+                     store,
+                     numPollers=4,
+                     maxMessages=1000,
+                     waitTimeSeconds=1,
+                     **labelArgs):
+        """Columnar variant of extractBatch(). Received extracts are appended
+        directly to store without creating Subject, Annotation or Classifier
+        instances.
+
+        Received messages are not deleted from the queue. Pass the returned
+        receipt handles to sqsDeleteBatch once the store has been persisted.
+
+        Arguments:
+        -- store - AnnotationStore to append to.
+        -- labelArgs - Arguments forwarded to the labelFromExtract method of
+        the annotationType (e.g. taskName, trueValue, falseValue).
+
+        Returns: Tuple of (slice of the store positions appended, list of
+        receipt handles).
+        """
+        received = self.sqsReceiveConcurrent(
+            numPollers=numPollers,
+            maxMessages=maxMessages,
+            waitTimeSeconds=waitTimeSeconds)
+        positions = self.appendRows(
+            store, self.extractRows(received.messages, store, **labelArgs))
+        return positions, received.receiptHandles
+
+    def extractRows(self, messages, store, **labelArgs):
+        """Generator yielding one ExtractRow per parsed message, with the
+        subject, classifier and label encoded against store. Previously unseen
+        subject and classifier ids are registered with store.
+        """
+        labelFromExtract = self.annotationType.labelFromExtract
+        for message in messages:
+            summary = self.parseExtractSummary(message)
+            classificationId, subjectId, classifierId, annotations = summary
+            yield ExtractRow(
+                int(classificationId),
+                store.subjectCode(subjectId),
+                store.classifierCode(classifierId),
+                store.labelCode(labelFromExtract(annotations, **labelArgs)))
+
+    def appendRows(self, store, rows, chunkSize=4096):
+        """Consume an iterable of ExtractRow tuples, appending them to store in
+        chunks of at most chunkSize rows.
+
+        Returns: Slice of the store positions appended.
+        """
+        if not isinstance(store, AnnotationStore):
+            raise TypeError(
+                'The store argument must be of type {}. Type {} passed.'.
+                format(type(AnnotationStore), type(store)))
+        start = store.numAnnotations
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, chunkSize))
+            if not chunk:
+                break
+            store.extendEncoded(*np.array(chunk, dtype=np.int64).T)
+        return slice(start, store.numAnnotations)
+
+    def sqsReceiveMessages(self,
+                           maxNumberOfMessages=10,
+                           waitTimeSeconds=20,
+                           visibilityTimeout=40):
+        """Perform a single receive_message call.
+
+        Returns: List of (receiptHandle, decoded message body) tuples for the
+        messages whose body passed the decoder's integrity check. Messages that
+        fail the check are not returned and so will be redelivered.
+        """
         response = self.sqs.receive_message(
             QueueUrl=self.queueUrl,
             AttributeNames=['SentTimestamp', 'MessageDeduplicationId'],
-            MaxNumberOfMessages=10,  # Allow up to 10 messages to be received
+            MaxNumberOfMessages=maxNumberOfMessages,
             MessageAttributeNames=['All'],
-            VisibilityTimeout=
-            40,  # Allows the message to be retrieved again after 40s
-            WaitTimeSeconds=
-            20  # Wait at most 20 seconds for an extract enables long polling
-        )
+            # Allows the message to be retrieved again after visibilityTimeout
+            VisibilityTimeout=visibilityTimeout,
+            # Wait at most waitTimeSeconds for an extract enables long polling
+            WaitTimeSeconds=waitTimeSeconds)
+
+        received = []
+        # Loop over messages
+        for message in response.get('Messages', []):
+            # extract message body expect a JSON formatted string
+            # any information required to deduplicate the message should be
+            # present in the message body
+            messageBody = message['Body']
+            # verify message body integrity
+            if self.decoder.verify(messageBody, message['MD5OfBody']):
+                received.append((message['ReceiptHandle'],
+                                 self.decoder(messageBody)))
+        return received
 
+    def sqsReceive(self):
         receivedMessageIds = []
         receivedMessages = []
-        uniqueMessages = set()
 
-        # Loop over messages
-        if 'Messages' in response:
-            for message in response['Messages']:
-                # extract message body expect a JSON formatted string
-                # any information required to deduplicate the message should be
-                # present in the message body
-                messageBody = message['Body']
-                # verify message body integrity
-                messageBodyMd5 = hashlib.md5(messageBody.encode()).hexdigest()
-
-                if messageBodyMd5 == message['MD5OfBody']:
-                    receivedMessages.append(json.loads(messageBody))
-                    receivedMessageIds.append(
-                        receivedMessages[-1]['classification_id'])
-                    uniqueMessages.add(UniqueSQSMessage(receivedMessages[-1]))
-                    # the message has been retrieved successfully - delete it.
-                    # self.sqsDelete(message['ReceiptHandle'])
-
-        return [uniqueMessage.message for uniqueMessage in uniqueMessages
-                ], receivedMessages, receivedMessageIds
+        for _, message in self.sqsReceiveMessages(
+                maxNumberOfMessages=self.sqsMaxBatchSize):
+            receivedMessages.append(message)
+            receivedMessageIds.append(receivedMessages[-1]['classification_id'])
+            # NOTE: Messages are not deleted here. Use sqsDeleteBatch once the
+            # extracts have been merged.
+
+        return self.uniqueMessages(
+            receivedMessages), receivedMessages, receivedMessageIds
+
+    def uniqueMessages(self, messages):
+        """Return the messages whose classification id is new, i.e. the first
+        occurrence of each id in messages that is not already recorded in
+        dedupIndex. The ids are not recorded here; pass them to
+        commitExtracts() once their extracts have been persisted.
+        """
+        if self.dedupIndex is None:
+            uniqueMessages = {}
+            for message in messages:
+                uniqueMessages.setdefault(UniqueSQSMessage(message), message)
+            return list(uniqueMessages.values())
+        isNew = self.dedupIndex.filterNew(
+            [int(message['classification_id']) for message in messages],
+            record=False)
+        return [message for message, new in zip(messages, isNew) if new]
+
+    def uncommittedSubjects(self, subjects):
+        """Return a Subjects collection holding only the annotations of
+        subjects whose classification id is not yet recorded in dedupIndex.
+
+        Batches received ahead of the one being merged are checked against
+        dedupIndex before the earlier batch is committed, so an extract
+        redelivered across the two passes uniqueMessages in both. Call this
+        just before merging a batch to discard it.
+        """
+        if self.dedupIndex is None:
+            return subjects
+        annotations = [(subject, annotation)
+                       for subject in subjects.items()
+                       for annotation in subject.annotations.items()]
+        isNew = self.dedupIndex.filterNew(
+            [int(annotation.id) for _, annotation in annotations],
+            record=False)
+        newAnnotations = collections.OrderedDict()
+        for (subject, annotation), new in zip(annotations, isNew):
+            if new:
+                newAnnotations.setdefault(subject, []).append(annotation)
+        return Subjects([
+            Subject(
+                id=subject.id,
+                annotations=Annotations(subjectAnnotations),
+                trueLabel=subject.trueLabel,
+                difficulty=subject.difficulty)
+            for subject, subjectAnnotations in newAnnotations.items()
+        ])
+
+    def commitExtracts(self, classificationIds):
+        """Record classificationIds in dedupIndex and flush it to disk. Call
+        this only once the extracts of a batch have been persisted, and before
+        their messages are deleted with sqsDeleteBatch, so that a crash in
+        between causes redelivery rather than loss.
+        """
+        if self.dedupIndex is None:
+            return
+        self.dedupIndex.filterNew(
+            [int(classificationId) for classificationId in classificationIds])
+        self.dedupIndex.flush()
+
+    def sqsReceiveConcurrent(self,
+                             numPollers=4,
+                             maxMessages=1000,
+                             waitTimeSeconds=1,
+                             visibilityTimeout=40):
+        """Receive messages using numPollers concurrent pollers and aggregate
+        them into a single large batch.
+
+        Each poller repeatedly requests up to 10 messages until maxMessages
+        messages have been aggregated in total or a request returns no messages
+        (i.e. the queue has been drained). visibilityTimeout should exceed the
+        time taken to merge the batch so that messages are not redelivered
+        before they are acknowledged.
+
+        Returns: ReceivedMessages
+        """
+        lock = threading.Lock()
+        received = []
+
+        def poll():
+            while True:
+                with lock:
+                    if len(received) >= maxMessages:
+                        return
+                messages = self.sqsReceiveMessages(
+                    maxNumberOfMessages=self.sqsMaxBatchSize,
+                    waitTimeSeconds=waitTimeSeconds,
+                    visibilityTimeout=visibilityTimeout)
+                if not messages:
+                    return
+                with lock:
+                    received.extend(messages)
+
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=numPollers) as pool:
+            for future in [pool.submit(poll) for _ in range(numPollers)]:
+                future.result()
+
+        return ReceivedMessages(
+            self.uniqueMessages([message for _, message in received]),
+            [receiptHandle for receiptHandle, _ in received], len(received))
 
     def sqsDelete(self, receiptHandle):
         self.sqs.delete_message(
             QueueUrl=self.queueUrl, ReceiptHandle=receiptHandle)
 
+    def sqsDeleteBatch(self, receiptHandles, numWorkers=4):
+        """Acknowledge messages with delete_message_batch calls of up to 10
+        entries, issued concurrently by numWorkers threads.
+
+        Returns: List of the receipt handles that could not be deleted.
+        """
+        receiptHandles = list(receiptHandles)
+        chunks = [
+            receiptHandles[start:start + self.sqsMaxBatchSize]
+            for start in range(0, len(receiptHandles), self.sqsMaxBatchSize)
+        ]
+
+        def delete(chunk):
+            response = self.sqs.delete_message_batch(
+                QueueUrl=self.queueUrl,
+                Entries=[{
+                    'Id': str(index),
+                    'ReceiptHandle': receiptHandle
+                } for index, receiptHandle in enumerate(chunk)])
+            return [
+                chunk[int(failure['Id'])]
+                for failure in response.get('Failed', [])
+            ]
+
+        failed = []
+        if chunks:
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=numWorkers) as pool:
+                for chunkFailures in pool.map(delete, chunks):
+                    failed.extend(chunkFailures)
+        return failed
+
     def parseExtractSummary(self, fullExtract):
         # Parse an extract in JSON format and instantiate a new Annotation.
         classificationId = fullExtract['classification_id']
@@ -168,18 +486,331 @@ class CaesarSQSReceiver(Receiver):
         return classificationId, subjectId, classifierId, annotations
 
 
+TransmitterStats = collections.namedtuple(
+    'TransmitterStats',
+    ['numQueued', 'numCoalesced', 'numSent', 'numFailed', 'numRetries'])
+"""Counters reported by CaesarTransmitter.stats.
+
+-- numQueued - Number of reductions queued.
+-- numCoalesced - Number of queued reductions superseded by a later update for
+the same subject before being sent.
+-- numSent - Number of reductions sent successfully.
+-- numFailed - Number of reductions abandoned after maxRetries attempts.
+-- numRetries - Number of failed attempts that were retried.
+"""
+
+
 class CaesarTransmitter(Transmitter):
-    def __init__(self):
-        pass
+    """Sends per-subject reductions to Caesar from a background thread.
+
+    Queuing a reduction never blocks on the network. Reductions are held in a
+    pending dictionary keyed on subject id, so a subject updated repeatedly
+    before its reduction is sent is sent only once, with its latest data. The
+    worker thread drains up to batchSize pending reductions whenever batchSize
+    are pending or flushInterval seconds have passed, and posts them using at
+    most maxConcurrency concurrent requests. Requests that fail with a network
+    or HTTP error are retried with exponential backoff; a reduction that
+    raises any other error (e.g. data that is not JSON serializable) is
+    abandoned at once.
+
+    Each reduction is posted as {"reduction": {"subject_id": ..., "data":
+    {...}}}, the body expected by Caesar's external reducer endpoint. The
+    endpoint accepts a single reduction per request, so reductions are posted
+    one per request; batches only bound how many are drained and in flight at
+    once.
+    """
+
+    def __init__(self,
+                 url,
+                 authToken=None,
+                 batchSize=100,
+                 maxConcurrency=4,
+                 flushInterval=1.0,
+                 maxRetries=5,
+                 backoffBase=0.5,
+                 timeout=10,
+                 sender=None):
+        """Arguments:
+        -- url - Reductions endpoint, e.g.
+        https://caesar.zooniverse.org/workflows/<id>/reducers/<key>/reductions
+        -- authToken - Optional bearer token.
+        -- batchSize - Maximum number of reductions drained per batch.
+        -- maxConcurrency - Maximum number of concurrent requests.
+        -- flushInterval - Maximum time in seconds a reduction waits for a
+        batch to fill.
+        -- maxRetries - Number of attempts per reduction before it is
+        abandoned.
+        -- backoffBase - Delay in seconds before the first retry. The delay
+        doubles with each further attempt.
+        -- timeout - Request timeout in seconds.
+        -- sender - Optional callable taking a reduction payload dictionary,
+        used instead of posting to url (e.g. for testing).
+        """
+        super().__init__()
+        self._url = url
+        self._authToken = authToken
+        self._batchSize = batchSize
+        self._flushInterval = flushInterval
+        self._maxRetries = maxRetries
+        self._backoffBase = backoffBase
+        self._timeout = timeout
+        self._sender = sender if sender is not None else self.post
+
+        self._condition = threading.Condition()
+        self._pending = collections.OrderedDict()
+        self._numInFlight = 0
+        self._closed = False
+        self._counts = dict.fromkeys(TransmitterStats._fields, 0)
+        self._failedSubjectIds = []
+
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=maxConcurrency)
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
 
-    def reductions(self):
-        # Transmit appropriately formatted reduction data to Caesar.
-        pass
+    @property
+    def url(self):
+        return self._url
+
+    @property
+    def stats(self):
+        with self._condition:
+            return TransmitterStats(**self._counts)
+
+    @property
+    def numPending(self):
+        with self._condition:
+            return len(self._pending) + self._numInFlight
+
+    @property
+    def failedSubjectIds(self):
+        """Ids of the subjects whose reductions were abandoned.
+        """
+        with self._condition:
+            return list(self._failedSubjectIds)
+
+    def queueReduction(self, subjectId, **data):
+        """Queue a reduction for subjectId, replacing any reduction for the same
+        subject that has not been sent yet. data must be JSON serializable.
+        """
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('The transmitter has been closed.')
+            if subjectId in self._pending:
+                self._counts['numCoalesced'] += 1
+                del self._pending[subjectId]
+            self._pending[subjectId] = data
+            self._counts['numQueued'] += 1
+            if len(self._pending) >= self._batchSize:
+                self._condition.notify_all()
+
+    def reductions(self,
+                   subjectIds,
+                   labels=None,
+                   posteriors=None,
+                   risks=None,
+                   decisions=None):
+        """Queue reductions for several subjects at once.
+
+        Arguments:
+        -- subjectIds - Sequence of subject ids.
+        -- labels - Optional sequence of label values labelling the columns of
+        posteriors.
+        -- posteriors - Optional array with shape (numSubjects, numLabels).
+        -- risks - Optional sequence of risks.
+        -- decisions - Optional sequence of retirement decisions.
+        """
+        for row, subjectId in enumerate(subjectIds):
+            data = {}
+            if posteriors is not None:
+                data['posteriors'] = {
+                    str(sqlValue(label)): float(posterior)
+                    for label, posterior in zip(labels, posteriors[row])
+                }
+            if risks is not None:
+                data['risk'] = float(risks[row])
+            if decisions is not None:
+                data['decision'] = sqlValue(decisions[row])
+            self.queueReduction(sqlValue(subjectId), **data)
+
+    def post(self, payload):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(payload).encode(),
+            headers={
+                'Content-Type': 'application/json',
+                'Accept': 'application/json'
+            },
+            method='POST')
+        if self._authToken is not None:
+            request.add_header('Authorization',
+                               'Bearer {}'.format(self._authToken))
+        with urllib.request.urlopen(request, timeout=self._timeout) as response:
+            response.read()
+
+    def _send(self, subjectId, data):
+        payload = {'reduction': {'subject_id': subjectId, 'data': data}}
+        for attempt in range(self._maxRetries):
+            try:
+                self._sender(payload)
+            except (OSError, urllib.error.URLError,
+                    http.client.HTTPException):
+                if attempt + 1 == self._maxRetries:
+                    break
+                with self._condition:
+                    self._counts['numRetries'] += 1
+                time.sleep(self._backoffBase * 2**attempt)
+            except Exception:
+                # Not transient, so retrying cannot help.
+                break
+            else:
+                return True
+        return False
+
+    def _sendBatch(self, batch):
+        results = []
+        try:
+            results = list(
+                self._pool.map(lambda reduction: self._send(*reduction),
+                               batch))
+        finally:
+            # Reductions without a result count as failed, so that flush()
+            # and close() never wait on a batch that raised.
+            with self._condition:
+                for index, (subjectId, _) in enumerate(batch):
+                    if index < len(results) and results[index]:
+                        self._counts['numSent'] += 1
+                    else:
+                        self._counts['numFailed'] += 1
+                        self._failedSubjectIds.append(subjectId)
+                self._numInFlight -= len(batch)
+                self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if len(self._pending) < self._batchSize and not self._closed:
+                    self._condition.wait(self._flushInterval)
+                if not self._pending:
+                    if self._closed:
+                        return
+                    continue
+                batch = []
+                while self._pending and len(batch) < self._batchSize:
+                    batch.append(self._pending.popitem(last=False))
+                self._numInFlight += len(batch)
+            try:
+                self._sendBatch(batch)
+            except Exception:
+                # The batch has been counted as failed; keep draining.
+                pass
+
+    def flush(self, timeout=None):
+        """Block until every queued reduction has been sent or abandoned.
+
+        Returns: True if the queue drained within timeout seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            self._condition.notify_all()
+            while self._pending or self._numInFlight:
+                remaining = (None if deadline is None else
+                             deadline - time.monotonic())
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """Send the remaining reductions and stop the worker thread.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._worker.join(timeout)
+        self._pool.shutdown(wait=False)
+
+
+class LocalCaesarServer():
+    """Local HTTP stub of the Caesar reductions endpoint for testing
+    CaesarTransmitter. Received reductions are recorded in order. Requests can
+    be failed at random (with status 503) or delayed to emulate an unreliable
+    network.
+    """
+
+    def __init__(self, failureProb=0.0, latency=0.0, seed=None):
+        self._failureProb = failureProb
+        self._latency = latency
+        self._random = np.random.RandomState(seed)
+        self._lock = threading.Lock()
+        self._received = []
+        self._numRequests = 0
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                time.sleep(stub._latency)
+                with stub._lock:
+                    stub._numRequests += 1
+                    failed = stub._random.uniform() < stub._failureProb
+                    if not failed:
+                        stub._received.append(json.loads(body)['reduction'])
+                self.send_response(503 if failed else 204)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                       Handler)
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def url(self):
+        return 'http://{}:{}/reductions'.format(*self._server.server_address)
+
+    @property
+    def received(self):
+        with self._lock:
+            return list(self._received)
+
+    @property
+    def numRequests(self):
+        with self._lock:
+            return self._numRequests
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+SimulatedColumns = collections.namedtuple(
+    'SimulatedColumns', [
+        'annotationIds', 'subjectIndex', 'classifierIndex', 'labels',
+        'trueLabels'
+    ])
+"""Columnar output of BinarySimulationReceiver.genColumns.
+
+-- annotationIds - Array of annotation ids.
+-- subjectIndex - Array of the subject id of each annotation.
+-- classifierIndex - Array of the classifier id of each annotation.
+-- labels - Boolean array of annotation labels.
+-- trueLabels - Boolean array of the true label of each subject.
+"""
 
 
 class BinarySimulationReceiver(Receiver):
-    def __init__(self, numClassifiers, numSubjects, numAnnotationsPerSubject,
-                 trueProb, successProb):
+    def __init__(self,
+                 numClassifiers,
+                 numSubjects,
+                 numAnnotationsPerSubject,
+                 trueProb,
+                 successProb,
+                 classifiers=None,
+                 seed=None):
         """Class to simulate reception of binary classifications.
 
         Parameters
@@ -196,6 +827,13 @@ class BinarySimulationReceiver(Receiver):
         successProb : float or array-like with size numClassifiers
             Probability that a classifier will correctly classify a
             subject.
+        classifiers : Classifiers, optional
+            Collection in which simulated classifiers are interned. Pass
+            the same collection to several receivers to share classifiers
+            between simulated batches.
+        seed : int or numpy.random.SeedSequence, optional
+            Seed for the numpy.random.Generator used by the vectorized
+            methods (genColumns and genStore).
 
         Returns
         -------
@@ -209,8 +847,9 @@ class BinarySimulationReceiver(Receiver):
                                              self.numClassifiers)
         self._trueProb = trueProb
         self._successProb = successProb
-        self._classifiers = None
+        self._classifiers = classifiers
         self._annotationIds = [0]
+        self._rng = np.random.default_rng(seed)
 
     @property
     def numClassifiers(self):
@@ -267,6 +906,10 @@ class BinarySimulationReceiver(Receiver):
     def annotationIds(self):
         return self._annotationIds
 
+    @property
+    def rng(self):
+        return self._rng
+
     def genClassifiers(self):
         """Generate a set of simulated classifiers with
         appropriate skill settings.
@@ -274,19 +917,20 @@ class BinarySimulationReceiver(Receiver):
         Returns
         -------
         None
-            Sets the `classifiers` instance attribute directly.
+            Sets the `classifiers` instance attribute directly. Classifiers
+            that are already present in the collection are reused.
 
         """
         # Models are simple placeholders
         skillModel = ClassifierSkillModelBinary()
         skillPriorModel = ClassifierSkillPriorBinary()
-        self.classifiers = Classifiers([
-            Classifier(
-                id=classifierId,
+        if self.classifiers is None:
+            self.classifiers = Classifiers()
+        for classifierId in range(self.numClassfiers):
+            self.classifiers.intern(
+                classifierId,
                 skillModel=skillModel,
                 skillPriorModel=skillPriorModel)
-            for classifierId in range(self.numClassfiers)
-        ])
 
     def genAnnotationId(self):
         id  = self.annotationIds[-1]
@@ -348,7 +992,8 @@ class BinarySimulationReceiver(Receiver):
 
         """
 
-        if self.classifiers is None:
+        if self.classifiers is None or len(
+                self.classifiers) < self.numClassifiers:
             self.genClassifiers()
 
         successIndicators = self.getProbs(self.successProb, self.numClassfiers)
@@ -375,13 +1020,693 @@ class BinarySimulationReceiver(Receiver):
         ])
         return subjects
 
+    def genClassifierIndex(self):
+        """Draw numAnnotationsPerSubject distinct classifiers for each subject.
+
+        Returns
+        -------
+        numpy.ndarray
+            Array with shape (numSubjects, numAnnotationsPerSubject) of
+            classifier indices.
+
+        """
+        numSubjects = self.numSubjects
+        numClassifiers = self.numClassifiers
+        numPerSubject = self.numAnnotationsPerSubject
+        if 2 * numPerSubject > numClassifiers:
+            # Dense case: take the first columns of a random permutation per
+            # subject.
+            return np.argsort(
+                self.rng.random((numSubjects, numClassifiers)),
+                axis=1)[:, :numPerSubject]
+        # Sparse case: draw with replacement and redraw the rows that contain
+        # repeats, which are few when numPerSubject << numClassifiers.
+        classifierIndex = self.rng.integers(
+            numClassifiers, size=(numSubjects, numPerSubject))
+        redraw = np.arange(numSubjects)
+        while redraw.size:
+            rows = np.sort(classifierIndex[redraw], axis=1)
+            redraw = redraw[np.any(rows[:, 1:] == rows[:, :-1], axis=1)]
+            classifierIndex[redraw] = self.rng.integers(
+                numClassifiers, size=(redraw.size, numPerSubject))
+        return classifierIndex
+
+    def genColumns(self):
+        """Generate an ensemble of simulated subjects as arrays, using a few
+        vectorized draws from the seeded generator rng.
+
+        Subject true labels are drawn as in genSubjects. Each annotation is
+        correct with the success probability of the classifier that made it.
+        Subject ids are 0..numSubjects-1 and classifier ids are
+        0..numClassifiers-1, as in genSubjects.
+
+        Returns
+        -------
+        SimulatedColumns
+            Parallel annotation arrays and per-subject true labels.
+
+        """
+        numSubjects = self.numSubjects
+        numPerSubject = self.numAnnotationsPerSubject
+        trueLabels = self.rng.random(numSubjects) < np.broadcast_to(
+            np.asarray(self.trueProb, dtype=float), numSubjects)
+        successProbs = np.broadcast_to(
+            np.asarray(self.successProb, dtype=float), self.numClassifiers)
+
+        classifierIndex = self.genClassifierIndex().ravel()
+        subjectIndex = np.repeat(np.arange(numSubjects), numPerSubject)
+        isCorrect = self.rng.random(classifierIndex.size) < successProbs[
+            classifierIndex]
+        labels = trueLabels[subjectIndex] == isCorrect
+
+        firstId = self.annotationIds[-1]
+        annotationIds = np.arange(firstId, firstId + labels.size)
+        self.annotationIds.append(firstId + labels.size)
+        return SimulatedColumns(annotationIds, subjectIndex, classifierIndex,
+                                labels, trueLabels)
+
+    def genStore(self, store=None):
+        """Generate an ensemble of simulated subjects directly into an
+        AnnotationStore. Use store.toSubjects() to obtain subjects whose
+        annotations are lazily materialised views over the arrays.
+
+        Parameters
+        ----------
+        store : AnnotationStore, optional
+            Store to append to. By default a new binary store is created.
+
+        Returns
+        -------
+        AnnotationStore
+            Store holding the simulated annotations and true labels.
+
+        """
+        if store is None:
+            store = AnnotationStore(labels=[False, True])
+        columns = self.genColumns()
+        subjectCodes = np.array(
+            [store.subjectCode(subjectId)
+             for subjectId in range(self.numSubjects)], dtype=np.int64)
+        classifierCodes = np.array(
+            [store.classifierCode(classifierId)
+             for classifierId in range(self.numClassifiers)], dtype=np.int64)
+        labelCodes = np.array(
+            [store.labelCode(False), store.labelCode(True)], dtype=np.int16)
+        store.extendEncoded(columns.annotationIds,
+                            subjectCodes[columns.subjectIndex],
+                            classifierCodes[columns.classifierIndex],
+                            labelCodes[columns.labels.astype(np.int64)])
+        store.setTrueLabelCodes(labelCodes[columns.trueLabels.astype(
+            np.int64)], subjectCodes)
+        return store
+
+
+def sqlValue(value):
+    """Convert numpy scalars to the Python types accepted by sqlite3.
+    """
+    return value.item() if isinstance(value, np.generic) else value
+
 
 class SQLiteStorage(Storage):
-    pass
+    """Persists subjects, classifications, classifiers, skills and posteriors
+    in an SQLite database in WAL mode.
+
+    Writes are incremental: the save methods only write what changed since
+    the previous save through this instance (or the positions and subjects
+    passed to them), using batched executemany statements. The load methods
+    hydrate an AnnotationStore, or a Subjects/Classifiers object model, in a
+    single pass over the classifications table.
+
+    Label values are stored as given, so binary labels are stored as 0 and 1.
+    Classifications by anonymous classifiers (whose id is None) are stored
+    with the user id anonymousUserId.
+    """
+
+    anonymousUserId = '<anonymous>'
+
+    schema = [
+        """CREATE TABLE IF NOT EXISTS subjects (
+            subject_id PRIMARY KEY, true_label, risk REAL)""",
+        """CREATE TABLE IF NOT EXISTS classifications (
+            classification_id INTEGER PRIMARY KEY,
+            subject_id NOT NULL, user_id NOT NULL, label)""",
+        """CREATE INDEX IF NOT EXISTS classifications_subject_id
+            ON classifications (subject_id)""",
+        """CREATE INDEX IF NOT EXISTS classifications_user_id
+            ON classifications (user_id)""",
+        """CREATE TABLE IF NOT EXISTS classifiers (user_id PRIMARY KEY)""",
+        """CREATE TABLE IF NOT EXISTS skills (
+            user_id NOT NULL, label NOT NULL, skill REAL,
+            PRIMARY KEY (user_id, label)) WITHOUT ROWID""",
+        """CREATE TABLE IF NOT EXISTS skill_priors (
+            label PRIMARY KEY, prior REAL)""",
+        """CREATE TABLE IF NOT EXISTS posteriors (
+            subject_id NOT NULL, label NOT NULL, posterior REAL,
+            PRIMARY KEY (subject_id, label)) WITHOUT ROWID"""
+    ]
+
+    def __init__(self, path, batchSize=10000):
+        """Arguments:
+        -- path - Path of the database file. It is created if necessary.
+        -- batchSize - Number of rows passed to each executemany call and
+        fetched per fetchmany call.
+        """
+        super().__init__()
+        self._path = path
+        self._batchSize = batchSize
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        with self._connection:
+            for statement in self.schema:
+                self._connection.execute(statement)
+
+        # State of the rows written through this instance, used to skip
+        # unchanged rows.
+        self._savedSubjects = {}
+        self._savedSkills = {}
+        self._savedSkillPriors = None
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def connection(self):
+        return self._connection
+
+    def close(self):
+        self._connection.close()
+
+    def _executemany(self, statement, rows):
+        """Execute statement for each row of the iterable rows in batches of
+        batchSize, within a single transaction.
+        """
+        rows = iter(rows)
+        with self._connection:
+            while True:
+                batch = list(itertools.islice(rows, self._batchSize))
+                if not batch:
+                    break
+                self._connection.executemany(statement, batch)
+
+    def _userId(self, classifierId):
+        return (self.anonymousUserId
+                if classifierId is None else sqlValue(classifierId))
+
+    def _fetch(self, statement, parameters=()):
+        cursor = self._connection.execute(statement, parameters)
+        while True:
+            rows = cursor.fetchmany(self._batchSize)
+            if not rows:
+                return
+            yield from rows
+
+    def _saveClassifications(self, rows):
+        rows = list(rows)
+        self._executemany(
+            'INSERT OR IGNORE INTO classifications VALUES (?, ?, ?, ?)', rows)
+        self._executemany('INSERT OR IGNORE INTO subjects (subject_id) '
+                          'VALUES (?)', {(row[1], ) for row in rows})
+        self._executemany('INSERT OR IGNORE INTO classifiers VALUES (?)',
+                          {(row[2], ) for row in rows})
+
+    def _saveTrueLabels(self, rows):
+        self._executemany(
+            'INSERT INTO subjects (subject_id, true_label) VALUES (?, ?) '
+            'ON CONFLICT (subject_id) DO UPDATE '
+            'SET true_label = excluded.true_label', rows)
+
+    def _saveSkills(self, classifierSkills):
+        """Write the skills of each (classifierId, skills dictionary) pair that
+        differ from those last written.
+        """
+        changed = [(classifierId, skills)
+                   for classifierId, skills in classifierSkills
+                   if self._savedSkills.get(classifierId) != skills]
+        self._executemany(
+            'INSERT OR REPLACE INTO skills VALUES (?, ?, ?)',
+            ((classifierId, sqlValue(label), float(skill))
+             for classifierId, skills in changed
+             for label, skill in skills.items()))
+        self._savedSkills.update(changed)
+
+    def _saveSkillPriors(self, skillPriors):
+        if skillPriors is None or skillPriors == self._savedSkillPriors:
+            return
+        self._executemany(
+            'INSERT OR REPLACE INTO skill_priors VALUES (?, ?)',
+            ((sqlValue(label), float(prior))
+             for label, prior in skillPriors.items()))
+        self._savedSkillPriors = dict(skillPriors)
+
+    def saveSubjects(self, subjects):
+        """Write the annotations and true labels of the subjects that have been
+        added or modified since they were last saved.
+        """
+        if not isinstance(subjects, Subjects):
+            raise TypeError(
+                'The subjects argument must be of type {}. Type {} passed.'.
+                format(type(Subjects), type(subjects)))
+        classifications, trueLabels = [], []
+        for subject in subjects.items():
+            version, numSaved = self._savedSubjects.get(subject.id, (None, 0))
+            if version == subject.version:
+                continue
+            annotations = subject.annotations.annotations
+            subjectId = sqlValue(subject.id)
+            classifications.extend(
+                (sqlValue(annotation.id), subjectId,
+                 self._userId(annotation.classifier.id),
+                 sqlValue(annotation.label))
+                for annotation in annotations[numSaved:])
+            trueLabels.append((subjectId, sqlValue(subject.trueLabel)))
+            self._savedSubjects[subject.id] = (subject.version,
+                                               len(annotations))
+        self._saveClassifications(classifications)
+        self._saveTrueLabels(trueLabels)
+
+    def saveClassifiers(self, classifiers):
+        """Write the skills and skill priors of classifiers (an iterable of
+        Classifier instances) that changed since they were last saved.
+        Classifiers whose skills have not been computed are skipped.
+        """
+        computed = [
+            classifier for classifier in classifiers
+            if classifier._skills is not None
+        ]
+        self._saveSkills((self._userId(classifier.id),
+                          dict(classifier.skills))
+                         for classifier in computed)
+        if computed and computed[0]._skillPriors is not None:
+            self._saveSkillPriors(computed[0].skillPriors)
+
+    def saveStore(self, store, positions=None):
+        """Write the annotations of store at positions (a slice or index array,
+        e.g. as returned by CaesarSQSReceiver.extractStore; default all) and
+        the true labels of their subjects.
+        """
+        if not isinstance(store, AnnotationStore):
+            raise TypeError(
+                'The store argument must be of type {}. Type {} passed.'.
+                format(type(AnnotationStore), type(store)))
+        if positions is None:
+            positions = slice(0, store.numAnnotations)
+        subjectIndex = store.subjectIndex[positions]
+        subjectIds, classifierIds = store.subjectIds, store.classifierIds
+        self._saveClassifications(
+            (annotationId, sqlValue(subjectIds[subjectCode]),
+             self._userId(classifierIds[classifierCode]),
+             sqlValue(store.decodeLabel(code)))
+            for annotationId, subjectCode, classifierCode, code in zip(
+                store.annotationIds[positions].tolist(), subjectIndex.tolist(),
+                store.classifierIndex[positions].tolist(),
+                store.labelCodes[positions].tolist()))
+        self.saveTrueLabels(store, np.unique(subjectIndex))
+
+    def saveTrueLabels(self, store, subjectCodes=None):
+        """Write the true labels of the subjects of store with the dense
+        indices subjectCodes (default all).
+        """
+        if subjectCodes is None:
+            subjectCodes = np.arange(store.numSubjects)
+        trueLabelCodes = store.trueLabelCodes
+        self._saveTrueLabels(
+            (sqlValue(store.subjectIds[code]),
+             sqlValue(store.decodeLabel(trueLabelCodes[code])))
+            for code in np.asarray(subjectCodes).tolist())
+
+    def saveSkills(self, store, skills, skillPriors=None):
+        """Write the rows of the skill array for store (as returned by
+        ClassifierSkillEngineBinary) that changed since they were last saved.
+        NaN entries, i.e. labels a classifier has not used, are not written.
+
+        Arguments:
+        -- skillPriors - Optional array of per-label skill priors.
+        """
+        self._saveSkills((self._userId(classifierId), {
+            label: skill
+            for label, skill in zip(store.labels, skills[code].tolist())
+            if not np.isnan(skill)
+        }) for code, classifierId in enumerate(store.classifierIds))
+        if skillPriors is not None:
+            self._saveSkillPriors({
+                label: prior
+                for label, prior in zip(store.labels, skillPriors.tolist())
+                if not np.isnan(prior)
+            })
+
+    def savePosteriors(self, store, summary, subjectCodes=None):
+        """Write the posteriors and risks of a PosteriorSummary for store.
+
+        Arguments:
+        -- subjectCodes - Dense subject indices of the rows of summary, if it
+        was evaluated for a subset of subjects. By default the rows follow the
+        subjects of store.
+        """
+        if subjectCodes is None:
+            subjectCodes = np.arange(summary.posteriors.shape[0])
+        subjectIds = [
+            sqlValue(store.subjectIds[code])
+            for code in np.asarray(subjectCodes).tolist()
+        ]
+        labels = [sqlValue(label) for label in store.labels]
+        self._executemany(
+            'INSERT OR REPLACE INTO posteriors VALUES (?, ?, ?)',
+            ((subjectId, label, posterior)
+             for subjectId, posteriors in zip(subjectIds,
+                                              summary.posteriors.tolist())
+             for label, posterior in zip(labels, posteriors)))
+        if summary.risks is not None:
+            self._executemany(
+                'UPDATE subjects SET risk = ? WHERE subject_id = ?',
+                zip(summary.risks.tolist(), subjectIds))
+
+    def loadStore(self, labels=[False, True], **storeArgs):
+        """Hydrate an AnnotationStore holding every saved classification and
+        subject true label, reading the classifications table once.
+        """
+        store = AnnotationStore(labels=labels, **storeArgs)
+        rows = self._fetch(
+            'SELECT classification_id, subject_id, NULLIF(user_id, ?), label '
+            'FROM classifications', (self.anonymousUserId, ))
+        while True:
+            batch = list(itertools.islice(rows, self._batchSize))
+            if not batch:
+                break
+            store.extend(*zip(*batch))
+        for subjectId, trueLabel in self._fetch(
+                'SELECT subject_id, true_label FROM subjects'):
+            if trueLabel is not None:
+                store.setTrueLabel(subjectId, trueLabel)
+            else:
+                store.subjectCode(subjectId)
+        return store
+
+    def loadSkills(self, store):
+        """Return (skills, skillPriors) arrays aligned with store. Missing
+        entries are NaN.
+        """
+        skills = np.full((store.numClassifiers, store.numLabels), np.nan)
+        for classifierId, label, skill in self._fetch(
+                'SELECT NULLIF(user_id, ?), label, skill FROM skills',
+            (self.anonymousUserId, )):
+            code = store.classifierIdMap.get(classifierId)
+            labelCode = store.labelCodeMap.get(label)
+            if code is not None and labelCode is not None:
+                skills[code, labelCode] = skill
+        skillPriors = np.full(store.numLabels, np.nan)
+        for label, prior in self._fetch(
+                'SELECT label, prior FROM skill_priors'):
+            labelCode = store.labelCodeMap.get(label)
+            if labelCode is not None:
+                skillPriors[labelCode] = prior
+        return skills, skillPriors
+
+    def loadPosteriors(self, store):
+        """Return (posteriors, risks) arrays aligned with store. Missing
+        entries are NaN. Saved subjects that are not in store are skipped.
+        """
+        posteriors = np.full((store.numSubjects, store.numLabels), np.nan)
+        for subjectId, label, posterior in self._fetch(
+                'SELECT subject_id, label, posterior FROM posteriors'):
+            code = store.subjectIdMap.get(subjectId)
+            labelCode = store.labelCodeMap.get(label)
+            if code is not None and labelCode is not None:
+                posteriors[code, labelCode] = posterior
+        risks = np.full(store.numSubjects, np.nan)
+        for subjectId, risk in self._fetch('SELECT subject_id, risk FROM '
+                                           'subjects WHERE risk IS NOT NULL'):
+            code = store.subjectIdMap.get(subjectId)
+            if code is not None:
+                risks[code] = risk
+        return posteriors, risks
+
+    def loadSubjects(self, labels=[False, True], **classifierArgs):
+        """Hydrate the object model. Annotations are views over a store loaded
+        with loadStore, and saved skills and skill priors are assigned to the
+        classifiers.
+
+        Arguments:
+        -- classifierArgs - Arguments forwarded to the Classifier constructor
+        (e.g. skillModel, skillPriorModel).
+
+        Returns: Tuple of (Subjects, Classifiers).
+        """
+        store = self.loadStore(labels=labels)
+        skills, skillPriors = self.loadSkills(store)
+        skillPriors = {
+            label: prior
+            for label, prior in zip(store.labels, skillPriors.tolist())
+            if not np.isnan(prior)
+        }
+        classifiers = Classifiers([])
+        for code, classifierId in enumerate(store.classifierIds):
+            classifier = classifiers.intern(classifierId, **classifierArgs)
+            classifierSkills = {
+                label: skill
+                for label, skill in zip(store.labels, skills[code].tolist())
+                if not np.isnan(skill)
+            }
+            if classifierSkills:
+                classifier.skills = classifierSkills
+            if skillPriors:
+                classifier.skillPriors = skillPriors
+        subjects = store.toSubjects(classifiers.items())
+        classifiers.indexSubjects(subjects)
+        for subject in subjects.items():
+            self._savedSubjects[subject.id] = (
+                subject.version, len(subject.annotations.annotations))
+        return subjects, classifiers
 
 
 class FileStorage(Storage):
-    pass
+    """Persists an AnnotationStore, classifier skills and subject posteriors as
+    memory-mappable binary files in a directory, so that restarting does not
+    require re-reading the classification history.
+
+    Each store column is a raw binary file. Every saveStore call appends the
+    annotations, subject ids and classifier ids added since the previous save
+    as a new segment, and records the segment in manifest.json. The manifest is
+    replaced atomically after the data has been written, so bytes beyond the
+    lengths it records (e.g. from an interrupted save) are ignored and
+    overwritten by the next save.
+
+    Ids that are all integers are stored as int64 columns and other ids as
+    JSON lines. Skills, skill priors, posteriors, risks and true label codes
+    are rewritten as .npy files on each save.
+    """
+
+    manifestName = 'manifest.json'
+    columnTypes = collections.OrderedDict([('annotationIds', np.int64),
+                                           ('subjectIndex', np.int64),
+                                           ('classifierIndex', np.int64),
+                                           ('labelCodes', np.int16)])
+
+    def __init__(self, path):
+        """Arguments:
+        -- path - Directory holding the files. It is created if necessary and
+        an existing manifest is reopened.
+        """
+        super().__init__()
+        self._path = path
+        os.makedirs(path, exist_ok=True)
+        manifestPath = os.path.join(path, self.manifestName)
+        if os.path.exists(manifestPath):
+            with open(manifestPath) as manifestFile:
+                self._manifest = json.load(manifestFile)
+        else:
+            self._manifest = {
+                'labels': None,
+                'idFormats': {},
+                'numAnnotations': 0,
+                'numSubjects': 0,
+                'numClassifiers': 0,
+                'segments': []
+            }
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def manifest(self):
+        return self._manifest
+
+    @property
+    def numAnnotations(self):
+        return self._manifest['numAnnotations']
+
+    @property
+    def segments(self):
+        """List of dictionaries recording the number of annotations, subjects
+        and classifiers added by each saveStore call.
+        """
+        return self._manifest['segments']
+
+    def _filePath(self, name):
+        return os.path.join(self._path, name)
+
+    def _writeManifest(self):
+        manifestPath = self._filePath(self.manifestName)
+        with open(manifestPath + '.tmp', 'w') as manifestFile:
+            json.dump(self._manifest, manifestFile, indent=1)
+        os.replace(manifestPath + '.tmp', manifestPath)
+
+    def _saveArray(self, name, array):
+        # np.save appends the .npy suffix to paths that lack it.
+        temporaryPath = self._filePath(name + '.tmp.npy')
+        np.save(temporaryPath, array)
+        os.replace(temporaryPath, self._filePath(name + '.npy'))
+
+    def _loadArray(self, name):
+        path = self._filePath(name + '.npy')
+        return np.load(path, mmap_mode='r') if os.path.exists(path) else None
+
+    def _appendColumn(self, name, dtype, values, numSaved):
+        """Append values to a raw binary column holding numSaved valid entries,
+        discarding any bytes beyond them.
+        """
+        path = self._filePath(name + '.bin')
+        with open(path, 'ab') as columnFile:
+            columnFile.truncate(numSaved * np.dtype(dtype).itemsize)
+            columnFile.write(
+                np.ascontiguousarray(values, dtype=dtype).tobytes())
+
+    def _mapColumn(self, name, dtype, size):
+        if size == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(
+            self._filePath(name + '.bin'),
+            dtype=dtype,
+            mode='r',
+            shape=(size, ))
+
+    def _appendIds(self, name, ids, numSaved):
+        idFormat = self._manifest['idFormats'].get(name)
+        if idFormat is None:
+            idFormat = ('int64' if all(
+                isinstance(id, (int, np.integer)) for id in ids) else 'json')
+            self._manifest['idFormats'][name] = idFormat
+        if idFormat == 'int64':
+            if not all(isinstance(id, (int, np.integer)) for id in ids):
+                raise TypeError('The {} stored in {} are integers. '
+                                'Non-integer ids passed.'.format(
+                                    name, self._path))
+            self._appendColumn(name, np.int64, ids, numSaved)
+            return
+        lines = self._manifest.setdefault('idLines', {})
+        path = self._filePath(name + '.jsonl')
+        encoded = ''.join(json.dumps(sqlValue(id)) + '\n'
+                          for id in ids).encode()
+        with open(path, 'ab') as idFile:
+            idFile.truncate(lines.get(name, 0))
+            idFile.write(encoded)
+        # The position reported by an append-mode file need not follow the
+        # truncation, so the length is tracked explicitly.
+        lines[name] = lines.get(name, 0) + len(encoded)
+
+    def _loadIds(self, name, size):
+        if self._manifest['idFormats'].get(name, 'int64') == 'int64':
+            return self._mapColumn(name, np.int64, size).tolist()
+        with open(self._filePath(name + '.jsonl'), 'rb') as idFile:
+            content = idFile.read(self._manifest['idLines'][name])
+        return [json.loads(line) for line in content.splitlines()]
+
+    def saveStore(self, store):
+        """Append the annotations, subjects and classifiers added to store
+        since the previous save as a new segment, and rewrite the true labels.
+
+        The store must extend the saved data, i.e. be the store passed to the
+        previous save (or one returned by loadStore) with further annotations
+        appended.
+        """
+        if not isinstance(store, AnnotationStore):
+            raise TypeError(
+                'The store argument must be of type {}. Type {} passed.'.
+                format(type(AnnotationStore), type(store)))
+        manifest = self._manifest
+        labels = [sqlValue(label) for label in store.labels]
+        savedLabels = manifest['labels'] or []
+        if store.numAnnotations < manifest['numAnnotations'] or labels[:len(
+                savedLabels)] != savedLabels:
+            raise ValueError(
+                'The store does not extend the data saved in {}.'.format(
+                    self._path))
+
+        positions = slice(manifest['numAnnotations'], store.numAnnotations)
+        for name, dtype in self.columnTypes.items():
+            self._appendColumn(name, dtype, getattr(store, name)[positions],
+                               manifest['numAnnotations'])
+        self._appendIds('subjectIds',
+                        store.subjectIds[manifest['numSubjects']:],
+                        manifest['numSubjects'])
+        self._appendIds('classifierIds',
+                        store.classifierIds[manifest['numClassifiers']:],
+                        manifest['numClassifiers'])
+        self._saveArray('trueLabelCodes', store.trueLabelCodes)
+
+        manifest['segments'].append({
+            name: getattr(store, name) - manifest[name]
+            for name in ('numAnnotations', 'numSubjects', 'numClassifiers')
+        })
+        manifest.update({
+            'labels': labels,
+            'numAnnotations': store.numAnnotations,
+            'numSubjects': store.numSubjects,
+            'numClassifiers': store.numClassifiers
+        })
+        self._writeManifest()
+
+    def saveSkills(self, skills, skillPriors=None):
+        """Write the skill array (and optionally skill priors) aligned with the
+        classifiers and labels of the saved store.
+        """
+        self._saveArray('skills', np.asarray(skills, dtype=float))
+        if skillPriors is not None:
+            self._saveArray('skillPriors',
+                            np.asarray(skillPriors, dtype=float))
+
+    def savePosteriors(self, summary):
+        """Write the posteriors and risks of a PosteriorSummary evaluated for
+        every subject of the saved store.
+        """
+        self._saveArray('posteriors', summary.posteriors)
+        if summary.risks is not None:
+            self._saveArray('risks', summary.risks)
+
+    def loadStore(self, **storeArgs):
+        """Return an AnnotationStore whose columns are memory-mapped from the
+        saved files, so opening does not read the annotations into memory. The
+        columns are copied into memory if further annotations are appended.
+        """
+        manifest = self._manifest
+        numAnnotations = manifest['numAnnotations']
+        columns = [
+            self._mapColumn(name, dtype, numAnnotations)
+            for name, dtype in self.columnTypes.items()
+        ]
+        trueLabelCodes = self._loadArray('trueLabelCodes')
+        return AnnotationStore.fromColumns(
+            *columns,
+            subjectIds=self._loadIds('subjectIds', manifest['numSubjects']),
+            classifierIds=self._loadIds('classifierIds',
+                                        manifest['numClassifiers']),
+            labels=manifest['labels'] or [],
+            trueLabelCodes=trueLabelCodes,
+            **storeArgs)
+
+    def loadSkills(self):
+        """Return memory-mapped (skills, skillPriors) arrays, or None for those
+        that have not been saved.
+        """
+        return self._loadArray('skills'), self._loadArray('skillPriors')
+
+    def loadPosteriors(self):
+        """Return memory-mapped (posteriors, risks) arrays, or None for those
+        that have not been saved.
+        """
+        return self._loadArray('posteriors'), self._loadArray('risks')
 
 
 # testSim = BinarySimulationReciever(
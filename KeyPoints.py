@@ -0,0 +1,487 @@
+import collections
+
+import numpy as np
+import scipy.sparse as scisparse
+import scipy.sparse.csgraph as scigraph
+import scipy.spatial as scispatial
+
+from Annotations import AnnotationKeyPoint
+
+KeyPointClusters = collections.namedtuple('KeyPointClusters', [
+    'centres', 'memberships', 'numMarks', 'numClassifiers', 'consensusLabels',
+    'consensusFractions'
+])
+"""Result of clustering the keypoint marks of one subject.
+
+-- centres - Array with shape (numClusters, 2) of cluster centres.
+-- memberships - Array with one entry per mark giving the index of its
+cluster, or -1 for marks not assigned to any cluster.
+-- numMarks - Array of the number of marks in each cluster.
+-- numClassifiers - Array of the number of distinct classifiers with a mark
+in each cluster.
+-- consensusLabels - List of the most common mark label in each cluster.
+-- consensusFractions - Array of the fraction of each cluster's marks that
+carry its consensus label.
+"""
+
+KeyPointSkills = collections.namedtuple(
+    'KeyPointSkills', ['classifierIds', 'precisions', 'variances'])
+"""Keypoint skills of a set of classifiers.
+
+-- classifierIds - List of classifier ids labelling the rows.
+-- precisions - Array of the smoothed probability that a mark by each
+classifier belongs to a cluster (i.e. is not a false detection).
+-- variances - Array of the smoothed mean squared distance per axis of each
+classifier's clustered marks from their cluster centres.
+"""
+
+
+class KeyPointClusterer():
+    """Clusters the keypoint marks of a subject by density.
+
+    A mark with at least minSamples marks (including itself) within radius is a
+    core mark. Core marks within radius of each other form a cluster, and other
+    marks within radius of a core mark join the cluster of the nearest one.
+    Remaining marks are unassigned.
+
+    Marks are binned into square cells half the radius wide, so a cell holding
+    minSamples marks makes them all core marks, and neighbours are only counted
+    (with a KD-tree, without listing them) for marks in sparser cells. Clusters
+    are then connected cell by cell, looking up the nearest core mark in each
+    of the few cells within radius of a core mark. Neighbouring pairs are
+    never enumerated, so the cost grows roughly as n log n in the number of
+    marks n even when thousands of marks pile up on one keypoint.
+    """
+
+    # Offsets of the cells that may hold neighbours of a mark, halved so that
+    # each pair of cells is visited once, nearest first.
+    _cellOffsets = sorted(
+        [(dx, dy) for dx in range(3) for dy in range(-2, 3)
+         if dx > 0 or dy > 0],
+        key=lambda offset: offset[0]**2 + offset[1]**2)
+    # Number of marks of each cell tried first when linking it to another.
+    _sampleSize = 8
+
+    def __init__(self, radius=10.0, minSamples=2):
+        """Arguments:
+        -- radius - Neighbourhood radius in pixels.
+        -- minSamples - Minimum number of marks in the neighbourhood of a core
+        mark.
+        """
+        self._radius = radius
+        self._minSamples = minSamples
+
+    @property
+    def radius(self):
+        return self._radius
+
+    @radius.setter
+    def radius(self, radius):
+        self._radius = radius
+
+    @property
+    def minSamples(self):
+        return self._minSamples
+
+    @minSamples.setter
+    def minSamples(self, minSamples):
+        self._minSamples = minSamples
+
+    def memberships(self, points):
+        """Return the cluster index of each row of points (with shape
+        (numMarks, 2)), or -1 for unassigned marks. Clusters are numbered in
+        order of their first mark.
+        """
+        if not self.radius > 0:
+            raise ValueError(
+                'The radius must be positive. {!r} passed.'.format(
+                    self.radius))
+        numMarks = points.shape[0]
+        memberships = np.full(numMarks, -1, dtype=np.int64)
+        if numMarks == 0:
+            return memberships
+
+        # Cells half the radius wide are narrower than the radius along their
+        # diagonal, so marks sharing a cell are always neighbours.
+        cells, cellKeys, width = self._cells(points)
+        cellCounts = np.bincount(cells)
+        core = cellCounts[cells] >= self.minSamples
+        sparse = np.flatnonzero(~core)
+        if sparse.size:
+            tree = scispatial.cKDTree(points)
+            core[sparse] = tree.query_ball_point(
+                points[sparse], self.radius,
+                return_length=True) >= self.minSamples
+        core = np.flatnonzero(core)
+        if core.size == 0:
+            return memberships
+
+        # Connected components of the graph of cells holding neighbouring core
+        # marks, which match those of the graph of the core marks themselves.
+        coreCells = cells[core]
+        coreTree = scispatial.cKDTree(points[core])
+        # Median splits and shrunk node bounds degrade badly on the many marks
+        # sharing a cell coordinate, so the tree is split at midpoints.
+        cellTree = scispatial.cKDTree(
+            np.column_stack([points[core], self._cellCoordinate(coreCells)]),
+            balanced_tree=False,
+            compact_nodes=False)
+        bound = np.nextafter(self.radius, np.inf)
+        # Rank of each core mark among the core marks of its cell.
+        order = np.argsort(coreCells, kind='stable')
+        ranks = np.empty(core.size, dtype=np.int64)
+        ranks[order] = np.arange(core.size) - np.searchsorted(
+            coreCells[order], coreCells[order])
+        sources, targets = [], []
+        cellComponents = np.arange(cellKeys.size)
+        for dx, dy in self._cellOffsets:
+            neighbourKeys = cellKeys[coreCells] + dx * width + dy
+            neighbourCells = np.minimum(
+                np.searchsorted(cellKeys, neighbourKeys), cellKeys.size - 1)
+            occupied = cellKeys[neighbourCells] == neighbourKeys
+            # A few marks of a cell usually suffice to link it to a
+            # neighbouring cell, so the others are only tried for the cells
+            # still unlinked afterwards.
+            for sampled in (ranks < self._sampleSize,
+                            ranks >= self._sampleSize):
+                unlinked = np.flatnonzero(
+                    occupied & sampled & (cellComponents[coreCells] !=
+                                          cellComponents[neighbourCells]))
+                if unlinked.size == 0:
+                    continue
+                # The nearest core mark in the neighbouring cell, if within
+                # radius. The third coordinate keeps other cells out of reach.
+                distances, _ = cellTree.query(
+                    np.column_stack([
+                        points[core[unlinked]],
+                        self._cellCoordinate(neighbourCells[unlinked])
+                    ]),
+                    distance_upper_bound=bound)
+                linked = unlinked[np.isfinite(distances)]
+                if linked.size == 0:
+                    continue
+                sources.append(coreCells[linked])
+                targets.append(neighbourCells[linked])
+                graph = scisparse.coo_matrix(
+                    (np.ones(sum(part.size for part in sources),
+                             dtype=np.int8), (np.concatenate(sources),
+                                              np.concatenate(targets))),
+                    shape=(cellKeys.size, cellKeys.size))
+                _, cellComponents = scigraph.connected_components(
+                    graph, directed=False)
+        components = cellComponents[coreCells]
+        memberships[core] = components
+
+        # Border marks join the cluster of their nearest core mark.
+        border = np.flatnonzero(memberships < 0)
+        if border.size:
+            distances, nearest = coreTree.query(
+                points[border], distance_upper_bound=bound)
+            attached = np.isfinite(distances)
+            memberships[border[attached]] = components[nearest[attached]]
+
+        # Renumber clusters in order of their first mark.
+        assigned = memberships >= 0
+        _, firstMarks, inverse = np.unique(
+            memberships[assigned], return_index=True, return_inverse=True)
+        order = np.argsort(np.argsort(firstMarks))
+        memberships[assigned] = order[inverse]
+        return memberships
+
+    def _cells(self, points):
+        """Return (cells, cellKeys, width), where cells gives the index of the
+        cell of each mark into the sorted array cellKeys, and the key of the
+        cell (dx, dy) cells away from a cell is its key + dx * width + dy.
+        """
+        coordinates = np.floor(points / (0.5 * self.radius)).astype(np.int64)
+        # Keep a margin of two cells so that neighbouring keys do not wrap.
+        coordinates -= coordinates.min(axis=0) - 2
+        width = int(coordinates[:, 1].max()) + 3
+        cellKeys, cells = np.unique(
+            coordinates[:, 0] * width + coordinates[:, 1], return_inverse=True)
+        return cells.ravel(), cellKeys, width
+
+    def _cellCoordinate(self, cells):
+        # Marks in different cells lie further apart than the radius along it.
+        return cells * (4.0 * self.radius)
+
+    def __call__(self, points, labels=None, classifierIds=None, weights=None):
+        """Cluster the marks of one subject.
+
+        Arguments:
+        -- points - Array-like with shape (numMarks, 2) of mark coordinates.
+        -- labels - Optional sequence of mark labels.
+        -- classifierIds - Optional sequence of the ids of the classifiers that
+        made each mark.
+        -- weights - Optional array of non-negative weights per mark (e.g. the
+        inverse variance of its classifier) used to average cluster centres.
+
+        Returns: KeyPointClusters
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        memberships = self.memberships(points)
+        return self.summarize(points, memberships, labels, classifierIds,
+                              weights)
+
+    def summarize(self,
+                  points,
+                  memberships,
+                  labels=None,
+                  classifierIds=None,
+                  weights=None):
+        """Derive cluster centres and consensus from the memberships of marks.
+        """
+        numMarks = points.shape[0]
+        assigned = np.flatnonzero(memberships >= 0)
+        clusterIndex = memberships[assigned]
+        numClusters = int(clusterIndex.max()) + 1 if assigned.size else 0
+
+        numMarksPerCluster = np.bincount(clusterIndex, minlength=numClusters)
+        if weights is None:
+            weights = np.ones(numMarks)
+        weights = np.asarray(weights, dtype=float)[assigned]
+        totalWeights = np.bincount(
+            clusterIndex, weights=weights, minlength=numClusters)
+        # Fall back to the unweighted mean for clusters with no weight.
+        weights = np.where(totalWeights[clusterIndex] > 0, weights, 1.0)
+        totalWeights = np.bincount(
+            clusterIndex, weights=weights, minlength=numClusters)
+        centres = np.column_stack([
+            np.bincount(
+                clusterIndex,
+                weights=weights * points[assigned, axis],
+                minlength=numClusters) for axis in range(2)
+        ]) / np.maximum(totalWeights, 1e-300)[:, np.newaxis]
+
+        if classifierIds is not None and numMarks:
+            _, classifierCodes = _codes(classifierIds)
+            distinct = np.unique(
+                clusterIndex * (classifierCodes.max() + 1) +
+                classifierCodes[assigned])
+            numClassifiers = np.bincount(
+                distinct // (classifierCodes.max() + 1),
+                minlength=numClusters)
+        else:
+            numClassifiers = numMarksPerCluster.copy()
+
+        consensusLabels = [None] * numClusters
+        consensusFractions = np.zeros(numClusters)
+        if labels is not None and numClusters:
+            labels = list(labels)
+            labelValues, labelCodes = np.unique(
+                np.array([repr(label) for label in labels]),
+                return_inverse=True)
+            firstLabels = {}
+            for position, code in enumerate(labelCodes):
+                firstLabels.setdefault(code, labels[position])
+            numLabelValues = labelValues.size
+            labelCounts = np.bincount(
+                clusterIndex * numLabelValues + labelCodes[assigned],
+                minlength=numClusters * numLabelValues).reshape(
+                    numClusters, numLabelValues)
+            consensusCodes = np.argmax(labelCounts, axis=1)
+            consensusLabels = [firstLabels[code] for code in consensusCodes]
+            consensusFractions = labelCounts[np.arange(numClusters),
+                                             consensusCodes] / np.maximum(
+                                                 numMarksPerCluster, 1)
+
+        return KeyPointClusters(centres, memberships, numMarksPerCluster,
+                                numClassifiers, consensusLabels,
+                                consensusFractions)
+
+    def clusterAnnotations(self, annotations, weights=None):
+        """Cluster an iterable of AnnotationKeyPoint instances.
+
+        Arguments:
+        -- weights - Optional dictionary mapping classifier ids to mark
+        weights. Classifiers missing from it have weight 1.
+        """
+        points, labels, classifierIds = keyPointArrays(annotations)
+        markWeights = None
+        if weights is not None:
+            markWeights = [
+                weights.get(classifierId, 1.0)
+                for classifierId in classifierIds
+            ]
+        return self(points, labels, classifierIds, markWeights)
+
+
+def _codes(values):
+    """Return (uniqueValues, codes), numbering the distinct values in order of
+    first appearance. Values are compared as dictionary keys, so ids of
+    different types (e.g. 1 and '1') remain distinct.
+    """
+    index = {}
+    codes = np.array(
+        [index.setdefault(value, len(index)) for value in values],
+        dtype=np.int64)
+    return list(index), codes
+
+
+def keyPointArrays(annotations):
+    """Return (points, labels, classifierIds) for an iterable of
+    AnnotationKeyPoint instances.
+    """
+    annotations = [
+        annotation for annotation in annotations
+        if isinstance(annotation, AnnotationKeyPoint)
+    ]
+    points = np.array(
+        [[annotation.x, annotation.y] for annotation in annotations],
+        dtype=float).reshape(-1, 2)
+    labels = [annotation.label for annotation in annotations]
+    classifierIds = [
+        getattr(annotation.classifier, 'id', annotation.classifier)
+        for annotation in annotations
+    ]
+    return points, labels, classifierIds
+
+
+class KeyPointSkillEngine():
+    """Estimates the keypoint skills of every classifier from the clustered
+    marks of many subjects at once.
+
+    A classifier's precision is the fraction of its marks that fall in a
+    cluster, Beta-smoothed towards lowCountProb with weight nBeta as for the
+    binary skill models. Its variance is the mean squared distance per axis of
+    its clustered marks from their cluster centres, smoothed towards
+    priorVariance with weight nVariance.
+    """
+
+    def __call__(self, classifierIds, offsets, clustered, **args):
+        """Evaluate the skills.
+
+        Arguments:
+        -- classifierIds - Sequence of the classifier id of every mark.
+        -- offsets - Array with shape (numMarks, 2) of each mark's displacement
+        from its cluster centre. Rows of unclustered marks are ignored.
+        -- clustered - Boolean array marking the marks assigned to a cluster.
+
+        Keyword arguments:
+        -- nBeta - Weight of the precision prior (default 5).
+        -- lowCountProb - Prior precision (default 0.8).
+        -- nVariance - Weight of the variance prior (default 5).
+        -- priorVariance - Prior variance in squared pixels (default 25).
+
+        Returns: KeyPointSkills
+        """
+        nBeta = args.get('nBeta', 5.0)
+        lowCountProb = args.get('lowCountProb', 0.8)
+        nVariance = args.get('nVariance', 5.0)
+        priorVariance = args.get('priorVariance', 25.0)
+
+        uniqueIds, classifierCodes = _codes(classifierIds)
+        numClassifiers = len(uniqueIds)
+        clustered = np.asarray(clustered, dtype=bool)
+        offsets = np.asarray(offsets, dtype=float).reshape(-1, 2)
+
+        numMarks = np.bincount(classifierCodes, minlength=numClassifiers)
+        numClustered = np.bincount(
+            classifierCodes[clustered], minlength=numClassifiers)
+        squaredOffsets = np.bincount(
+            classifierCodes[clustered],
+            weights=0.5 * np.sum(offsets[clustered]**2, axis=1),
+            minlength=numClassifiers)
+
+        precisions = (nBeta * lowCountProb + numClustered) / (nBeta + numMarks)
+        variances = (nVariance * priorVariance + squaredOffsets) / (
+            nVariance + numClustered)
+        return KeyPointSkills(uniqueIds, precisions, variances)
+
+    def assign(self, skills, classifiers):
+        """Write skills back to the keyPointSkills of Classifier instances as
+        dictionaries with keys 'precision' and 'variance'. Their label skills
+        are left untouched.
+        """
+        rows = {
+            classifierId: row
+            for row, classifierId in enumerate(skills.classifierIds)
+        }
+        for classifier in classifiers:
+            row = rows.get(classifier.id)
+            classifier.keyPointSkills = ({
+                'precision': float(skills.precisions[row]),
+                'variance': float(skills.variances[row])
+            } if row is not None else {})
+
+
+class KeyPointAggregator():
+    """Aggregates the keypoint marks of a Subjects collection.
+
+    Each subject's marks are clustered, classifier skills are estimated from
+    all subjects' clusters, and cluster centres are then recomputed weighting
+    each mark by its classifier's precision over variance, so that careful
+    classifiers pull the centres further.
+    """
+
+    def __init__(self, clusterer=None, skillEngine=None, **skillArgs):
+        """Arguments:
+        -- clusterer - Defaults to KeyPointClusterer().
+        -- skillEngine - Defaults to KeyPointSkillEngine().
+        -- skillArgs - Keyword arguments forwarded to the skill engine.
+        """
+        self._clusterer = (clusterer
+                           if clusterer is not None else KeyPointClusterer())
+        self._skillEngine = (skillEngine if skillEngine is not None else
+                             KeyPointSkillEngine())
+        self._skillArgs = skillArgs
+        self._skills = None
+
+    @property
+    def clusterer(self):
+        return self._clusterer
+
+    @property
+    def skillEngine(self):
+        return self._skillEngine
+
+    @property
+    def skills(self):
+        return self._skills
+
+    def __call__(self, subjects, classifiers=None):
+        """Aggregate the AnnotationKeyPoint annotations of subjects.
+
+        Arguments:
+        -- subjects - Subjects collection.
+        -- classifiers - Optional iterable of Classifier instances whose
+        keyPointSkills are updated.
+
+        Returns: Dictionary mapping subject ids to KeyPointClusters.
+        """
+        marks = {}
+        for subject in subjects.items():
+            points, labels, classifierIds = keyPointArrays(
+                subject.annotations.items())
+            memberships = self._clusterer.memberships(points)
+            marks[subject.id] = (points, labels, classifierIds, memberships)
+
+        # Offsets of every mark from its unweighted cluster centre.
+        allIds, allOffsets, allClustered = [], [], []
+        for points, labels, classifierIds, memberships in marks.values():
+            clusters = self._clusterer.summarize(points, memberships)
+            clustered = memberships >= 0
+            offsets = np.zeros_like(points)
+            offsets[clustered] = (points[clustered] -
+                                  clusters.centres[memberships[clustered]])
+            allIds.extend(classifierIds)
+            allOffsets.append(offsets)
+            allClustered.append(clustered)
+        self._skills = self._skillEngine(
+            allIds,
+            np.concatenate(allOffsets) if allOffsets else np.empty((0, 2)),
+            np.concatenate(allClustered) if allClustered else np.empty(0),
+            **self._skillArgs)
+        if classifiers is not None:
+            self._skillEngine.assign(self._skills, classifiers)
+
+        weights = dict(
+            zip(self._skills.classifierIds,
+                self._skills.precisions / self._skills.variances))
+        return {
+            subjectId: self._clusterer.summarize(
+                points, memberships, labels, classifierIds,
+                [weights[classifierId] for classifierId in classifierIds])
+            for subjectId, (points, labels, classifierIds,
+                            memberships) in marks.items()
+        }
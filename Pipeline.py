@@ -0,0 +1,300 @@
+import queue
+import threading
+import time
+
+
+class StageStats():
+    """Throughput counters for one pipeline stage.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._lock = threading.Lock()
+        self._numBatches = 0
+        self._numItems = 0
+        self._busySeconds = 0.0
+        self._blockedSeconds = 0.0
+        self._startTime = None
+        self._stopTime = None
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def numBatches(self):
+        return self._numBatches
+
+    @property
+    def numItems(self):
+        return self._numItems
+
+    @property
+    def busySeconds(self):
+        """Time spent doing work, excluding time blocked on the queue.
+        """
+        return self._busySeconds
+
+    @property
+    def blockedSeconds(self):
+        """Time spent waiting on the queue: for the receiver, waiting for space
+        (i.e. throttled by backpressure); for the updater, waiting for work.
+        """
+        return self._blockedSeconds
+
+    @property
+    def elapsedSeconds(self):
+        if self._startTime is None:
+            return 0.0
+        stopTime = (self._stopTime
+                    if self._stopTime is not None else time.perf_counter())
+        return stopTime - self._startTime
+
+    @property
+    def itemsPerSecond(self):
+        elapsed = self.elapsedSeconds
+        return self._numItems / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def utilization(self):
+        """Fraction of the elapsed time spent busy.
+        """
+        elapsed = self.elapsedSeconds
+        return self._busySeconds / elapsed if elapsed > 0 else 0.0
+
+    def start(self):
+        self._startTime = time.perf_counter()
+
+    def stop(self):
+        self._stopTime = time.perf_counter()
+
+    def record(self, numItems, busySeconds):
+        with self._lock:
+            self._numBatches += 1
+            self._numItems += numItems
+            self._busySeconds += busySeconds
+
+    def recordBlocked(self, blockedSeconds):
+        with self._lock:
+            self._blockedSeconds += blockedSeconds
+
+    def asDict(self):
+        return {
+            'name': self.name,
+            'numBatches': self.numBatches,
+            'numItems': self.numItems,
+            'busySeconds': self.busySeconds,
+            'blockedSeconds': self.blockedSeconds,
+            'elapsedSeconds': self.elapsedSeconds,
+            'itemsPerSecond': self.itemsPerSecond,
+            'utilization': self.utilization
+        }
+
+    def __str__(self):
+        return ('{name}: {numBatches} batches, {numItems} items, '
+                '{itemsPerSecond:.1f} items/s, {utilization:.0%} busy, '
+                '{blockedSeconds:.2f}s blocked'.format(**self.asDict()))
+
+
+class Pipeline():
+    """Runs a receiver stage and a model-update stage in separate threads,
+    connected by a bounded queue of batches.
+
+    The receiver thread repeatedly calls receive() and enqueues each non-empty
+    batch. The updater thread dequeues batches and calls update(batch). When
+    the updater falls behind and the queue is full, the receiver blocks
+    before polling again, so unreceived messages stay in the source queue
+    (backpressure). Threads suffice because the receiver spends its time in
+    network I/O and the updater largely in NumPy, both of which release the
+    GIL.
+
+    An exception raised by either stage stops the pipeline and is re-raised
+    by join().
+    """
+
+    # Interval at which blocked stages check whether the pipeline is stopping.
+    pollInterval = 0.1
+
+    def __init__(self,
+                 receive,
+                 update,
+                 maxQueueSize=2,
+                 sizeOf=len,
+                 maxBatches=None,
+                 maxIdlePolls=None):
+        """Arguments:
+        -- receive - Callable returning the next batch.
+        -- update - Callable consuming a batch.
+        -- maxQueueSize - Maximum number of received batches awaiting update.
+        -- sizeOf - Callable returning the number of items in a batch. Batches
+        of size zero are discarded.
+        -- maxBatches - Optional number of non-empty batches after which the
+        receiver stops.
+        -- maxIdlePolls - Optional number of consecutive empty batches after
+        which the receiver stops.
+        """
+        self._receive = receive
+        self._update = update
+        self._sizeOf = sizeOf
+        self._maxBatches = maxBatches
+        self._maxIdlePolls = maxIdlePolls
+        self._queue = queue.Queue(maxsize=maxQueueSize)
+        self._maxQueueDepth = 0
+        self._stopping = threading.Event()
+        self._receiverDone = threading.Event()
+        self._errors = []
+        self._receiverStats = StageStats('receiver')
+        self._updaterStats = StageStats('updater')
+        self._threads = []
+
+    @property
+    def receiverStats(self):
+        return self._receiverStats
+
+    @property
+    def updaterStats(self):
+        return self._updaterStats
+
+    @property
+    def queueDepth(self):
+        """Number of batches received but not yet being updated.
+        """
+        return self._queue.qsize()
+
+    @property
+    def maxQueueDepth(self):
+        return self._maxQueueDepth
+
+    @property
+    def maxQueueSize(self):
+        return self._queue.maxsize
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def stats(self):
+        return {
+            'receiver': self.receiverStats.asDict(),
+            'updater': self.updaterStats.asDict(),
+            'queueDepth': self.queueDepth,
+            'maxQueueDepth': self.maxQueueDepth,
+            'maxQueueSize': self.maxQueueSize
+        }
+
+    def _fail(self, error):
+        self._errors.append(error)
+        self._stopping.set()
+
+    def _enqueue(self, batch):
+        """Put batch on the queue, blocking while it is full. Returns False if
+        the pipeline stopped while blocked.
+        """
+        startTime = time.perf_counter()
+        try:
+            while not self._stopping.is_set():
+                try:
+                    self._queue.put(batch, timeout=self.pollInterval)
+                except queue.Full:
+                    continue
+                self._maxQueueDepth = max(self._maxQueueDepth,
+                                          self._queue.qsize())
+                return True
+            return False
+        finally:
+            self._receiverStats.recordBlocked(time.perf_counter() - startTime)
+
+    def _runReceiver(self):
+        self._receiverStats.start()
+        numBatches, numIdlePolls = 0, 0
+        try:
+            while not self._stopping.is_set():
+                if (self._maxBatches is not None
+                        and numBatches >= self._maxBatches):
+                    break
+                if (self._maxIdlePolls is not None
+                        and numIdlePolls >= self._maxIdlePolls):
+                    break
+                startTime = time.perf_counter()
+                batch = self._receive()
+                numItems = self._sizeOf(batch)
+                self._receiverStats.record(numItems,
+                                           time.perf_counter() - startTime)
+                if not numItems:
+                    numIdlePolls += 1
+                    continue
+                numIdlePolls = 0
+                if not self._enqueue(batch):
+                    break
+                numBatches += 1
+        except Exception as error:
+            self._fail(error)
+        finally:
+            self._receiverStats.stop()
+            self._receiverDone.set()
+
+    def _runUpdater(self):
+        self._updaterStats.start()
+        try:
+            while True:
+                startTime = time.perf_counter()
+                try:
+                    batch = self._queue.get(timeout=self.pollInterval)
+                except queue.Empty:
+                    self._updaterStats.recordBlocked(time.perf_counter() -
+                                                     startTime)
+                    # Stop once the receiver has finished and the queue is
+                    # drained, or immediately after a failure.
+                    if self._receiverDone.is_set() or self._errors:
+                        break
+                    continue
+                self._updaterStats.recordBlocked(time.perf_counter() -
+                                                 startTime)
+                if self._errors:
+                    break
+                startTime = time.perf_counter()
+                self._update(batch)
+                self._updaterStats.record(
+                    self._sizeOf(batch), time.perf_counter() - startTime)
+        except Exception as error:
+            self._fail(error)
+        finally:
+            self._updaterStats.stop()
+
+    def start(self):
+        if self.running:
+            raise RuntimeError('The pipeline is already running.')
+        self._stopping.clear()
+        self._receiverDone.clear()
+        self._threads = [
+            threading.Thread(target=self._runReceiver, daemon=True),
+            threading.Thread(target=self._runUpdater, daemon=True)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Ask the receiver to stop. Batches already received are still
+        updated.
+        """
+        self._stopping.set()
+
+    def join(self, timeout=None):
+        """Wait for both stages to finish. Re-raises the first exception raised
+        by a stage.
+
+        Returns: True if both stages finished within timeout seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(
+                deadline - time.monotonic(), 0))
+        if self._errors:
+            raise self._errors[0]
+        return not self.running
+
+    def run(self):
+        """Start the pipeline and wait for it to finish.
+        """
+        self.start()
+        self.join()
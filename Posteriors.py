@@ -0,0 +1,593 @@
+import collections
+
+import numpy as np
+
+from AnnotationModels import AnnotationPriorBase
+from AnnotationStore import AnnotationStore
+from Risk import LossModelBase
+from Subjects import Subjects
+
+PosteriorSummary = collections.namedtuple(
+    'PosteriorSummary', ['posteriors', 'mapLabelCodes', 'mapLabels', 'risks'])
+"""Result of a batched posterior evaluation.
+
+-- posteriors - Array with shape (numSubjects, numLabels) of posterior
+probabilities for each subject and candidate true label.
+-- mapLabelCodes - Array of the maximum a posteriori label code per subject.
+-- mapLabels - List of the corresponding label values.
+-- risks - Array of the expected loss of predicting the MAP label per subject,
+or None if no loss model was supplied.
+"""
+
+
+def logSumExp(logValues, axis=-1):
+    """Numerically stable log(sum(exp(logValues))) along axis. Rows in which
+    every entry is -inf yield -inf.
+    """
+    maxima = np.max(logValues, axis=axis, keepdims=True)
+    finiteMaxima = np.where(np.isfinite(maxima), maxima, 0.0)
+    with np.errstate(divide='ignore'):
+        sums = np.log(
+            np.sum(np.exp(logValues - finiteMaxima), axis=axis, keepdims=True))
+    return np.squeeze(sums + finiteMaxima, axis=axis)
+
+
+class PosteriorEngineBinary():
+    """Computes subject posteriors, MAP labels and risks for every subject in an
+    AnnotationStore at once under the Bernoulli model of AnnotationModelBinary.
+
+    Per-annotation log-likelihoods are segment-summed per subject and
+    normalised with a log-sum-exp, so subjects with many annotations do not
+    underflow.
+    """
+
+    def __init__(self, observedLabelsOnly=True):
+        """Arguments:
+        -- observedLabelsOnly - If True (the default), only labels assigned by at
+        least one of a subject's annotations are candidate true labels for that
+        subject, matching Subject.computeTrueLabel and Risk. Subjects without
+        labelled annotations consider all labels.
+        """
+        self._observedLabelsOnly = observedLabelsOnly
+
+    @property
+    def observedLabelsOnly(self):
+        return self._observedLabelsOnly
+
+    @observedLabelsOnly.setter
+    def observedLabelsOnly(self, observedLabelsOnly):
+        self._observedLabelsOnly = observedLabelsOnly
+
+    def annotationLogLikelihoods(self, store, skills, positions=None):
+        """Return an array with shape (numAnnotations, numLabels) holding the log
+        probability of each annotation's label given each candidate true label.
+
+        Arguments:
+        -- store - AnnotationStore holding the annotations.
+        -- skills - Array with shape (numClassifiers, numLabels). NaN entries
+        (labels a classifier has never assigned) are treated as 0.5, as in
+        Classifier.getSkill.
+        -- positions - Optional index array restricting the annotations used.
+        """
+        classifierIndex = store.classifierIndex
+        labelCodes = store.labelCodes
+        if positions is not None:
+            classifierIndex = classifierIndex[positions]
+            labelCodes = labelCodes[positions]
+        skills = np.where(np.isnan(skills), 0.5, skills)[classifierIndex]
+        matches = labelCodes[:, np.newaxis] == np.arange(store.numLabels)
+        with np.errstate(divide='ignore'):
+            logLikelihoods = np.where(matches, np.log(skills),
+                                      np.log1p(-skills))
+        # Annotations with a missing label carry no information.
+        logLikelihoods[labelCodes == store.missingCode] = 0.0
+        return logLikelihoods
+
+    def logPriors(self, store, annotationPriorModel):
+        if not issubclass(type(annotationPriorModel), AnnotationPriorBase):
+            raise TypeError(
+                'The annotationPriorModel argument must inherit from {}. Type {} passed.'.
+                format(AnnotationPriorBase.__name__, type(annotationPriorModel)))
+        with np.errstate(divide='ignore'):
+            return np.log([
+                annotationPriorModel(label) for label in store.labels
+            ])
+
+    def lossMatrix(self, store, lossModel):
+        """Return the matrix of lossModel(trueLabel, predictedLabel) indexed by
+        [trueLabelCode, predictedLabelCode].
+        """
+        if not issubclass(type(lossModel), LossModelBase):
+            raise TypeError(
+                'The lossModel argument must inherit from {}. Type {} passed.'.
+                format(LossModelBase.__name__, type(lossModel)))
+        return np.array(
+            [[lossModel(trueLabel, predictedLabel)
+              for predictedLabel in store.labels]
+             for trueLabel in store.labels],
+            dtype=float)
+
+    def __call__(self,
+                 store,
+                 skills,
+                 annotationPriorModel,
+                 lossModel=None,
+                 predictedLabelCodes=None,
+                 subjectCodes=None):
+        """Evaluate posteriors for all subjects in store.
+
+        Arguments:
+        -- store - AnnotationStore holding the annotations.
+        -- skills - Array with shape (numClassifiers, numLabels), as returned by
+        ClassifierSkillEngineBinary.
+        -- annotationPriorModel - Subclass of AnnotationPriorBase giving the
+        prior probability of each true label.
+        -- lossModel - Optional subclass of LossModelBase. If supplied, risks are
+        evaluated.
+        -- predictedLabelCodes - Optional array of predicted label codes against
+        which risks are evaluated. Defaults to the MAP labels.
+        -- subjectCodes - Optional array of dense subject indices. If supplied,
+        only these subjects are evaluated (e.g. those that received new
+        annotations) and the rows of the result follow its order.
+
+        Returns: PosteriorSummary
+        """
+        if not isinstance(store, AnnotationStore):
+            raise TypeError(
+                'The store argument must be of type {}. Type {} passed.'.
+                format(type(AnnotationStore), type(store)))
+
+        numLabels = store.numLabels
+        if subjectCodes is None:
+            numSubjects = store.numSubjects
+            positions = None
+            subjectIndex = store.subjectIndex
+            labelCodes = store.labelCodes
+        else:
+            subjectCodes = np.atleast_1d(subjectCodes)
+            numSubjects = subjectCodes.size
+            subjectPositions = [
+                store.subjectPositions(code) for code in subjectCodes
+            ]
+            positions = np.concatenate(
+                subjectPositions + [np.empty(0, dtype=np.int64)])
+            subjectIndex = np.repeat(
+                np.arange(numSubjects),
+                [codePositions.size for codePositions in subjectPositions])
+            labelCodes = store.labelCodes[positions]
+
+        logLikelihoods = self.annotationLogLikelihoods(store, skills,
+                                                       positions)
+        # Segment-sum every label column at once over flattened
+        # (subject, label) cells.
+        cells = subjectIndex[:, np.newaxis] * numLabels + np.arange(numLabels)
+        logPosteriors = np.bincount(
+            cells.ravel(),
+            weights=logLikelihoods.ravel(),
+            minlength=numSubjects * numLabels).reshape(numSubjects, numLabels)
+        logPosteriors += self.logPriors(store, annotationPriorModel)
+
+        if self.observedLabelsOnly:
+            labelled = labelCodes != store.missingCode
+            observed = np.bincount(
+                subjectIndex[labelled] * numLabels + labelCodes[labelled],
+                minlength=numSubjects * numLabels).reshape(
+                    numSubjects, numLabels) > 0
+            observed[~observed.any(axis=1)] = True
+            logPosteriors[~observed] = -np.inf
+
+        return self.summarize(store, logPosteriors, lossModel,
+                              predictedLabelCodes)
+
+    def summarize(self,
+                  store,
+                  logPosteriors,
+                  lossModel=None,
+                  predictedLabelCodes=None):
+        """Normalise unnormalised log posteriors and derive MAP labels and
+        risks.
+        """
+        logNormalizers = logSumExp(logPosteriors, axis=1)
+        with np.errstate(invalid='ignore'):
+            posteriors = np.exp(logPosteriors - logNormalizers[:, np.newaxis])
+        posteriors[~np.isfinite(logNormalizers)] = 1.0 / max(
+            logPosteriors.shape[1], 1)
+
+        mapLabelCodes = (np.argmax(posteriors, axis=1) if posteriors.shape[1]
+                         else np.full(posteriors.shape[0], store.missingCode))
+        mapLabels = [store.decodeLabel(code) for code in mapLabelCodes]
+
+        risks = None
+        if lossModel is not None:
+            if predictedLabelCodes is None:
+                predictedLabelCodes = mapLabelCodes
+            losses = self.lossMatrix(store, lossModel)
+            risks = np.einsum('st,st->s', posteriors,
+                              losses[:, predictedLabelCodes].T)
+
+        return PosteriorSummary(posteriors, mapLabelCodes, mapLabels, risks)
+
+    def skillMatrix(self, store, classifiers):
+        """Assemble the skill array for store from Classifier instances whose
+        skills have already been computed. Labels missing from a classifier's
+        skills are NaN.
+        """
+        skills = np.full((store.numClassifiers, store.numLabels), np.nan)
+        for classifier in classifiers:
+            code = store.classifierIdMap.get(classifier.id)
+            if code is None:
+                continue
+            for label, skill in classifier.skills.items():
+                labelCode = store.labelCodeMap.get(label)
+                if labelCode is not None:
+                    skills[code, labelCode] = skill
+        return skills
+
+    def computeTrueLabels(self,
+                          subjects,
+                          annotationPriorModel,
+                          lossModel=None,
+                          skills=None,
+                          labels=None):
+        """Compute posteriors for a Subjects collection, set each subject's true
+        label to its MAP estimate and return the PosteriorSummary, whose rows
+        follow the order of subjects.
+
+        Arguments:
+        -- subjects - Subjects collection whose classifiers' skills have been
+        computed.
+        -- skills - Optional precomputed skill array for the store of subjects
+        (see AnnotationStore.forSubjects). By default skills are read from the
+        Classifier instances.
+        -- labels - Optional sequence of valid labels. Defaults to
+        [False, True].
+        """
+        if not isinstance(subjects, Subjects):
+            raise TypeError(
+                'The subjects argument must be of type {}. Type {} passed.'.
+                format(type(Subjects), type(subjects)))
+        store = AnnotationStore.forSubjects(
+            subjects, labels=labels if labels is not None else [False, True])
+        if skills is None:
+            skills = self.skillMatrix(store, {
+                annotation.classifier.id: annotation.classifier
+                for subject in subjects.items()
+                for annotation in subject.annotations.items()
+            }.values())
+        summary = self(store, skills, annotationPriorModel, lossModel)
+        store.setTrueLabelCodes(summary.mapLabelCodes)
+        for subject in subjects.items():
+            subject.trueLabel = summary.mapLabels[store.subjectCode(subject.id)]
+        return summary
+
+
+class PosteriorEngineCategorical(PosteriorEngineBinary):
+    """Computes subject posteriors, MAP labels and risks for every subject in an
+    AnnotationStore at once under the confusion matrix model of
+    AnnotationModelCategorical.
+
+    Skills are arrays with shape (numClassifiers, numLabels, numLabels), as
+    returned by ClassifierSkillEngineCategorical. Each annotation's
+    log-likelihoods for all candidate true labels are gathered from the
+    logarithm of its classifier's confusion matrix in one indexing operation.
+    """
+
+    def annotationLogLikelihoods(self, store, skills, positions=None):
+        """Return an array with shape (numAnnotations, numLabels) holding the log
+        probability of each annotation's label given each candidate true label.
+
+        Arguments:
+        -- store - AnnotationStore holding the annotations.
+        -- skills - Array with shape (numClassifiers, numLabels, numLabels). NaN
+        entries (e.g. classifiers unseen in a previous round) are treated as
+        1 / numLabels.
+        -- positions - Optional index array restricting the annotations used.
+        """
+        classifierIndex = store.classifierIndex
+        labelCodes = store.labelCodes
+        if positions is not None:
+            classifierIndex = classifierIndex[positions]
+            labelCodes = labelCodes[positions]
+        numLabels = store.numLabels
+        with np.errstate(divide='ignore'):
+            logSkills = np.log(
+                np.where(np.isnan(skills), 1.0 / max(numLabels, 1), skills))
+        # Missing labels (-1) index the last column and are zeroed below.
+        logLikelihoods = logSkills[classifierIndex, :, labelCodes]
+        logLikelihoods[labelCodes == store.missingCode] = 0.0
+        return logLikelihoods
+
+    def skillMatrix(self, store, classifiers):
+        """Assemble the skill array for store from Classifier instances whose
+        skills are dictionaries keyed on (trueLabel, label) pairs. Missing
+        entries are NaN.
+        """
+        numLabels = store.numLabels
+        skills = np.full((store.numClassifiers, numLabels, numLabels), np.nan)
+        for classifier in classifiers:
+            code = store.classifierIdMap.get(classifier.id)
+            if code is None:
+                continue
+            for (trueLabel, label), skill in classifier.skills.items():
+                trueLabelCode = store.labelCodeMap.get(trueLabel)
+                labelCode = store.labelCodeMap.get(label)
+                if trueLabelCode is not None and labelCode is not None:
+                    skills[code, trueLabelCode, labelCode] = skill
+        return skills
+
+
+class LogOddsAccumulatorBinary():
+    """Maintains the posterior log-odds of every subject in a binary
+    AnnotationStore online, so that posteriors and risks are available
+    immediately after each annotation arrives.
+
+    Under AnnotationModelBinary the log-odds of a subject being True is the
+    log prior odds plus, for each annotation, a log-likelihood ratio that
+    depends only on the annotation's label and the skills of its classifier.
+    Each subject's sum is updated in constant time when an annotation is
+    appended. When skills change, only the annotations of the classifiers whose
+    skills changed are re-weighted.
+
+    Results match PosteriorEngineBinary up to floating point rounding, which
+    can accumulate over many skill updates; recompute() resets it.
+    """
+
+    # Skills are clipped away from 0 and 1 so that every ratio is finite.
+    skillEpsilon = 1e-12
+
+    def __init__(self,
+                 store,
+                 annotationPriorModel,
+                 lossModel=None,
+                 skills=None,
+                 observedLabelsOnly=True):
+        """Arguments:
+        -- store - AnnotationStore with the labels [False, True]. Annotations
+        already in the store are accounted for.
+        -- annotationPriorModel - Subclass of AnnotationPriorBase giving the
+        prior probability of each true label.
+        -- lossModel - Optional subclass of LossModelBase. Required by risks().
+        -- skills - Optional array with shape (numClassifiers, numLabels), as
+        returned by ClassifierSkillEngineBinary. Classifiers without skills
+        carry no information until setSkills() is called.
+        -- observedLabelsOnly - As for PosteriorEngineBinary.
+        """
+        if not isinstance(store, AnnotationStore):
+            raise TypeError(
+                'The store argument must be of type {}. Type {} passed.'.
+                format(type(AnnotationStore), type(store)))
+        self._store = store
+        self._falseCode = store.labelCode(False)
+        self._trueCode = store.labelCode(True)
+        if store.numLabels != 2:
+            raise ValueError(
+                'The store must hold binary labels. Labels {} found.'.format(
+                    store.labels))
+        self._engine = PosteriorEngineBinary(observedLabelsOnly)
+        logPriors = self._engine.logPriors(store, annotationPriorModel)
+        self._logPriorOdds = logPriors[self._trueCode] - logPriors[
+            self._falseCode]
+        self._losses = (self._engine.lossMatrix(store, lossModel)
+                        if lossModel is not None else None)
+
+        # Log-likelihood ratio of each (classifier, label code) pair. The last
+        # column is zero so that the missing label code (-1) indexes it.
+        self._weights = np.zeros((0, 3))
+        self._logOdds = np.zeros(0)
+        self._labelCounts = np.zeros((0, 2), dtype=np.int64)
+        self._numAccounted = 0
+        if skills is not None:
+            self._weights = self.weights(skills)
+        self.sync()
+
+    @property
+    def store(self):
+        return self._store
+
+    @property
+    def numAccounted(self):
+        """Number of store annotations included in the log-odds.
+        """
+        return self._numAccounted
+
+    @property
+    def observedLabelsOnly(self):
+        return self._engine.observedLabelsOnly
+
+    def weights(self, skills):
+        """Return the log-likelihood ratio of each classifier assigning each
+        label, as an array with shape (numClassifiers, 3) whose last column
+        (the missing label) is zero.
+        """
+        skills = np.clip(
+            np.where(np.isnan(skills), 0.5, skills), self.skillEpsilon,
+            1.0 - self.skillEpsilon)
+        trueSkills = skills[:, self._trueCode]
+        falseSkills = skills[:, self._falseCode]
+        weights = np.zeros((skills.shape[0], 3))
+        weights[:, self._trueCode] = (
+            np.log(trueSkills) - np.log1p(-falseSkills))
+        weights[:, self._falseCode] = (
+            np.log1p(-trueSkills) - np.log(falseSkills))
+        return weights
+
+    def _grow(self):
+        numSubjects = self._store.numSubjects
+        if numSubjects > self._logOdds.size:
+            capacity = max(numSubjects, 2 * self._logOdds.size)
+            logOdds = np.full(capacity, self._logPriorOdds)
+            logOdds[:self._logOdds.size] = self._logOdds
+            labelCounts = np.zeros((capacity, 2), dtype=np.int64)
+            labelCounts[:self._labelCounts.shape[0]] = self._labelCounts
+            self._logOdds, self._labelCounts = logOdds, labelCounts
+        numClassifiers = self._store.numClassifiers
+        if numClassifiers > self._weights.shape[0]:
+            capacity = max(numClassifiers, 2 * self._weights.shape[0])
+            weights = np.zeros((capacity, 3))
+            weights[:self._weights.shape[0]] = self._weights
+            self._weights = weights
+
+    def sync(self):
+        """Account for the annotations appended to the store since the last
+        call. Costs O(1) per annotation.
+
+        Returns: Array of the dense indices of the subjects updated.
+        """
+        start, stop = self._numAccounted, len(self._store)
+        if start == stop:
+            return np.empty(0, dtype=np.int64)
+        self._grow()
+        subjectIndex = self._store.subjectIndex[start:stop]
+        labelCodes = self._store.labelCodes[start:stop]
+        if stop - start == 1:
+            # Scalar fast path for annotations arriving one at a time.
+            subjectCode, labelCode = int(subjectIndex[0]), int(labelCodes[0])
+            self._logOdds[subjectCode] += self._weights[
+                self._store.classifierIndex[start], labelCode]
+            if labelCode != self._store.missingCode:
+                self._labelCounts[subjectCode, labelCode] += 1
+        else:
+            np.add.at(
+                self._logOdds, subjectIndex,
+                self._weights[self._store.classifierIndex[start:stop],
+                              labelCodes])
+            labelled = labelCodes != self._store.missingCode
+            np.add.at(self._labelCounts,
+                      (subjectIndex[labelled], labelCodes[labelled]), 1)
+        self._numAccounted = stop
+        return np.unique(subjectIndex)
+
+    def append(self, annotationId, subjectId, classifierId, label):
+        """Append an annotation to the store and account for it.
+
+        Returns: Dense index of the annotated subject.
+        """
+        position = self._store.append(annotationId, subjectId, classifierId,
+                                      label)
+        self.sync()
+        return int(self._store.subjectIndex[position])
+
+    def setSkills(self, skills, classifierIds=None):
+        """Replace the classifier skills and adjust the log-odds of the
+        subjects annotated by classifiers whose skills changed. Costs
+        O(annotations of the changed classifiers).
+
+        Arguments:
+        -- skills - Array with shape (numClassifiers, numLabels).
+        -- classifierIds - Optional sequence of the classifier ids labelling the
+        rows of skills (e.g. when the skills were computed over another store).
+        By default rows follow the store's classifier codes.
+
+        Returns: Array of the dense indices of the subjects updated.
+        """
+        self.sync()
+        weights = self.weights(np.asarray(skills, dtype=float))
+        if classifierIds is not None:
+            codes = [
+                self._store.classifierIdMap.get(classifierId)
+                for classifierId in classifierIds
+            ]
+            rows = [row for row, code in enumerate(codes) if code is not None]
+            aligned = self._weights.copy()
+            aligned[[codes[row] for row in rows]] = weights[rows]
+            weights = aligned
+        else:
+            aligned = np.zeros_like(self._weights)
+            numRows = min(weights.shape[0], aligned.shape[0])
+            aligned[:numRows] = weights[:numRows]
+            weights = aligned
+
+        changedCodes = np.flatnonzero(np.any(weights != self._weights, axis=1))
+        if changedCodes.size == 0:
+            return changedCodes
+        if changedCodes.size > self._store.numClassifiers // 8:
+            # Re-weighting most annotations: a full recompute is cheaper.
+            self._weights = weights
+            self.recompute()
+            return np.arange(self._store.numSubjects)
+
+        positions = np.concatenate([
+            self._store.classifierPositions(code) for code in changedCodes
+        ])
+        positions = positions[positions < self._numAccounted]
+        classifierIndex = self._store.classifierIndex[positions]
+        labelCodes = self._store.labelCodes[positions]
+        subjectIndex = self._store.subjectIndex[positions]
+        np.add.at(
+            self._logOdds, subjectIndex,
+            weights[classifierIndex, labelCodes] -
+            self._weights[classifierIndex, labelCodes])
+        self._weights = weights
+        return np.unique(subjectIndex)
+
+    def recompute(self):
+        """Recompute the log-odds of every subject from scratch.
+        """
+        self._grow()
+        numAccounted = self._numAccounted
+        numSubjects = self._logOdds.size
+        subjectIndex = self._store.subjectIndex[:numAccounted]
+        labelCodes = self._store.labelCodes[:numAccounted]
+        self._logOdds = self._logPriorOdds + np.bincount(
+            subjectIndex,
+            weights=self._weights[self._store.classifierIndex[:numAccounted],
+                                  labelCodes],
+            minlength=numSubjects)
+        labelled = labelCodes != self._store.missingCode
+        self._labelCounts = np.bincount(
+            subjectIndex[labelled] * 2 + labelCodes[labelled],
+            minlength=2 * numSubjects).reshape(numSubjects, 2)
+
+    def logOdds(self, subjectCodes=None):
+        """Return the log-odds of True for all subjects, or for the subjects
+        with the dense indices subjectCodes, ignoring observedLabelsOnly.
+        """
+        self.sync()
+        if subjectCodes is None:
+            return self._logOdds[:self._store.numSubjects].copy()
+        return self._logOdds[subjectCodes]
+
+    def posteriors(self, subjectCodes=None):
+        """Return an array with shape (numSubjects, 2) of posterior
+        probabilities, with columns following the store's label codes.
+        """
+        logOdds = np.atleast_1d(self.logOdds(subjectCodes))
+        trueProbs = 0.5 * (1.0 + np.tanh(0.5 * logOdds))
+        if self.observedLabelsOnly:
+            counts = self._labelCounts[:self._store.numSubjects]
+            if subjectCodes is not None:
+                counts = np.atleast_2d(counts[subjectCodes])
+            trueProbs = np.where(
+                counts[:, self._trueCode] == 0,
+                np.where(counts[:, self._falseCode] == 0, trueProbs, 0.0),
+                np.where(counts[:, self._falseCode] == 0, 1.0, trueProbs))
+        posteriors = np.empty((trueProbs.size, 2))
+        posteriors[:, self._trueCode] = trueProbs
+        posteriors[:, self._falseCode] = 1.0 - trueProbs
+        return posteriors
+
+    def summary(self, subjectCodes=None, predictedLabelCodes=None):
+        """Return a PosteriorSummary for all subjects, or for the subjects with
+        the dense indices subjectCodes. Risks are included if a loss model was
+        supplied.
+        """
+        posteriors = self.posteriors(subjectCodes)
+        mapLabelCodes = np.argmax(posteriors, axis=1)
+        mapLabels = [self._store.decodeLabel(code) for code in mapLabelCodes]
+        risks = None
+        if self._losses is not None:
+            if predictedLabelCodes is None:
+                predictedLabelCodes = mapLabelCodes
+            risks = np.einsum('st,st->s', posteriors,
+                              self._losses[:, predictedLabelCodes].T)
+        return PosteriorSummary(posteriors, mapLabelCodes, mapLabels, risks)
+
+    def risks(self, subjectCodes=None):
+        """Return the current risk of predicting the MAP label for all subjects,
+        or for the subjects with the dense indices subjectCodes.
+        """
+        if self._losses is None:
+            raise RuntimeError(
+                'Risks require a loss model. Pass lossModel to the constructor.'
+            )
+        return self.summary(subjectCodes).risks
@@ -0,0 +1,347 @@
+# Message queue backends for the Caesar receivers.
+#
+# Receivers talk to queues through the subset of the boto3 SQS client
+# interface defined by QueueBackend, so the AWS queue can be replaced by the
+# in-process LocalQueueBackend for offline load testing.
+
+import collections
+import hashlib
+import heapq
+import itertools
+import json
+import random
+import threading
+import time
+
+
+class QueueBackend():
+    """Base class. Subclasses implement the subset of the boto3 SQS client
+    interface used by the receivers. Method and argument names follow boto3 so
+    that a boto3 client can be used wherever a QueueBackend is expected.
+    """
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, **kwargs):
+        raise NotImplementedError(
+            'This base class does not currently implement this method.')
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        raise NotImplementedError(
+            'This base class does not currently implement this method.')
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        raise NotImplementedError(
+            'This base class does not currently implement this method.')
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        raise NotImplementedError(
+            'This base class does not currently implement this method.')
+
+    def send_message_batch(self, QueueUrl, Entries):
+        raise NotImplementedError(
+            'This base class does not currently implement this method.')
+
+
+class SQSQueueBackend(QueueBackend):
+    """Delegates to a boto3 SQS client. boto3 is only required when this
+    backend is instantiated.
+    """
+
+    def __init__(self, client=None, **clientArgs):
+        if client is None:
+            import boto3
+            client = boto3.client('sqs', **clientArgs)
+        self._client = client
+
+    @property
+    def client(self):
+        return self._client
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, **kwargs):
+        return self.client.receive_message(
+            QueueUrl=QueueUrl,
+            MaxNumberOfMessages=MaxNumberOfMessages,
+            **kwargs)
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        return self.client.delete_message(
+            QueueUrl=QueueUrl, ReceiptHandle=ReceiptHandle)
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        return self.client.delete_message_batch(
+            QueueUrl=QueueUrl, Entries=Entries)
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        return self.client.send_message(
+            QueueUrl=QueueUrl, MessageBody=MessageBody, **kwargs)
+
+    def send_message_batch(self, QueueUrl, Entries):
+        return self.client.send_message_batch(
+            QueueUrl=QueueUrl, Entries=Entries)
+
+
+class LocalQueueMessage():
+    def __init__(self, messageId, body):
+        self.messageId = messageId
+        self.body = body
+        self.md5OfBody = hashlib.md5(body.encode()).hexdigest()
+        self.receiptHandle = None
+        self.receiveCount = 0
+
+
+class LocalQueueBackend(QueueBackend):
+    """In-process, thread-safe stand-in for an SQS standard queue.
+
+    Mimics the SQS semantics relied upon by the receivers:
+    -- Receiving returns at most 10 messages, each with MD5OfBody and a fresh
+    ReceiptHandle, and long polls for up to WaitTimeSeconds.
+    -- Received messages are invisible for the visibility timeout and are
+    redelivered if not deleted before it expires. Only the most recent receipt
+    handle of a message can delete it.
+    -- With probability duplicateProb a sent message is enqueued twice,
+    emulating at-least-once delivery. The copy becomes visible after a delay
+    drawn uniformly from [0, duplicateDelay] seconds, so duplicates can arrive
+    in different receive batches.
+
+    The QueueUrl arguments are accepted for compatibility and ignored.
+    """
+
+    maxBatchSize = 10
+
+    def __init__(self,
+                 visibilityTimeout=30,
+                 duplicateProb=0.0,
+                 duplicateDelay=0.0,
+                 seed=None,
+                 clock=time.monotonic):
+        """Arguments:
+        -- visibilityTimeout - Default visibility timeout in seconds, used when
+        receive_message is called without VisibilityTimeout.
+        -- duplicateProb - Probability that a sent message is delivered twice.
+        -- duplicateDelay - Maximum delay in seconds before a duplicate becomes
+        visible.
+        -- seed - Seed for the duplication random number generator.
+        -- clock - Function returning the current time in seconds.
+        """
+        self._visibilityTimeout = visibilityTimeout
+        self._duplicateProb = duplicateProb
+        self._duplicateDelay = duplicateDelay
+        self._random = random.Random(seed)
+        self._clock = clock
+        self._condition = threading.Condition()
+        self._visible = collections.deque()
+        self._inFlight = []
+        self._messages = {}
+        self._messageIds = itertools.count()
+        self._receiptHandles = itertools.count()
+        self._numSent = 0
+        self._numDeleted = 0
+        self._numRedelivered = 0
+
+    @property
+    def numVisible(self):
+        """Approximate number of messages available for retrieval.
+        """
+        with self._condition:
+            self._restoreExpired()
+            return len(self._visible)
+
+    @property
+    def numInFlight(self):
+        """Approximate number of messages that are neither deleted nor visible,
+        i.e. received but unacknowledged messages and delayed duplicates.
+        """
+        with self._condition:
+            self._restoreExpired()
+            return sum(
+                messageId in self._messages
+                and self._messages[messageId].receiptHandle == receiptHandle
+                for _, messageId, receiptHandle in self._inFlight)
+
+    @property
+    def numSent(self):
+        return self._numSent
+
+    @property
+    def numDeleted(self):
+        return self._numDeleted
+
+    @property
+    def numRedelivered(self):
+        return self._numRedelivered
+
+    def _restoreExpired(self):
+        now = self._clock()
+        while self._inFlight and self._inFlight[0][0] <= now:
+            _, messageId, receiptHandle = heapq.heappop(self._inFlight)
+            message = self._messages.get(messageId)
+            # Stale entries belong to deleted or since re-received messages.
+            if message is None or message.receiptHandle != receiptHandle:
+                continue
+            self._visible.append(messageId)
+            if receiptHandle is not None:
+                self._numRedelivered += 1
+
+    def _enqueue(self, body, delay=0.0):
+        messageId = str(next(self._messageIds))
+        message = LocalQueueMessage(messageId, body)
+        self._messages[messageId] = message
+        if delay > 0:
+            heapq.heappush(self._inFlight,
+                           (self._clock() + delay, messageId, None))
+        else:
+            self._visible.append(messageId)
+        self._numSent += 1
+        return message
+
+    def send_message(self, QueueUrl=None, MessageBody=None, **kwargs):
+        with self._condition:
+            message = self._enqueue(MessageBody)
+            if self._random.random() < self._duplicateProb:
+                self._enqueue(
+                    MessageBody,
+                    delay=self._random.uniform(0, self._duplicateDelay))
+            self._condition.notify_all()
+        return {
+            'MessageId': message.messageId,
+            'MD5OfMessageBody': message.md5OfBody
+        }
+
+    def send_message_batch(self, QueueUrl=None, Entries=()):
+        successful = []
+        for entry in Entries:
+            response = self.send_message(QueueUrl, entry['MessageBody'])
+            response.update({'Id': entry['Id']})
+            successful.append(response)
+        return {'Successful': successful, 'Failed': []}
+
+    def receive_message(self,
+                        QueueUrl=None,
+                        MaxNumberOfMessages=1,
+                        WaitTimeSeconds=0,
+                        VisibilityTimeout=None,
+                        **kwargs):
+        if not 1 <= MaxNumberOfMessages <= self.maxBatchSize:
+            raise ValueError(
+                'MaxNumberOfMessages must be between 1 and {}. {} passed.'.
+                format(self.maxBatchSize, MaxNumberOfMessages))
+        visibilityTimeout = (VisibilityTimeout if VisibilityTimeout is not None
+                             else self._visibilityTimeout)
+        deadline = self._clock() + WaitTimeSeconds
+        with self._condition:
+            self._restoreExpired()
+            while not self._visible:
+                remaining = deadline - self._clock()
+                if remaining <= 0:
+                    return {}
+                # Wake periodically so that expiring messages are redelivered.
+                self._condition.wait(min(remaining, 0.05))
+                self._restoreExpired()
+
+            messages = []
+            visibleUntil = self._clock() + visibilityTimeout
+            while self._visible and len(messages) < MaxNumberOfMessages:
+                # Messages deleted after their visibility timeout expired may
+                # still be queued.
+                message = self._messages.get(self._visible.popleft())
+                if message is None:
+                    continue
+                message.receiptHandle = '{}-{}'.format(
+                    message.messageId, next(self._receiptHandles))
+                message.receiveCount += 1
+                heapq.heappush(self._inFlight,
+                               (visibleUntil, message.messageId,
+                                message.receiptHandle))
+                messages.append({
+                    'MessageId': message.messageId,
+                    'ReceiptHandle': message.receiptHandle,
+                    'MD5OfBody': message.md5OfBody,
+                    'Body': message.body,
+                    'Attributes': {
+                        'ApproximateReceiveCount': str(message.receiveCount)
+                    }
+                })
+        return {'Messages': messages} if messages else {}
+
+    def _delete(self, receiptHandle):
+        messageId = receiptHandle.rsplit('-', 1)[0]
+        message = self._messages.get(messageId)
+        if message is None or message.receiptHandle != receiptHandle:
+            return False
+        del self._messages[messageId]
+        self._numDeleted += 1
+        return True
+
+    def delete_message(self, QueueUrl=None, ReceiptHandle=None):
+        with self._condition:
+            if not self._delete(ReceiptHandle):
+                raise ValueError(
+                    'The receipt handle {} is not valid.'.format(ReceiptHandle))
+        return {}
+
+    def delete_message_batch(self, QueueUrl=None, Entries=()):
+        if len(Entries) > self.maxBatchSize:
+            raise ValueError(
+                'At most {} entries can be deleted in one batch. {} passed.'.
+                format(self.maxBatchSize, len(Entries)))
+        successful, failed = [], []
+        with self._condition:
+            for entry in Entries:
+                if self._delete(entry['ReceiptHandle']):
+                    successful.append({'Id': entry['Id']})
+                else:
+                    failed.append({
+                        'Id': entry['Id'],
+                        'SenderFault': True,
+                        'Code': 'ReceiptHandleIsInvalid',
+                        'Message': 'The receipt handle is not valid.'
+                    })
+        return {'Successful': successful, 'Failed': failed}
+
+    def replay(self, extracts, rate=None, background=False):
+        """Send recorded extracts to the queue.
+
+        Arguments:
+        -- extracts - Iterable of extracts, each either a dictionary or a JSON
+        string, or the path of a file holding one JSON extract per line.
+        -- rate - Optional number of extracts per second. By default extracts
+        are sent as fast as possible.
+        -- background - If True, send from a daemon thread and return it.
+
+        Returns: The number of extracts sent, or the sending thread if
+        background is True.
+        """
+        if isinstance(extracts, str):
+            extracts = loadExtracts(extracts)
+
+        def send():
+            startTime = self._clock()
+            numSent = 0
+            for extract in extracts:
+                if rate is not None:
+                    delay = startTime + numSent / rate - self._clock()
+                    if delay > 0:
+                        time.sleep(delay)
+                self.send_message(
+                    MessageBody=extract
+                    if isinstance(extract, str) else json.dumps(extract))
+                numSent += 1
+            return numSent
+
+        if background:
+            thread = threading.Thread(target=send, daemon=True)
+            thread.start()
+            return thread
+        return send()
+
+
+def loadExtracts(path):
+    """Read recorded extracts from a file holding either a JSON array or one
+    JSON extract per line.
+
+    Returns: List of JSON strings.
+    """
+    with open(path) as extractFile:
+        content = extractFile.read().strip()
+    if content.startswith('['):
+        return [json.dumps(extract) for extract in json.loads(content)]
+    return [line for line in content.splitlines() if line.strip()]
@@ -0,0 +1,161 @@
+import collections
+
+SubjectResult = collections.namedtuple('SubjectResult',
+                                       ['posteriors', 'mapLabel', 'risk'])
+"""Cached inference result for a subject.
+
+-- posteriors - Dictionary mapping each candidate true label to its posterior
+probability.
+-- mapLabel - Maximum a posteriori true label.
+-- risk - Expected loss of predicting the subject's true label, or None if it
+has not been evaluated.
+"""
+
+
+class SubjectResultCache():
+    """Bounded least-recently-used cache of per-subject inference results.
+
+    Results are keyed on the subject id and validated against the subject's
+    version (see Subject.version), so a result is reused only while the
+    subject's annotations and true label are unchanged. Changes to classifier
+    skills are handled by invalidateClassifiers(), which discards the results
+    of the subjects annotated by classifiers whose skills changed; call it
+    whenever skills are recomputed (Classifiers.computeSkills and EMEngine.run
+    do so when passed the cache). Validating a result therefore costs O(1)
+    rather than O(annotations). The annotation, prior and loss models are
+    assumed fixed; call clear() if they change.
+    """
+
+    def __init__(self, maxSize=100000):
+        """Arguments:
+        -- maxSize - Maximum number of subjects cached. The least recently used
+        entries are evicted beyond this. None means unbounded.
+        """
+        self._maxSize = maxSize
+        self._entries = collections.OrderedDict()
+        # Skill version of each classifier when results were last invalidated.
+        self._skillVersions = {}
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @property
+    def maxSize(self):
+        return self._maxSize
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    @property
+    def evictions(self):
+        return self._evictions
+
+    @property
+    def hitRate(self):
+        lookups = self._hits + self._misses
+        return self._hits / lookups if lookups else 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, subjectId):
+        return subjectId in self._entries
+
+    def clear(self):
+        """Discard all entries. The counters are kept.
+        """
+        self._entries.clear()
+        self._skillVersions.clear()
+
+    def resetCounters(self):
+        self._hits = self._misses = self._evictions = 0
+
+    def key(self, subject):
+        """Return the validation key of subject's current state.
+        """
+        return subject.version
+
+    def invalidate(self, subjectIds):
+        """Discard the results of the subjects with subjectIds.
+        """
+        for subjectId in subjectIds:
+            self._entries.pop(subjectId, None)
+
+    def invalidateClassifiers(self, classifiers, subjects):
+        """Discard the results of the subjects annotated by classifiers whose
+        skills changed since the previous call.
+
+        Arguments:
+        -- classifiers - Classifiers collection. Its registry of annotation
+        positions within subjects is used to find the affected subjects, so
+        the cost is proportional to the annotations of the changed
+        classifiers.
+        -- subjects - Subjects collection the registry refers to.
+
+        Returns: Number of classifiers whose skills changed.
+        """
+        changed = [
+            classifier for classifier in classifiers.items()
+            if self._skillVersions.get(classifier.id) !=
+            classifier.skillVersion
+        ]
+        if self._entries:
+            scanned = [
+                classifier.id for classifier in changed
+                if not classifiers.isIndexed(classifier.id, subjects)
+            ]
+            if scanned:
+                # Fall back to a single scan for classifiers the registry
+                # does not cover.
+                scanned = set(scanned)
+                self.invalidate(
+                    subject.id for subject in subjects.items()
+                    if any(annotation.classifier.id in scanned
+                           for annotation in subject.annotations.items()))
+            for classifier in changed:
+                if classifier.id not in scanned:
+                    self.invalidate(
+                        subjects.subjects[position].id
+                        for position in classifiers.subjectPositions(
+                            classifier.id))
+        for classifier in changed:
+            self._skillVersions[classifier.id] = classifier.skillVersion
+        return len(changed)
+
+    def get(self, subject, requireRisk=False):
+        """Return the cached SubjectResult for subject if it is still valid,
+        otherwise None.
+
+        Arguments:
+        -- requireRisk - If True, a valid result without a risk is treated as a
+        miss.
+        """
+        entry = self._entries.get(subject.id)
+        if (entry is not None and entry[0] == self.key(subject)
+                and not (requireRisk and entry[1].risk is None)):
+            self._entries.move_to_end(subject.id)
+            self._hits += 1
+            return entry[1]
+        self._misses += 1
+        return None
+
+    def put(self, subject, result):
+        """Cache result for the current state of subject.
+        """
+        self._entries[subject.id] = (self.key(subject), result)
+        self._entries.move_to_end(subject.id)
+        if self._maxSize is not None:
+            while len(self._entries) > self._maxSize:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def __str__(self):
+        return ('{} entries, {} hits, {} misses, {} evictions, '
+                '{:.0%} hit rate'.format(
+                    len(self), self.hits, self.misses, self.evictions,
+                    self.hitRate))
@@ -0,0 +1,241 @@
+import collections
+import heapq
+import itertools
+
+import numpy as np
+
+RetirementDecision = collections.namedtuple(
+    'RetirementDecision',
+    ['subjectId', 'decision', 'risk', 'numAnnotations', 'reason'])
+"""Decision emitted by RetirementEngine for a subject.
+
+-- decision - Either 'retire' or 'continue'.
+-- risk - Risk of the subject when the decision was made.
+-- numAnnotations - Number of annotations of the subject.
+-- reason - Name of the rule that triggered retirement ('goldStandard',
+'risk' or 'maxAnnotations'), or None for 'continue'.
+"""
+
+
+class RetirementEngine():
+    """Decides which subjects to retire.
+
+    Active subjects are kept in a heap ordered on risk, ties broken in favour
+    of subjects with more annotations. Each update pushes new heap entries only
+    for the subjects whose risk or annotation count changed, and then pops the
+    subjects whose risk has fallen below riskThreshold. Stale entries are
+    skipped lazily when popped and discarded by an occasional rebuild, so a
+    cycle in which k subjects change costs O(k log N).
+
+    Retirement rules, in order of precedence:
+    -- goldStandard - A subject with a gold-standard decision ('retire' or
+    'continue') always receives that decision.
+    -- risk - A subject with at least minAnnotations annotations is retired
+    once its risk falls below riskThreshold.
+    -- maxAnnotations - A subject is retired once it has maxAnnotations
+    annotations, whatever its risk.
+
+    Retired subjects are removed from the engine and further updates for them
+    are ignored.
+    """
+
+    retire = 'retire'
+    proceed = 'continue'
+
+    def __init__(self,
+                 riskThreshold=0.05,
+                 maxAnnotations=None,
+                 minAnnotations=1,
+                 goldStandard=None,
+                 riskTolerance=1e-12):
+        """Arguments:
+        -- riskThreshold - Subjects whose risk is below this are retired.
+        -- maxAnnotations - Optional annotation count at which subjects are
+        retired regardless of risk.
+        -- minAnnotations - Minimum number of annotations before the risk rule
+        applies.
+        -- goldStandard - Optional dictionary mapping subject ids to the
+        decision ('retire' or 'continue') they must receive.
+        -- riskTolerance - Risk changes no larger than this are ignored.
+        """
+        self._riskThreshold = riskThreshold
+        self._maxAnnotations = maxAnnotations
+        self._minAnnotations = minAnnotations
+        self._goldStandard = dict(goldStandard or {})
+        self._riskTolerance = riskTolerance
+
+        self._heap = []
+        self._entries = {}
+        self._sequence = itertools.count()
+        self._retired = {}
+        # Active subjects below the risk threshold that a rule keeps active.
+        # They are off the heap until their risk or annotation count changes.
+        self._exempt = set()
+        # Active subjects to decide on in the next update whatever their risk.
+        self._pending = set()
+
+    @property
+    def riskThreshold(self):
+        return self._riskThreshold
+
+    @property
+    def maxAnnotations(self):
+        return self._maxAnnotations
+
+    @property
+    def minAnnotations(self):
+        return self._minAnnotations
+
+    @property
+    def goldStandard(self):
+        return self._goldStandard
+
+    @property
+    def retired(self):
+        """Dictionary mapping the ids of retired subjects to the
+        RetirementDecision that retired them.
+        """
+        return self._retired
+
+    @property
+    def numActive(self):
+        return len(self._entries)
+
+    def setGoldStandard(self, subjectId, decision):
+        """Override the rules for one subject. The subject is decided on again
+        in the next update.
+        """
+        if decision not in (self.retire, self.proceed):
+            raise ValueError(
+                'The decision argument must be {!r} or {!r}. {!r} passed.'.
+                format(self.retire, self.proceed, decision))
+        self._goldStandard[subjectId] = decision
+        current = self._entries.get(subjectId)
+        if current is not None:
+            # Reconsider the subject in the next update.
+            self._exempt.discard(subjectId)
+            self._push([self._entry(subjectId, current[0], current[1])])
+            self._pending.add(subjectId)
+
+    def _entry(self, subjectId, risk, numAnnotations):
+        sequence = next(self._sequence)
+        self._entries[subjectId] = (risk, numAnnotations, sequence)
+        return (risk, -numAnnotations, sequence, subjectId)
+
+    def _push(self, entries):
+        # Pushing k entries costs O(k log N); heapify is cheaper once k is a
+        # sizeable fraction of the heap (e.g. when first loading subjects).
+        if len(entries) > len(self._heap) // 4:
+            self._heap.extend(entries)
+            heapq.heapify(self._heap)
+        else:
+            for entry in entries:
+                heapq.heappush(self._heap, entry)
+
+    def _isCurrent(self, entry):
+        risk, _, sequence, subjectId = entry
+        current = self._entries.get(subjectId)
+        return current is not None and current[2] == sequence
+
+    def _compact(self):
+        # Rebuild the heap once stale entries outnumber current ones.
+        if len(self._heap) > 2 * len(self._entries) + 1024:
+            self._heap = [
+                entry for entry in self._heap if self._isCurrent(entry)
+            ]
+            heapq.heapify(self._heap)
+
+    def _retire(self, subjectId, reason):
+        risk, numAnnotations, _ = self._entries.pop(subjectId)
+        self._exempt.discard(subjectId)
+        decision = RetirementDecision(subjectId, self.retire, risk,
+                                      numAnnotations, reason)
+        self._retired[subjectId] = decision
+        return decision
+
+    def _isExempt(self, subjectId, numAnnotations):
+        return (self._goldStandard.get(subjectId) == self.proceed
+                or numAnnotations < self._minAnnotations)
+
+    def update(self, subjectIds, risks, numAnnotations):
+        """Record the current risk and annotation count of subjects and decide
+        on those that changed.
+
+        Unchanged subjects are skipped, so passing every subject is correct,
+        but passing only subjects modified this cycle avoids even the O(N)
+        comparison.
+
+        Arguments:
+        -- subjectIds - Sequence of subject ids.
+        -- risks - Sequence of risks.
+        -- numAnnotations - Sequence of annotation counts.
+
+        Returns: List of RetirementDecision, one for each changed subject.
+        """
+        changed = collections.OrderedDict(
+            (subjectId, None) for subjectId in self._pending
+            if subjectId in self._entries)
+        self._pending = set()
+        entries = []
+        # Converting once is much faster than iterating over NumPy scalars.
+        risks = np.asarray(risks, dtype=float).tolist()
+        numAnnotations = np.asarray(numAnnotations, dtype=int).tolist()
+        for subjectId, risk, count in zip(subjectIds, risks, numAnnotations):
+            if subjectId in self._retired:
+                continue
+            previous = self._entries.get(subjectId)
+            if (previous is not None
+                    and abs(previous[0] - risk) <= self._riskTolerance
+                    and previous[1] == count):
+                continue
+            self._exempt.discard(subjectId)
+            entries.append(self._entry(subjectId, risk, count))
+            changed[subjectId] = None
+        self._push(entries)
+
+        for subjectId in changed:
+            count = self._entries[subjectId][1]
+            gold = self._goldStandard.get(subjectId)
+            if gold == self.retire:
+                changed[subjectId] = self._retire(subjectId, 'goldStandard')
+            elif (gold is None and self._maxAnnotations is not None
+                  and count >= self._maxAnnotations):
+                changed[subjectId] = self._retire(subjectId, 'maxAnnotations')
+
+        # Entries below the threshold were pushed this cycle, since earlier
+        # ones were either retired or set aside as exempt, so this loop only
+        # visits changed subjects.
+        while self._heap and self._heap[0][0] < self._riskThreshold:
+            entry = heapq.heappop(self._heap)
+            if not self._isCurrent(entry):
+                continue
+            subjectId = entry[3]
+            if self._isExempt(subjectId, -entry[1]):
+                # Set aside until the subject changes again.
+                self._exempt.add(subjectId)
+                continue
+            changed[subjectId] = self._retire(subjectId, 'risk')
+        self._compact()
+
+        decisions = []
+        for subjectId, decision in changed.items():
+            if decision is None:
+                risk, count, _ = self._entries[subjectId]
+                decision = RetirementDecision(subjectId, self.proceed, risk,
+                                              count, None)
+            decisions.append(decision)
+        return decisions
+
+    def nearestRetirement(self, count):
+        """Return the ids of up to count active, non-exempt subjects with the
+        lowest risk, in order, in O(count log N).
+        """
+        popped, subjectIds = [], []
+        while self._heap and len(subjectIds) < count:
+            entry = heapq.heappop(self._heap)
+            if self._isCurrent(entry):
+                popped.append(entry)
+                subjectIds.append(entry[3])
+        for entry in popped:
+            heapq.heappush(self._heap, entry)
+        return subjectIds
@@ -4,6 +4,7 @@ import numpy as np
 
 from Annotations import Annotations
 from AnnotationModels import AnnotationModelBase, AnnotationPriorBase
+from ResultCache import SubjectResult, SubjectResultCache
 from Subjects import Subject, Subjects
 
 
@@ -52,11 +53,59 @@ class LossModelBinary(LossModelBase):
         self._falseNegLoss = falseNegLoss
 
 
+class LossModelCategorical(LossModelBase):
+    """Loss of predicting one of several labels. Defaults to the zero-one loss.
+    """
+
+    def __init__(self, losses=None, defaultLoss=1):
+        """Arguments:
+        -- losses - Optional dictionary mapping (trueLabel, predictedLabel)
+        pairs to losses, overriding defaultLoss.
+        -- defaultLoss - Loss of any incorrect prediction not in losses.
+        """
+        self._losses = dict(losses) if losses is not None else {}
+        self._defaultLoss = defaultLoss
+
+    def __call__(self, trueLabel, predictedLabel):
+        if (trueLabel, predictedLabel) in self._losses:
+            return self._losses[(trueLabel, predictedLabel)]
+        return 0 if trueLabel == predictedLabel else self._defaultLoss
+
+    @property
+    def losses(self):
+        return self._losses
+
+    @property
+    def defaultLoss(self):
+        return self._defaultLoss
+
+    @defaultLoss.setter
+    def defaultLoss(self, defaultLoss):
+        self._defaultLoss = defaultLoss
+
+
 class Risk():
     """Computes a metric that can be used to define decision thresholds for each
     subject based on its classification history.
     """
 
+    def __init__(self, cache=None):
+        """Arguments:
+        -- cache - Optional SubjectResultCache. Risks of subjects whose
+        annotations, true label and classifier skills are unchanged since they
+        were last evaluated are then returned from the cache (see
+        SubjectResultCache.invalidateClassifiers).
+        """
+        if cache is not None and not isinstance(cache, SubjectResultCache):
+            raise TypeError(
+                'The cache argument must be of type {}. Type {} passed.'.
+                format(SubjectResultCache.__name__, type(cache)))
+        self._cache = cache
+
+    @property
+    def cache(self):
+        return self._cache
+
     def __call__(self, annotations, subject, lossModel, annotationModel,
                  annotationPriorModel):
         """Evaluate the risk.
@@ -94,18 +143,35 @@ class Risk():
                 'The annotationPriorModel argument must inherit from {}. Type {} passed.'.
                 format(type(AnnotationPriorBase).__name__, type(annotationPriorModel)))
 
-        trueLabelRisks = []
-        posteriorProbSum = 0
-        for trueLabel in annotations.getUniqueLabels():
-            posteriorProb = annotationPriorModel(trueLabel) * np.prod([
-                annotationModel(trueLabel, annotation)
-                for annotation in annotations.items()
+        if self._cache is not None:
+            result = self._cache.get(subject, requireRisk=True)
+            if result is not None:
+                return result.risk
+
+        # Accumulate in log space to avoid underflow for subjects with many
+        # annotations.
+        trueLabels = annotations.getUniqueLabels()
+        with np.errstate(divide='ignore'):
+            logPosteriorProbs = np.array([
+                np.log(annotationPriorModel(trueLabel)) + np.sum(
+                    np.log([
+                        annotationModel(trueLabel, annotation)
+                        for annotation in annotations.items()
+                    ])) for trueLabel in trueLabels
             ])
-            # print('posteriorProb =>', posteriorProb, 'lossModel(trueLabel, subject.trueLabel) =>', lossModel(trueLabel, subject.trueLabel))
-            # print(trueLabel, subject.trueLabel)
-            trueLabelRisks.append(
-                (lossModel(trueLabel, subject.trueLabel) * posteriorProb))
-            posteriorProbSum += posteriorProb
-        risk = np.sum(trueLabelRisks)/posteriorProbSum
+        posteriorProbs = np.exp(logPosteriorProbs - np.max(logPosteriorProbs))
+        trueLabelRisks = [
+            lossModel(trueLabel, subject.trueLabel) * posteriorProb
+            for trueLabel, posteriorProb in zip(trueLabels, posteriorProbs)
+        ]
+        risk = np.sum(trueLabelRisks) / np.sum(posteriorProbs)
+
+        if self._cache is not None:
+            posteriorProbs = posteriorProbs / np.sum(posteriorProbs)
+            self._cache.put(
+                subject,
+                SubjectResult(
+                    dict(zip(trueLabels, posteriorProbs)),
+                    trueLabels[np.argmax(posteriorProbs)], risk))
 
         return risk
@@ -1,8 +1,11 @@
+import collections
+
 import matplotlib.pyplot as mplplot
 import matplotlib.transforms as mpltrans
 import numpy as np
 
 from Annotations import AnnotationBase, Annotations
+from ResultCache import SubjectResult
 
 
 class Subject():
@@ -16,6 +19,9 @@ class Subject():
             [])
         self._difficulty = difficulty
         self._trueLabel = trueLabel
+        self._version = 0
+        # Subjects collection whose modification counter markModified bumps.
+        self._parent = None
 
     def __eq__(self, other):
         return self.id == other.id
@@ -42,6 +48,7 @@ class Subject():
             annotation for annotation in annotations
             if issubclass(annotation, AnnotationBase)
         ])
+        self.markModified()
 
     @property
     def difficulty(self):
@@ -57,79 +64,317 @@ class Subject():
 
     @trueLabel.setter
     def trueLabel(self, trueLabel):
+        if trueLabel is not self._trueLabel and trueLabel != self._trueLabel:
+            self.markModified()
+            if self._parent is not None and self._parent.store is not None:
+                self._parent.store.setTrueLabel(self.id, trueLabel)
         self._trueLabel = trueLabel
 
-    def computeTrueLabel(self, annotationModel, annotationPriorModel):
+    @property
+    def version(self):
+        """Counter incremented whenever the subject's true label or annotation
+        set changes.
+        """
+        return self._version
+
+    def markModified(self):
+        self._version += 1
+        if self._parent is not None:
+            self._parent._modifications += 1
+
+    def computeTrueLabel(self,
+                         annotationModel,
+                         annotationPriorModel,
+                         cache=None):
+        """Set the true label to its maximum a posteriori estimate.
+
+        Arguments:
+        -- cache - Optional SubjectResultCache. If it holds a valid result for
+        this subject, its MAP label is used without re-evaluating the
+        annotations.
+        """
+        if cache is not None:
+            result = cache.get(self)
+            if result is not None:
+                self.trueLabel = result.mapLabel
+                return
+
         validLabels = self.annotations.getUniqueLabels()
         # Predict subject label
         labelMlEstimates = []
         for trueLabel in validLabels:
-            if len(self.annotations.annotations) > 0:
-                dataProb = np.product([
-                    annotationModel(trueLabel, annotation)
-                    for annotation in self.annotations.items()
-                ])
-            else:
-                dataProb = 1.0
-            labelMlEstimates.append(annotationPriorModel(trueLabel) * dataProb)
+            # Sum log probabilities to avoid underflow for subjects with many
+            # annotations.
+            with np.errstate(divide='ignore'):
+                logDataProb = np.sum(
+                    np.log([
+                        annotationModel(trueLabel, annotation)
+                        for annotation in self.annotations.items()
+                    ]))
+                labelMlEstimates.append(
+                    np.log(annotationPriorModel(trueLabel)) + logDataProb)
 
-        self._trueLabel = validLabels[np.argmax(labelMlEstimates)]
+        self.trueLabel = validLabels[np.argmax(labelMlEstimates)]
+        if cache is not None:
+            logNormalizer = np.logaddexp.reduce(labelMlEstimates)
+            cache.put(
+                self,
+                SubjectResult({
+                    label: float(np.exp(estimate - logNormalizer))
+                    for label, estimate in zip(validLabels, labelMlEstimates)
+                }, self.trueLabel, None))
 
     def __str__(self):
         return '\n'.join(['-==Subject==-'] + [
             '{} => {}'.format(name[1:], value)
-            for name, value in vars(self).items()
+            for name, value in vars(self).items() if name != '_parent'
         ] + ['-==Subject==-'])
 
 
+MergeCounts = collections.namedtuple('MergeCounts', ['new', 'updated'])
+"""Number of new subjects appended and of known subjects updated by
+Subjects.merge.
+"""
+
+
 class Subjects():
     def __init__(self, subjects=[]):
-        self._subjects = [
-            subject for subject in subjects if isinstance(subject, Subject)
-        ]
+        self._subjects = []
+        self._subjectIndex = {}
+        self._version = 0
+        # Number of modifications of the member subjects this collection owns,
+        # and the members owned by other collections.
+        self._modifications = 0
+        self._foreign = []
+        self._store = None
+        for subject in subjects:
+            if isinstance(subject, Subject):
+                self._add(subject)
 
     @property
     def subjects(self):
         return self._subjects
 
     @subjects.setter
-    def subjects(self, classifiers):
-        self._subjects = [
-            subject for subject in subjects if isinstance(subject, Subject)
-        ]
+    def subjects(self, subjects):
+        self._subjects = []
+        self._subjectIndex = {}
+        self._foreign = []
+        self._store = None
+        self._version += 1
+        for subject in subjects:
+            if isinstance(subject, Subject):
+                self._add(subject)
+
+    def _add(self, subject, adopt=False):
+        # The index refers to the first subject appended with each id.
+        self._subjectIndex.setdefault(subject.id, len(self._subjects))
+        self._subjects.append(subject)
+        self._version += 1
+        if subject._parent is None or adopt:
+            self._adopt(subject)
+        elif subject._parent is not self:
+            self._foreign.append(subject)
+        if self._store is not None:
+            self._store.subjectCode(subject.id)
+            if subject.trueLabel is not None:
+                self._store.setTrueLabel(subject.id, subject.trueLabel)
+
+    def _adopt(self, subject):
+        """Make this collection the owner of subject, whose modifications then
+        bump its counter. A previous owner tracks the subject as foreign.
+        """
+        parent = subject._parent
+        if parent is self:
+            return
+        if parent is not None:
+            parent._foreign.append(subject)
+        subject._parent = self
+
+    def _storeAnnotations(self, updates):
+        """Append annotations to the backing store and replace them with views
+        over it.
+
+        Arguments:
+        -- updates - Sequence of (subject, start, stop) tuples listing the
+        positions of annotations within member subjects.
+        """
+        annotations = [(subject, position, annotation)
+                       for subject, start, stop in updates
+                       for position, annotation in enumerate(
+                           subject.annotations.annotations[start:stop], start)]
+        positions = self._store.extend(
+            [annotation.id for _, _, annotation in annotations],
+            [subject.id for subject, _, _ in annotations],
+            [annotation.classifier.id for _, _, annotation in annotations],
+            [annotation.label for _, _, annotation in annotations])
+        for storePosition, (subject, position, annotation) in zip(
+                range(positions.start, positions.stop), annotations):
+            subject.annotations.annotations[
+                position] = self._store.annotationView(
+                    storePosition, annotation.classifier)
+
+    @property
+    def store(self):
+        """AnnotationStore backing the collection (see attachStore), or None.
+        """
+        return self._store
+
+    def attachStore(self, store=None, labels=None):
+        """Back the collection with an AnnotationStore. The store then follows
+        the subjects and annotations added through append and merge, whose
+        annotations become views over it, and the true labels set on member
+        subjects, so the array-based engines use it directly rather than
+        building a store on every call. Annotations added to a subject in any
+        other way are not tracked.
+
+        Arguments:
+        -- store - Store already holding the annotations and true labels of
+        the collection, with its subjects in the same order (e.g. the store
+        toSubjects was called on). By default a store is built from the
+        collection and its annotations are replaced with views over it.
+        -- labels - Valid labels of a new store. Defaults to [False, True].
+
+        Returns: The store.
+        """
+        if store is None:
+            from AnnotationStore import AnnotationStore
+            store = AnnotationStore(
+                labels=labels if labels is not None else [False, True])
+            for subject in self._subjects:
+                store.subjectCode(subject.id)
+                if subject.trueLabel is not None:
+                    store.setTrueLabel(subject.id, subject.trueLabel)
+            self._store = store
+            self._storeAnnotations([
+                (subject, 0, len(subject.annotations.annotations))
+                for subject in self._subjects
+            ])
+        self._store = store
+        # Labels are written through to the store by the owning collection.
+        for subject in self._subjects:
+            self._adopt(subject)
+        self._foreign = []
+        return store
+
+    @property
+    def version(self):
+        """Tuple that changes whenever a subject is added to the collection or
+        the true label or annotation set of a member subject changes.
+
+        Subjects record the collection that owns them (the first one they are
+        added to, or the one they are merged into), so reading the version is
+        O(1) except for members owned by another collection (e.g. those of a
+        subset), whose versions are summed.
+        """
+        return (self._version, self._modifications,
+                sum(subject.version for subject in self._foreign))
+
+    @property
+    def collectionVersion(self):
+        """Counter incremented whenever subjects are added to the collection or
+        annotations are merged into it. Unlike version it is O(1) to read, but
+        it does not reflect changes made directly to member subjects.
+        """
+        return self._version
 
     def items(self):
         for subject in self.subjects:
             yield subject
 
+    def __len__(self):
+        return len(self._subjects)
+
+    def __contains__(self, id):
+        return id in self._subjectIndex
+
+    def get(self, id, default=None):
+        """Return the subject with the specified id, or default if there is no
+        such subject.
+        """
+        position = self._subjectIndex.get(id)
+        return self._subjects[position] if position is not None else default
+
     def append(self, subject):
         if isinstance(subject, Subject):
-            self.subjects.append(subject)
+            self._add(subject)
+            if self._store is not None:
+                self._storeAnnotations(
+                    [(subject, 0, len(subject.annotations.annotations))])
         else:
             raise TypeError(
                 'The subject argument must an instance of type {}. Type {} passed.'.
                 format(Subject, type(subject)))
 
-    def merge(self, subjects):
+    def merge(self, subjects, classifiers=None):
+        """Merge subjects into this collection. The annotations of subjects that
+        are already known are appended to those of the known subject. Unknown
+        subjects are appended.
+
+        Arguments:
+        -- subjects - Subjects collection to merge.
+        -- classifiers - Optional Classifiers collection. Merged annotations are
+        re-pointed to its canonical Classifier for each classifier id and its
+        registry of annotation positions within this collection is updated.
+        A stale registry is rebuilt first.
+
+        The merged annotations are appended to the backing store, if any (see
+        attachStore).
+
+        Returns: MergeCounts
+        """
+        if classifiers is not None and not classifiers.indexes(self):
+            classifiers.indexSubjects(self)
+        numNew, numUpdated = 0, 0
+        updates = []
         for subject in subjects.items():
-            for knownSubject in self.items():
-                if knownSubject.id == subject.id:
-                    print(True)
-                    knownSubject.annotations.append(subject.annotations)
-                    break
+            subjectPosition = self._subjectIndex.get(subject.id)
+            if subjectPosition is not None:
+                knownSubject = self._subjects[subjectPosition]
+                firstPosition = len(knownSubject.annotations.annotations)
+                knownSubject.annotations.append(subject.annotations)
+                knownSubject.markModified()
+                numUpdated += 1
             else:
-                print(False)
-                self.append(subject)
+                subjectPosition = len(self._subjects)
+                firstPosition = 0
+                # The merged collection (usually a received batch) is
+                # discarded, so this collection takes ownership.
+                self._add(subject, adopt=True)
+                knownSubject = subject
+                numNew += 1
+            if classifiers is not None:
+                annotations = knownSubject.annotations.annotations
+                for annotationPosition in range(firstPosition,
+                                                len(annotations)):
+                    annotation = annotations[annotationPosition]
+                    annotation.classifier = classifiers.canonical(
+                        annotation.classifier)
+                    classifiers.register(annotation.classifier.id,
+                                         subjectPosition, annotationPosition)
+            updates.append((knownSubject, firstPosition,
+                            len(knownSubject.annotations.annotations)))
+        if self._store is not None:
+            self._storeAnnotations(updates)
+        self._version += 1
+        if classifiers is not None:
+            classifiers.markIndexed(self)
+        return MergeCounts(numNew, numUpdated)
 
     def subsetCriterion(self, subject, id, trueLabel):
         # Returns True by default if id and trueLabel are None
-        if id is not None and subject.id != id or trueLabel is not None and trueLabel != trueLabel:
+        if id is not None and subject.id != id or trueLabel is not None and subject.trueLabel != trueLabel:
             return False
         return True
 
     def subset(self, id=None, trueLabel=None):
+        if id is not None:
+            subject = self.get(id)
+            candidates = [subject] if subject is not None else []
+        else:
+            candidates = self.subjects
         return Subjects([
-            subject for subject in self.subjects
+            subject for subject in candidates
             if isinstance(subject, Subject)
             and self.subsetCriterion(subject, id, trueLabel)
         ])
@@ -0,0 +1,64 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# The modules live at the top level of the repository.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from IO import BinarySimulationReceiver
+
+
+def simulate(numSubjects=300,
+             numClassifiers=40,
+             numAnnotationsPerSubject=8,
+             seed=0):
+    """Return a seeded BinarySimulationReceiver whose store has been generated,
+    as (receiver, store). Subject true labels hold the simulated truth.
+    """
+    rng = np.random.default_rng(seed)
+    receiver = BinarySimulationReceiver(
+        numClassifiers=numClassifiers,
+        numSubjects=numSubjects,
+        numAnnotationsPerSubject=numAnnotationsPerSubject,
+        trueProb=0.6,
+        successProb=rng.uniform(low=0.55, high=0.95, size=numClassifiers),
+        seed=seed)
+    store = receiver.genStore()
+    receiver.genClassifiers()
+    return receiver, store
+
+
+def storeRows(store):
+    """Return the annotations of store as a sorted list of
+    (annotationId, subjectId, classifierId, label) tuples.
+    """
+    return sorted(
+        zip(store.annotationIds.tolist(),
+            [store.subjectIds[code] for code in store.subjectIndex.tolist()],
+            [
+                store.classifierIds[code]
+                for code in store.classifierIndex.tolist()
+            ],
+            [store.decodeLabel(code) for code in store.labelCodes.tolist()]))
+
+
+def subjectRows(subjects):
+    return sorted((annotation.id, subject.id, annotation.classifier.id,
+                   annotation.label) for subject in subjects.items()
+                  for annotation in subject.annotations.items())
+
+
+@pytest.fixture
+def simulated():
+    return simulate()
+
+
+@pytest.fixture
+def simulatedSubjects(simulated):
+    """Subjects collection of object annotations (views over the simulated
+    store) and the Classifiers collection they reference.
+    """
+    receiver, store = simulated
+    return store.toSubjects(receiver.classifiers.items()), receiver.classifiers
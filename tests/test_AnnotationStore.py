@@ -0,0 +1,165 @@
+import numpy as np
+
+from conftest import simulate, storeRows, subjectRows
+from Annotations import AnnotationBinary, Annotations
+from AnnotationStore import AnnotationStore
+from Benchmark import simulateExtracts
+from Classifiers import Classifiers
+from IO import BinarySimulationReceiver, CaesarSQSReceiver
+from Queues import LocalQueueBackend
+from Subjects import Subject, Subjects
+
+
+def testToSubjectsMatchesStore(simulated):
+    receiver, store = simulated
+    subjects = store.toSubjects(receiver.classifiers.items())
+
+    assert len(subjects) == store.numSubjects
+    assert subjectRows(subjects) == storeRows(store)
+    for subject in subjects.items():
+        assert subject.trueLabel == store.getTrueLabel(subject.id)
+        for annotation in subject.annotations.items():
+            # Views reference the canonical classifiers.
+            assert annotation.classifier is receiver.classifiers.get(
+                annotation.classifier.id)
+
+
+def testFromSubjectsRoundTrip(simulatedSubjects):
+    subjects, _ = simulatedSubjects
+    store = AnnotationStore.fromSubjects(subjects, labels=[False, True])
+
+    assert subjectRows(subjects) == storeRows(store)
+    assert [store.getTrueLabel(subject.id) for subject in subjects.items()
+            ] == [subject.trueLabel for subject in subjects.items()]
+    assert subjectRows(store.toSubjects()) == subjectRows(subjects)
+
+
+def testPositionsFollowAppends():
+    store = AnnotationStore(labels=[False, True])
+    # Keep the tails short so that the index is rebuilt along the way.
+    store.positionIndexMinTail = 16
+    rng = np.random.default_rng(1)
+    for batch in range(20):
+        numAnnotations = int(rng.integers(1, 40))
+        store.extend(
+            np.arange(numAnnotations) + 1000 * batch,
+            rng.integers(50, size=numAnnotations).tolist(),
+            rng.integers(10, size=numAnnotations).tolist(),
+            (rng.random(numAnnotations) < 0.5).tolist())
+        for code in range(store.numSubjects):
+            np.testing.assert_array_equal(
+                np.sort(store.subjectPositions(code)),
+                np.flatnonzero(store.subjectIndex == code))
+        for code in range(store.numClassifiers):
+            np.testing.assert_array_equal(
+                np.sort(store.classifierPositions(code)),
+                np.flatnonzero(store.classifierIndex == code))
+
+
+def testSimulationIsSeeded():
+    _, first = simulate(seed=3)
+    _, second = simulate(seed=3)
+    _, other = simulate(seed=4)
+
+    assert storeRows(first) == storeRows(second)
+    np.testing.assert_array_equal(first.trueLabelCodes,
+                                  second.trueLabelCodes)
+    assert storeRows(first) != storeRows(other)
+
+
+def testSimulationDrawsDistinctClassifiers():
+    receiver = BinarySimulationReceiver(
+        numClassifiers=12,
+        numSubjects=200,
+        numAnnotationsPerSubject=5,
+        trueProb=0.5,
+        successProb=0.8,
+        seed=0)
+    columns = receiver.genColumns()
+
+    classifierIndex = columns.classifierIndex.reshape(200, 5)
+    assert all(len(set(row)) == 5 for row in classifierIndex.tolist())
+    np.testing.assert_array_equal(columns.subjectIndex,
+                                  np.repeat(np.arange(200), 5))
+    assert len(np.unique(columns.annotationIds)) == 1000
+
+
+def testExtractRowsMatchSubjectsFromMessages():
+    extracts = simulateExtracts(
+        500, numClassifiers=30, numAnnotationsPerSubject=5, seed=0)
+    # An extract without an answer to the task has a missing label.
+    del extracts[7]['data']['classification']['annotations']['T0']
+    labelArgs = dict(taskName='T0', trueValue=1, falseValue=0)
+    receiver = CaesarSQSReceiver(
+        None,
+        annotationType=AnnotationBinary,
+        classifiers=Classifiers(),
+        sqsClient=LocalQueueBackend())
+
+    knownSubjects = Subjects([])
+    knownSubjects.merge(
+        receiver.subjectsFromMessages(extracts, **labelArgs),
+        classifiers=receiver.classifiers)
+    store = AnnotationStore(labels=[False, True])
+    positions = receiver.appendRows(
+        store, receiver.extractRows(extracts, store, **labelArgs),
+        chunkSize=64)
+
+    assert positions == slice(0, len(extracts))
+    assert storeRows(store) == subjectRows(knownSubjects)
+    assert store.labelCodes[store.annotationIds.tolist().index(
+        extracts[7]['classification_id'])] == store.missingCode
+
+
+def testBackedSubjectsFollowMerges(simulated):
+    receiver, store = simulated
+    subjects = store.toSubjects(receiver.classifiers.items())
+    extracts = simulateExtracts(
+        40, numClassifiers=30, numAnnotationsPerSubject=3, seed=1)
+    for extract in extracts[::2]:
+        # Half of the extracts annotate known subjects.
+        extract['subject_id'] = store.subjectIds[extract['subject_id'] % 100]
+    batchReceiver = CaesarSQSReceiver(
+        None,
+        annotationType=AnnotationBinary,
+        classifiers=Classifiers(),
+        sqsClient=LocalQueueBackend())
+    batch = batchReceiver.subjectsFromMessages(
+        extracts, taskName='T0', trueValue=1, falseValue=0)
+    numAnnotations = store.numAnnotations
+
+    subjects.merge(batch, classifiers=receiver.classifiers)
+
+    assert subjects.store is store
+    assert store.numAnnotations == numAnnotations + len(extracts)
+    assert store.numSubjects == len(subjects)
+    assert subjectRows(subjects) == storeRows(store)
+    for subject in subjects.items():
+        for annotation in subject.annotations.items():
+            assert annotation.store is store
+    # True labels set on subjects are written through to the store.
+    subject = subjects.subjects[-1]
+    subject.trueLabel = True
+    assert store.getTrueLabel(subject.id) is True
+    assert AnnotationStore.forSubjects(subjects, labels=[False, True]) is store
+
+
+def testAttachStore(simulatedSubjects):
+    subjects, _ = simulatedSubjects
+    copy = Subjects([
+        Subject(id=subject.id, annotations=Annotations(
+            list(subject.annotations.items())), trueLabel=subject.trueLabel)
+        for subject in subjects.items()
+    ])
+    assert copy.store is None
+
+    store = copy.attachStore()
+
+    assert subjectRows(copy) == subjectRows(subjects) == storeRows(store)
+    assert [store.getTrueLabel(subject.id) for subject in copy.items()
+            ] == [subject.trueLabel for subject in copy.items()]
+    copy.append(Subject(id='new', trueLabel=False))
+    assert store.getTrueLabel('new') is False
+    assert AnnotationStore.forSubjects(copy, labels=[True]) is not store
+    copy.subjects = list(copy.items())
+    assert copy.store is None
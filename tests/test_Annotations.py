@@ -0,0 +1,30 @@
+import pytest
+
+from Annotations import (AnnotationBase, AnnotationBinary,
+                         AnnotationCategorical)
+from Classifiers import Classifier
+from Labels import CategoricalLabelType
+
+
+def testCategoricalAnnotation():
+    classifier = Classifier(id=1)
+    zooniverseAnnotations = {'T0': [{'value': 'spiral'}]}
+    annotation = AnnotationCategorical(
+        5,
+        classifier=classifier,
+        zooniverseAnnotations=zooniverseAnnotations,
+        taskName='T0')
+
+    assert isinstance(annotation, AnnotationBase)
+    assert not isinstance(annotation, AnnotationBinary)
+    assert not hasattr(annotation, 'trueValue')
+    assert annotation.labelType is CategoricalLabelType
+    assert (annotation.id, annotation.label) == (5, 'spiral')
+    assert AnnotationCategorical(
+        6,
+        classifier=classifier,
+        zooniverseAnnotations=zooniverseAnnotations,
+        taskName='T0',
+        values=['elliptical']).label is None
+    with pytest.raises(TypeError):
+        annotation.classifier = 1
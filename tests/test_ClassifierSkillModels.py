@@ -0,0 +1,153 @@
+import numpy as np
+import pytest
+
+from Annotations import AnnotationBinary, Annotations
+from AnnotationStore import AnnotationStore
+from ClassifierSkillModels import (ClassifierSkillCountsBinary,
+                                   ClassifierSkillEngineBinary,
+                                   ClassifierSkillModelBinary,
+                                   ClassifierSkillPriorBinary)
+from Classifiers import Classifier
+from Subjects import Subject, Subjects
+
+
+def hideTrueLabels(subjects, step=7):
+    """Clear the true label of every step-th subject, so that unlabelled
+    subjects are exercised too.
+    """
+    for subject in subjects.subjects[::step]:
+        subject.trueLabel = None
+
+
+def assertSkillsEqual(actual, expected):
+    assert set(actual) == set(expected)
+    for label, skill in expected.items():
+        assert actual[label] == pytest.approx(skill, rel=1e-12)
+
+
+@pytest.mark.parametrize('useRegistry', [False, True])
+def testEngineMatchesComputeSkills(simulatedSubjects, useRegistry):
+    subjects, classifiers = simulatedSubjects
+    hideTrueLabels(subjects)
+    if useRegistry:
+        classifiers.indexSubjects(subjects)
+    args = dict(classifiers=classifiers) if useRegistry else {}
+    for classifier in classifiers.items():
+        classifier.computeSkills(subjects, **args)
+    expected = {
+        classifier.id: (dict(classifier.skills), dict(classifier.skillPriors))
+        for classifier in classifiers.items()
+    }
+
+    engine = ClassifierSkillEngineBinary()
+    store = AnnotationStore.fromSubjects(subjects, labels=[False, True])
+    priors = engine.priors(store)
+    skills = engine(store, priors=priors)
+    for classifierId, (classifierSkills, skillPriors) in expected.items():
+        code = store.classifierIdMap[classifierId]
+        assertSkillsEqual(
+            {
+                store.labels[labelCode]: skill
+                for labelCode, skill in enumerate(skills[code])
+                if not np.isnan(skill)
+            }, classifierSkills)
+        assertSkillsEqual(dict(zip(store.labels, priors)), skillPriors)
+
+    # Writing back reproduces the dictionaries of the object models.
+    engine.computeSkills(subjects, classifiers=classifiers.items())
+    for classifier in classifiers.items():
+        assertSkillsEqual(classifier.skills, expected[classifier.id][0])
+        assertSkillsEqual(classifier.skillPriors, expected[classifier.id][1])
+
+
+def assertCountsBackedModelsMatchScan(subjects, classifiers, counts):
+    priors = ClassifierSkillPriorBinary()(subjects, initMode=False)
+    assertSkillsEqual(
+        ClassifierSkillPriorBinary(counts)(subjects, initMode=False), priors)
+    for classifier in classifiers.items():
+        assertSkillsEqual(
+            ClassifierSkillModelBinary(counts)(classifier, subjects, priors,
+                                               False),
+            ClassifierSkillModelBinary()(classifier, subjects, priors, False))
+
+
+def testCountsBackedModelsMatchScan(simulatedSubjects):
+    subjects, classifiers = simulatedSubjects
+    hideTrueLabels(subjects)
+    counts = ClassifierSkillCountsBinary(subjects.store)
+
+    assertCountsBackedModelsMatchScan(subjects, classifiers, counts)
+    # Counts over a different store do not describe subjects.
+    other = ClassifierSkillCountsBinary(
+        AnnotationStore.fromSubjects(subjects, labels=[False, True]))
+    with pytest.raises(ValueError):
+        ClassifierSkillPriorBinary(other)(subjects, initMode=False)
+
+
+def testCountsBackedModelsFollowSubjects(simulatedSubjects):
+    subjects, classifiers = simulatedSubjects
+    counts = ClassifierSkillCountsBinary(subjects.store)
+    assertCountsBackedModelsMatchScan(subjects, classifiers, counts)
+
+    # Labels set on subjects and classifiers added by a merge reach the counts.
+    hideTrueLabels(subjects, step=3)
+    newcomer = Classifier(id='newcomer')
+    classifiers.append(newcomer)
+    subjects.merge(
+        Subjects([
+            Subject(id=subject.id,
+                    annotations=Annotations([
+                        AnnotationBinary(10**6 + position,
+                                         classifier=newcomer,
+                                         zooniverseAnnotations={
+                                             'T0': [{
+                                                 'value': position % 2
+                                             }]
+                                         },
+                                         taskName='T0',
+                                         trueValue=1,
+                                         falseValue=0)
+                    ]))
+            for position, subject in enumerate(subjects.subjects[:20])
+        ]))
+
+    assert ClassifierSkillModelBinary(counts)(
+        newcomer, subjects, {False: 0.5, True: 0.5}, False)
+    assertCountsBackedModelsMatchScan(subjects, classifiers, counts)
+
+
+@pytest.mark.parametrize('maxRelabelSubjects', [0, 1024])
+def testCountsFollowAppendsAndRelabels(simulated, maxRelabelSubjects):
+    _, store = simulated
+    engine = ClassifierSkillEngineBinary()
+    counts = ClassifierSkillCountsBinary(store)
+    # Zero forces relabel() to recount instead of updating incrementally.
+    counts.maxRelabelSubjects = maxRelabelSubjects
+    rng = np.random.default_rng(2)
+
+    def assertCountsMatch():
+        for table, expected in zip(counts.tables(), engine.counts(store)):
+            np.testing.assert_array_equal(table, expected)
+
+    assertCountsMatch()
+    for batch in range(5):
+        numAnnotations = 50
+        store.extend(
+            np.arange(numAnnotations) + 10**6 * (batch + 1),
+            rng.integers(store.numSubjects + 20,
+                         size=numAnnotations).tolist(),
+            rng.integers(store.numClassifiers + 5,
+                         size=numAnnotations).tolist(),
+            rng.choice([False, True, None], size=numAnnotations).tolist())
+        counts.update()
+        assertCountsMatch()
+
+        subjectCodes = rng.choice(store.numSubjects, size=30, replace=False)
+        counts.relabel(subjectCodes, rng.integers(-1, 2, size=30))
+        assertCountsMatch()
+
+    # Labels changed directly in the store are picked up by sync().
+    store.setTrueLabelCodes(
+        rng.integers(-1, 2, size=store.numSubjects).astype(np.int16))
+    counts.sync()
+    assertCountsMatch()
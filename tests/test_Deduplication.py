@@ -0,0 +1,144 @@
+import collections
+
+import numpy as np
+import pytest
+
+from Annotations import AnnotationBinary
+from AnnotationStore import AnnotationStore
+from Benchmark import simulateExtracts
+from Classifiers import Classifiers
+from Deduplication import ClassificationIdIndex
+from IO import CaesarSQSReceiver
+from Queues import LocalQueueBackend
+from Subjects import Subjects
+
+receiveArgs = dict(
+    numPollers=4,
+    maxMessages=40,
+    waitTimeSeconds=0,
+    taskName='T0',
+    trueValue=1,
+    falseValue=0)
+
+
+def testFilterNew():
+    index = ClassificationIdIndex(chunkBits=64)
+
+    isNew = index.filterNew([5, 70, 5, 1000])
+    np.testing.assert_array_equal(isNew, [True, True, False, True])
+    np.testing.assert_array_equal(
+        index.filterNew([70, 6, 6], record=False), [False, True, False])
+    assert 6 not in index
+    assert index.add(6)
+    assert not index.add(6)
+    assert len(index) == 4
+    assert 1000 in index and 999 not in index
+
+
+def testPersistsOnlyOnFlush(tmp_path):
+    path = str(tmp_path / 'index')
+    # A single resident chunk forces clean chunks out as others are touched.
+    index = ClassificationIdIndex(path, chunkBits=64, maxResidentChunks=1)
+    index.filterNew([1, 100, 200])
+    index.flush()
+    index.filterNew([300, 2])
+    # Recorded but unflushed ids survive eviction in memory only.
+    assert 1 in index and 2 in index and 300 in index
+    assert ClassificationIdIndex(path).filterNew([1, 2, 300]).tolist() == [
+        False, True, True
+    ]
+
+    index.flush()
+    reopened = ClassificationIdIndex(path, chunkBits=8)
+    assert reopened.chunkBits == 64
+    assert len(reopened) == 5
+    assert all(classificationId in reopened
+               for classificationId in [1, 2, 100, 200, 300])
+    assert index.numResidentChunks == 1
+
+
+def testChunkBitsMustBeBytes():
+    with pytest.raises(ValueError):
+        ClassificationIdIndex(chunkBits=12)
+
+
+@pytest.mark.parametrize('columnar', [False, True])
+def testRedeliveredExtractsMergedOnce(columnar):
+    extracts = simulateExtracts(
+        400, numClassifiers=30, numAnnotationsPerSubject=5, seed=0)
+    now = [0.0]
+    queue = LocalQueueBackend(
+        visibilityTimeout=30, duplicateProb=0.5, seed=0, clock=lambda: now[0])
+    queue.replay(extracts)
+    knownSubjects = Subjects([])
+    store = AnnotationStore(labels=[False, True])
+    receiver = CaesarSQSReceiver(
+        None,
+        annotationType=AnnotationBinary,
+        classifiers=Classifiers(),
+        sqsClient=queue,
+        dedupIndex=ClassificationIdIndex())
+
+    numBatches = 0
+    while queue.numVisible or queue.numInFlight:
+        if columnar:
+            positions, receiptHandles = receiver.extractStore(
+                store, **receiveArgs)
+            receiver.commitExtracts(store.annotationIds[positions])
+        else:
+            subjects, receiptHandles = receiver.extractBatch(**receiveArgs)
+            knownSubjects.merge(subjects, classifiers=receiver.classifiers)
+            receiver.commitExtracts([
+                annotation.id for subject in subjects.items()
+                for annotation in subject.annotations.items()
+            ])
+        if numBatches == 0:
+            # Lose the first acknowledgement, as if the receiver had crashed
+            # after committing, so that its messages are redelivered.
+            now[0] += 100
+        else:
+            assert not receiver.sqsDeleteBatch(receiptHandles)
+        numBatches += 1
+
+    if columnar:
+        mergedIds = store.annotationIds.tolist()
+    else:
+        mergedIds = [
+            annotation.id for subject in knownSubjects.items()
+            for annotation in subject.annotations.items()
+        ]
+    assert queue.numSent > len(extracts)
+    assert queue.numRedelivered > 0
+    assert sorted(mergedIds) == sorted(
+        extract['classification_id'] for extract in extracts)
+
+
+def testUncommittedSubjectsDropsEarlierBatch():
+    extracts = simulateExtracts(
+        20, numClassifiers=5, numAnnotationsPerSubject=4, seed=1)
+    receiver = CaesarSQSReceiver(
+        None,
+        annotationType=AnnotationBinary,
+        classifiers=Classifiers(),
+        sqsClient=LocalQueueBackend(),
+        dedupIndex=ClassificationIdIndex())
+    labelArgs = dict(taskName='T0', trueValue=1, falseValue=0)
+    # Both batches are received before the first is committed, and the
+    # second holds redelivered copies of three extracts of the first.
+    first = receiver.uniqueMessages(extracts[:10])
+    second = receiver.uniqueMessages(extracts[7:])
+    assert len(first) + len(second) == 23
+
+    firstSubjects = receiver.subjectsFromMessages(first, **labelArgs)
+    receiver.commitExtracts(
+        [annotation.id for subject in firstSubjects.items()
+         for annotation in subject.annotations.items()])
+    remaining = receiver.uncommittedSubjects(
+        receiver.subjectsFromMessages(second, **labelArgs))
+
+    remainingIds = collections.Counter(
+        annotation.id for subject in remaining.items()
+        for annotation in subject.annotations.items())
+    assert sorted(remainingIds) == sorted(
+        extract['classification_id'] for extract in extracts[10:])
+    assert max(remainingIds.values()) == 1
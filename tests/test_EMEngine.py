@@ -0,0 +1,172 @@
+import numpy as np
+import pytest
+
+from conftest import simulate
+from AnnotationModels import AnnotationPriorBinary
+from Annotations import AnnotationBinary, Annotations
+from ClassifierSkillModels import ClassifierSkillEngineBinary
+from EMEngine import EMEngine
+from Posteriors import PosteriorEngineBinary
+from Risk import LossModelBinary
+from Subjects import Subject, Subjects
+
+
+class ScanSkillEngineBinary(ClassifierSkillEngineBinary):
+    """Recounts the whole store on every iteration; EMEngine only maintains
+    incremental count tables for ClassifierSkillEngineBinary itself.
+    """
+
+
+def voteLabelCodes(store):
+    """Return the majority vote label code of every subject of a binary store,
+    with ties going to True.
+    """
+    observed = store.labelCodes != store.missingCode
+    votes = np.bincount(
+        store.subjectIndex[observed],
+        weights=2.0 * store.labelCodes[observed] - 1,
+        minlength=store.numSubjects)
+    return (votes >= 0).astype(np.int16)
+
+
+def testConvergesToSimulatedTruth():
+    _, store = simulate(numSubjects=500, seed=1)
+    truth = store.trueLabelCodes.copy()
+    store.setTrueLabelCodes(voteLabelCodes(store))
+    engine = EMEngine(AnnotationPriorBinary(successProb=0.6),
+                      LossModelBinary())
+
+    summary = engine(store)
+
+    assert engine.converged
+    assert len(engine.iterations) < engine.maxIterations
+    np.testing.assert_array_equal(store.trueLabelCodes, summary.mapLabelCodes)
+    assert np.mean(summary.mapLabelCodes == truth) > np.mean(
+        voteLabelCodes(store) == truth)
+    assert np.mean(summary.mapLabelCodes == truth) > 0.9
+    assert np.all(np.isfinite(summary.risks))
+
+
+def testIncrementalCountsMatchScan():
+    _, incrementalStore = simulate(seed=2)
+    _, scanStore = simulate(seed=2)
+    for store in (incrementalStore, scanStore):
+        store.setTrueLabelCodes(voteLabelCodes(store))
+    annotationPriorModel = AnnotationPriorBinary()
+    incremental = EMEngine(annotationPriorModel, maxIterations=50)
+    scan = EMEngine(
+        annotationPriorModel,
+        maxIterations=50,
+        skillEngine=ScanSkillEngineBinary())
+
+    incrementalSummary = incremental(incrementalStore)
+    scanSummary = scan(scanStore)
+
+    assert incremental.accumulator is not None
+    assert [iteration.labelChanges for iteration in incremental.iterations
+            ] == [iteration.labelChanges for iteration in scan.iterations]
+    np.testing.assert_allclose(incremental.skills, scan.skills, rtol=1e-12)
+    np.testing.assert_array_equal(incrementalSummary.mapLabelCodes,
+                                  scanSummary.mapLabelCodes)
+
+
+def testWarmStartFoldsInNewAnnotations():
+    _, store = simulate(numSubjects=400, seed=3)
+    store.setTrueLabelCodes(voteLabelCodes(store))
+    lossModel = LossModelBinary()
+    engine = EMEngine(AnnotationPriorBinary(), lossModel)
+    engine(store)
+    coldIterations = len(engine.iterations)
+
+    # Further annotations for a mix of known and new subjects.
+    more = simulate(numSubjects=100, seed=4)[1]
+    store.extend(more.annotationIds + 10**6,
+                 [code + 350 for code in more.subjectIndex.tolist()],
+                 more.classifierIndex.tolist(),
+                 [more.decodeLabel(code) for code in more.labelCodes.tolist()])
+    summary = engine(store)
+
+    assert engine.converged
+    assert len(engine.iterations) <= coldIterations
+    assert np.all(store.trueLabelCodes != store.missingCode)
+    # The accumulator folded in the new annotations exactly.
+    expected = PosteriorEngineBinary()(store, engine.skills,
+                                       AnnotationPriorBinary(), lossModel)
+    np.testing.assert_allclose(summary.posteriors, expected.posteriors)
+    np.testing.assert_allclose(summary.risks, expected.risks, atol=1e-12)
+
+
+def testRunWritesBack(simulatedSubjects):
+    subjects, classifiers = simulatedSubjects
+    for subject in subjects.items():
+        subject.trueLabel = None
+    engine = EMEngine(AnnotationPriorBinary(), LossModelBinary())
+
+    summary = engine.run(subjects, classifiers=classifiers.items())
+
+    assert [subject.trueLabel for subject in subjects.items()
+            ] == summary.mapLabels
+    for classifier in classifiers.items():
+        assert set(classifier.skills) <= {False, True}
+        assert classifier.skillPriors
+
+
+def testRunReusesBackingStore(simulatedSubjects):
+    subjects, classifiers = simulatedSubjects
+    store = subjects.store
+    engine = EMEngine(AnnotationPriorBinary(), LossModelBinary())
+    engine.run(subjects, classifiers=classifiers.items())
+    accumulator = engine.accumulator
+    coldIterations = len(engine.iterations)
+
+    # A batch of annotations for new subjects is merged into the collection.
+    rng = np.random.default_rng(5)
+    classifierList = list(classifiers.items())
+    subjects.merge(
+        Subjects([
+            Subject(id=10**6 + index,
+                    annotations=Annotations([
+                        AnnotationBinary(10**7 + 10 * index + position,
+                                         classifier=classifierList[code],
+                                         zooniverseAnnotations={
+                                             'T0': [{
+                                                 'value': int(value)
+                                             }]
+                                         },
+                                         taskName='T0',
+                                         trueValue=1,
+                                         falseValue=0)
+                        for position, (code, value) in enumerate(
+                            zip(rng.integers(len(classifierList), size=5),
+                                rng.integers(2, size=5)))
+                    ])) for index in range(20)
+        ]))
+    summary = engine.run(subjects, classifiers=classifiers.items())
+
+    # The backing store and the accumulator over it are reused.
+    assert subjects.store is store
+    assert engine.accumulator is accumulator
+    assert len(engine.iterations) <= coldIterations
+    assert [subject.trueLabel for subject in subjects.items()
+            ] == summary.mapLabels
+
+
+def testRunAttachesStore():
+    receiver, store = simulate(numSubjects=50)
+    subjects = Subjects(list(store.toSubjects(
+        receiver.classifiers.items()).items()))
+    assert subjects.store is None
+
+    EMEngine(AnnotationPriorBinary()).run(subjects)
+
+    assert subjects.store is not None
+    assert subjects.store.numAnnotations == store.numAnnotations
+
+
+def testRejectsEmptyIterationBudget():
+    with pytest.raises(ValueError):
+        EMEngine(AnnotationPriorBinary(), maxIterations=0)
+    engine = EMEngine(AnnotationPriorBinary())
+    with pytest.raises(ValueError):
+        engine.maxIterations = 0
+    assert engine.maxIterations == 20
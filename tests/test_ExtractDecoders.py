@@ -0,0 +1,83 @@
+import hashlib
+import json
+
+import pytest
+
+from ExtractDecoders import ExtractDecoder, SelectiveExtractDecoder
+
+
+def extractBody(annotations, **fields):
+    extract = {
+        'id': 17,
+        'classification_id': 101,
+        'subject_id': 202,
+        'user_id': 303,
+        'metadata': {'workflow_version': '1.2', 'finished_at': 'now'},
+        'data': {'classification': {'annotations': annotations}}
+    }
+    extract.update(fields)
+    return json.dumps(extract)
+
+
+def trimmed(extract, taskName='T0'):
+    """Return the fields of a fully decoded extract used by the models.
+    """
+    annotations = extract['data']['classification']['annotations']
+    if isinstance(annotations, dict):
+        annotations = {
+            task: value
+            for task, value in annotations.items() if task == taskName
+        }
+    return dict(
+        classification_id=extract['classification_id'],
+        subject_id=extract['subject_id'],
+        user_id=extract['user_id'],
+        data={'classification': {'annotations': annotations}})
+
+
+@pytest.mark.parametrize('annotations', [
+    {'T0': {'value': 1}},
+    {'T0': [{'x': 1.5, 'y': 2, 'tool_label': 'a'}], 'T1': 'skip'},
+    {'T1': {'T0': 'nested'}, 'T0': 0},
+    {'T1': 'skip', 'T2': {'value': [1, 2]}},
+    {},
+])
+def testSelectiveMatchesFullDecode(annotations):
+    body = extractBody(annotations)
+    extract = SelectiveExtractDecoder('T0')(body)
+
+    assert extract == trimmed(json.loads(body))
+    # Unused metadata is never decoded.
+    assert 'metadata' not in extract
+
+
+@pytest.mark.parametrize('body', [
+    extractBody({'T0': 1}, metadata={'user_id': 1}),
+    extractBody({'T0': 1}, user_id=None).replace('"user_id": null, ', ''),
+    extractBody([{'task': 'T0', 'value': 1}]),
+])
+def testSelectiveFallsBackToFullDecode(body):
+    # Duplicate or missing keys and non-object annotations are decoded in
+    # full.
+    assert SelectiveExtractDecoder('T0')(body) == json.loads(body)
+
+
+def testSelectiveRaisesOnInvalidValues():
+    body = extractBody({'T0': 1}).replace('"subject_id": 202',
+                                          '"subject_id": undefined')
+
+    # The full decode the scan error falls back to reports the error.
+    with pytest.raises(ValueError):
+        SelectiveExtractDecoder('T0')(body)
+
+
+def testVerifyIntegrity():
+    body = extractBody({'T0': 1})
+    digest = hashlib.md5(body.encode()).hexdigest()
+    decoder = ExtractDecoder()
+
+    assert decoder.verify(body, digest)
+    assert not decoder.verify(body + ' ', digest)
+    decoder.verifyIntegrity = False
+    assert decoder.verify(body + ' ', digest)
+    assert SelectiveExtractDecoder('T0').verifyIntegrity
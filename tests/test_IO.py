@@ -0,0 +1,301 @@
+import collections
+import os
+
+import numpy as np
+import pytest
+
+from conftest import simulate, storeRows, subjectRows
+from AnnotationModels import AnnotationPriorBinary
+from AnnotationStore import AnnotationStore
+from ClassifierSkillModels import ClassifierSkillEngineBinary
+from IO import (CaesarTransmitter, FileStorage, LocalCaesarServer,
+                SQLiteStorage, TransmitterStats)
+from Posteriors import PosteriorEngineBinary
+from Risk import LossModelBinary
+
+
+def appendSimulated(store, seed, numSubjects=60, subjectOffset=0):
+    """Append the annotations of a further simulation to store, with
+    annotation ids that do not clash with earlier ones and subject ids offset
+    by subjectOffset.
+    """
+    _, more = simulate(numSubjects=numSubjects, seed=seed)
+    positions = slice(store.numAnnotations,
+                      store.numAnnotations + more.numAnnotations)
+    store.extend(
+        more.annotationIds + 10**6 * seed,
+        [more.subjectIds[code] + subjectOffset
+         for code in more.subjectIndex.tolist()],
+        [more.classifierIds[code] for code in more.classifierIndex.tolist()],
+        [more.decodeLabel(code) for code in more.labelCodes.tolist()])
+    return positions
+
+
+def evaluate(store):
+    skillEngine = ClassifierSkillEngineBinary()
+    priors = skillEngine.priors(store)
+    skills = skillEngine(store, priors=priors)
+    summary = PosteriorEngineBinary()(store, skills, AnnotationPriorBinary(),
+                                      LossModelBinary())
+    return skills, priors, summary
+
+
+def testSQLiteStoreRoundTrip(tmp_path, simulated):
+    _, store = simulated
+    path = str(tmp_path / 'store.db')
+    storage = SQLiteStorage(path, batchSize=128)
+    storage.saveStore(store)
+    # Later appends are saved by position, with overlapping subjects.
+    positions = appendSimulated(store, seed=1, subjectOffset=250)
+    storage.saveStore(store, positions)
+    skills, priors, summary = evaluate(store)
+    storage.saveSkills(store, skills, priors)
+    storage.savePosteriors(store, summary)
+    storage.close()
+
+    storage = SQLiteStorage(path)
+    loaded = storage.loadStore()
+    loadedSkills, loadedPriors = storage.loadSkills(loaded)
+    loadedPosteriors, loadedRisks = storage.loadPosteriors(loaded)
+
+    assert storeRows(loaded) == storeRows(store)
+    assert sorted(loaded.subjectIds) == sorted(store.subjectIds)
+    for subjectId in store.subjectIds:
+        assert loaded.getTrueLabel(subjectId) == store.getTrueLabel(subjectId)
+    codes = [loaded.classifierIdMap[classifierId]
+             for classifierId in store.classifierIds]
+    np.testing.assert_array_equal(loadedSkills[codes], skills)
+    np.testing.assert_array_equal(loadedPriors, priors)
+    codes = [loaded.subjectIdMap[subjectId] for subjectId in store.subjectIds]
+    np.testing.assert_array_equal(loadedPosteriors[codes], summary.posteriors)
+    np.testing.assert_array_equal(loadedRisks[codes], summary.risks)
+
+
+def testSQLiteStoresAnonymousClassifications(tmp_path, simulated):
+    _, store = simulated
+    # Classifications by anonymous volunteers have no user id.
+    store.extend([10**6, 10**6 + 1], store.subjectIds[:2], [None, None],
+                 [False, True])
+    skills, priors, _ = evaluate(store)
+    path = str(tmp_path / 'store.db')
+    storage = SQLiteStorage(path)
+    storage.saveStore(store)
+    storage.saveSkills(store, skills, priors)
+    storage.close()
+
+    storage = SQLiteStorage(path)
+    loaded = storage.loadStore()
+    loadedSkills, _ = storage.loadSkills(loaded)
+
+    assert storeRows(loaded) == storeRows(store)
+    np.testing.assert_array_equal(
+        loadedSkills[loaded.classifierIdMap[None]],
+        skills[store.classifierIdMap[None]])
+
+
+def testSQLiteLoadPosteriorsSkipsUnknownSubjects(tmp_path, simulated):
+    _, store = simulated
+    storage = SQLiteStorage(str(tmp_path / 'store.db'))
+    storage.saveStore(store)
+    storage.savePosteriors(store, evaluate(store)[2])
+
+    subset = AnnotationStore(labels=[False, True])
+    subset.extend([1], ['unknown'], [0], [True])
+    subset.subjectCode(store.subjectIds[3])
+    posteriors, risks = storage.loadPosteriors(subset)
+
+    assert np.all(np.isnan(posteriors[0])) and np.isnan(risks[0])
+    assert np.all(np.isfinite(posteriors[1])) and np.isfinite(risks[1])
+
+
+def testSQLiteSubjectsRoundTrip(tmp_path, simulatedSubjects):
+    subjects, classifiers = simulatedSubjects
+    ClassifierSkillEngineBinary().computeSkills(
+        subjects, classifiers=classifiers.items())
+    path = str(tmp_path / 'subjects.db')
+    storage = SQLiteStorage(path)
+    storage.saveSubjects(subjects)
+    storage.saveClassifiers(classifiers.items())
+    storage.close()
+
+    loadedSubjects, loadedClassifiers = SQLiteStorage(path).loadSubjects()
+
+    assert subjectRows(loadedSubjects) == subjectRows(subjects)
+    for subject in subjects.items():
+        assert loadedSubjects.get(
+            subject.id).trueLabel == subject.trueLabel
+    for classifier in classifiers.items():
+        loadedClassifier = loadedClassifiers.get(classifier.id)
+        assert loadedClassifier.skills == pytest.approx(classifier.skills)
+        assert loadedClassifier.skillPriors == pytest.approx(
+            classifier.skillPriors)
+
+
+def testFileStoreRoundTrip(tmp_path, simulated):
+    _, store = simulated
+    path = str(tmp_path / 'files')
+    storage = FileStorage(path)
+    storage.saveStore(store)
+    appendSimulated(store, seed=1, subjectOffset=250)
+    store.setTrueLabel(0, False)
+    storage.saveStore(store)
+    skills, priors, summary = evaluate(store)
+    storage.saveSkills(skills, priors)
+    storage.savePosteriors(summary)
+
+    storage = FileStorage(path)
+    loaded = storage.loadStore()
+    loadedSkills, loadedPriors = storage.loadSkills()
+    loadedPosteriors, loadedRisks = storage.loadPosteriors()
+
+    assert len(storage.segments) == 2
+    assert storage.segments[1]['numSubjects'] == 10
+    assert storage.numAnnotations == store.numAnnotations
+    for name in FileStorage.columnTypes:
+        np.testing.assert_array_equal(getattr(loaded, name),
+                                      getattr(store, name))
+    np.testing.assert_array_equal(loaded.trueLabelCodes, store.trueLabelCodes)
+    assert list(loaded.subjectIds) == list(store.subjectIds)
+    assert list(loaded.classifierIds) == list(store.classifierIds)
+    assert loaded.getTrueLabel(0) is False
+    np.testing.assert_array_equal(loadedSkills, skills)
+    np.testing.assert_array_equal(loadedPriors, priors)
+    np.testing.assert_array_equal(loadedPosteriors, summary.posteriors)
+    np.testing.assert_array_equal(loadedRisks, summary.risks)
+
+    # A loaded store can be extended and saved as a further segment.
+    appendSimulated(loaded, seed=2, subjectOffset=1000)
+    storage.saveStore(loaded)
+    assert storeRows(FileStorage(path).loadStore()) == storeRows(loaded)
+
+
+def testFileStoreStringIds(tmp_path):
+    store = AnnotationStore(labels=['a', 'b', 'c'])
+    store.extend([1, 2, 3], ['s1', 's2', 's1'], ['u1', 'u1', 'u2'],
+                 ['a', 'c', None])
+    storage = FileStorage(str(tmp_path / 'files'))
+    storage.saveStore(store)
+
+    assert storeRows(storage.loadStore()) == storeRows(store)
+
+
+def testFileStoreRejectsUnrelatedStore(tmp_path, simulated):
+    _, store = simulated
+    storage = FileStorage(str(tmp_path / 'files'))
+    storage.saveStore(store)
+
+    shorter = AnnotationStore(labels=[False, True])
+    shorter.extend([1], [0], [0], [True])
+    with pytest.raises(ValueError):
+        storage.saveStore(shorter)
+    with pytest.raises(ValueError):
+        storage.saveStore(AnnotationStore(labels=[True, False]))
+    assert len(storage.segments) == 1
+
+
+def testTransmitterRetriesAgainstLocalServer():
+    server = LocalCaesarServer(failureProb=0.3, seed=0)
+    transmitter = CaesarTransmitter(
+        server.url,
+        batchSize=8,
+        maxRetries=20,
+        backoffBase=0.001,
+        flushInterval=0.01)
+    subjectIds = list(range(30))
+    posteriors = np.column_stack([np.linspace(0, 1, 30),
+                                  np.linspace(1, 0, 30)])
+    try:
+        transmitter.reductions(
+            subjectIds,
+            labels=[False, True],
+            posteriors=posteriors,
+            risks=np.full(30, 0.25),
+            decisions=[None] * 29 + ['retire'])
+        assert transmitter.flush(timeout=30)
+        stats = transmitter.stats
+        received = {
+            reduction['subject_id']: reduction['data']
+            for reduction in server.received
+        }
+    finally:
+        transmitter.close()
+        server.close()
+
+    assert sorted(received) == subjectIds
+    assert stats.numSent == 30 and stats.numFailed == 0
+    assert stats.numRetries == server.numRequests - 30 > 0
+    assert received[29] == {
+        'posteriors': {'False': 1.0, 'True': 0.0},
+        'risk': 0.25,
+        'decision': 'retire'
+    }
+
+
+def testTransmitterCoalescesPendingReductions():
+    sent = []
+    transmitter = CaesarTransmitter(
+        None, batchSize=100, flushInterval=60, sender=sent.append)
+    for risk in (0.5, 0.4, 0.3):
+        transmitter.queueReduction(1, risk=risk)
+    transmitter.queueReduction(2, risk=0.9)
+    assert transmitter.numPending == 2
+    assert transmitter.flush(timeout=10)
+    transmitter.close()
+
+    assert sent == [{
+        'reduction': {'subject_id': 1, 'data': {'risk': 0.3}}
+    }, {
+        'reduction': {'subject_id': 2, 'data': {'risk': 0.9}}
+    }]
+    assert transmitter.stats == TransmitterStats(
+        numQueued=4, numCoalesced=2, numSent=2, numFailed=0, numRetries=0)
+    with pytest.raises(RuntimeError):
+        transmitter.queueReduction(3)
+
+
+def testTransmitterAbandonsFailedReductions():
+    attempts = collections.Counter()
+
+    def sender(payload):
+        subjectId = payload['reduction']['subject_id']
+        attempts[subjectId] += 1
+        if subjectId == 'unreachable':
+            raise ConnectionError('Unreachable.')
+        if subjectId == 'invalid':
+            raise TypeError('Not JSON serializable.')
+
+    transmitter = CaesarTransmitter(
+        None, maxRetries=3, backoffBase=0.001, flushInterval=0.01,
+        sender=sender)
+    for subjectId in ('unreachable', 'invalid', 'valid'):
+        transmitter.queueReduction(subjectId)
+    assert transmitter.flush(timeout=10)
+    transmitter.close()
+
+    # Transient errors are retried; any other error abandons at once.
+    assert attempts == {'unreachable': 3, 'invalid': 1, 'valid': 1}
+    assert sorted(transmitter.failedSubjectIds) == ['invalid', 'unreachable']
+    assert transmitter.stats.numFailed == 2
+    assert transmitter.stats.numRetries == 2
+    assert transmitter.stats.numSent == 1
+
+
+def testFileStoreDiscardsUnsavedIds(tmp_path):
+    store = AnnotationStore(labels=['a', 'b'])
+    store.extend([1, 2], ['s1', 's2'], ['u1', 'u2'], ['a', 'b'])
+    path = str(tmp_path / 'files')
+    storage = FileStorage(path)
+    storage.saveStore(store)
+    # Bytes left by a save interrupted before its manifest was written.
+    with open(os.path.join(path, 'subjectIds.jsonl'), 'ab') as idFile:
+        idFile.write(b'"orphan"\n"orphan"\n')
+
+    store.extend([3, 4], ['s3', 's1'], ['u1', 'u3'], ['b', 'a'])
+    storage.saveStore(store)
+    store.extend([5], ['s4'], ['u4'], ['a'])
+    FileStorage(path).saveStore(store)
+
+    loaded = FileStorage(path).loadStore()
+    assert list(loaded.subjectIds) == ['s1', 's2', 's3', 's4']
+    assert list(loaded.classifierIds) == ['u1', 'u2', 'u3', 'u4']
+    assert storeRows(loaded) == storeRows(store)
@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+import scipy.sparse.csgraph as scigraph
+import scipy.spatial as scispatial
+
+from Annotations import AnnotationKeyPoint, Annotations
+from Classifiers import Classifier
+from KeyPoints import (KeyPointAggregator, KeyPointClusterer,
+                       KeyPointSkillEngine)
+from Subjects import Subject, Subjects
+
+
+def referenceMemberships(points, radius, minSamples):
+    """Cluster points by comparing every pair of marks.
+    """
+    distances = scispatial.distance.cdist(points, points)
+    neighbours = distances <= radius
+    core = np.flatnonzero(neighbours.sum(axis=1) >= minSamples)
+    memberships = np.full(points.shape[0], -1)
+    if core.size == 0:
+        return memberships
+    _, components = scigraph.connected_components(
+        neighbours[np.ix_(core, core)], directed=False)
+    memberships[core] = components
+    for mark in np.flatnonzero(memberships < 0):
+        nearest = np.argmin(distances[mark, core])
+        if distances[mark, core[nearest]] <= radius:
+            memberships[mark] = components[nearest]
+    assigned = memberships >= 0
+    _, firstMarks, inverse = np.unique(
+        memberships[assigned], return_index=True, return_inverse=True)
+    memberships[assigned] = np.argsort(np.argsort(firstMarks))[inverse]
+    return memberships
+
+
+@pytest.mark.parametrize('minSamples', [1, 3, 6])
+def testMembershipsMatchPairwiseReference(minSamples):
+    rng = np.random.default_rng(minSamples)
+    centres = rng.uniform(0, 500, size=(20, 2))
+    points = np.concatenate([
+        centres[rng.integers(20, size=400)] +
+        rng.normal(scale=4, size=(400, 2)),
+        rng.uniform(0, 500, size=(100, 2))
+    ])
+    clusterer = KeyPointClusterer(radius=6, minSamples=minSamples)
+
+    np.testing.assert_array_equal(
+        clusterer.memberships(points),
+        referenceMemberships(points, 6, minSamples))
+
+
+def testSummarizeKnownClusters():
+    points = [[0, 0], [2, 0], [1, 3], [100, 100], [102, 100], [300, 300]]
+    clusters = KeyPointClusterer(radius=5, minSamples=2)(
+        points,
+        labels=['a', 'a', 'b', 'b', 'b', 'c'],
+        classifierIds=[1, 2, 1, 1, 2, 3])
+
+    np.testing.assert_array_equal(clusters.memberships, [0, 0, 0, 1, 1, -1])
+    np.testing.assert_allclose(clusters.centres, [[1, 1], [101, 100]])
+    np.testing.assert_array_equal(clusters.numMarks, [3, 2])
+    np.testing.assert_array_equal(clusters.numClassifiers, [2, 2])
+    assert clusters.consensusLabels == ['a', 'b']
+    np.testing.assert_allclose(clusters.consensusFractions, [2 / 3, 1])
+
+    weighted = KeyPointClusterer(radius=5)([[0, 0], [4, 0]],
+                                           weights=[3, 1])
+    np.testing.assert_allclose(weighted.centres, [[1, 0]])
+
+
+def testEmptyAndInvalidInput():
+    clusterer = KeyPointClusterer()
+    clusters = clusterer(np.empty((0, 2)))
+
+    assert clusters.centres.shape == (0, 2)
+    assert clusters.memberships.size == 0
+    clusterer.radius = 0
+    with pytest.raises(ValueError):
+        clusterer([[0, 0]])
+
+
+def testSkillEngine():
+    skills = KeyPointSkillEngine()(
+        ['a', 'a', 'a', 'b'], [[1, 1], [-1, 1], [0, 0], [0, 0]],
+        [True, True, False, True],
+        nBeta=0,
+        nVariance=0)
+
+    assert skills.classifierIds == ['a', 'b']
+    np.testing.assert_allclose(skills.precisions, [2 / 3, 1])
+    np.testing.assert_allclose(skills.variances, [1, 0])
+
+
+def testAggregatorWeightsCarefulClassifiers():
+    careful, careless = Classifier(id='careful'), Classifier(id='careless')
+    rng = np.random.default_rng(0)
+    subjects = Subjects([])
+    for subjectId in range(30):
+        annotations = [
+            AnnotationKeyPoint(x, y, 'star', careful)
+            for x, y in rng.normal(scale=0.5, size=(3, 2))
+        ] + [
+            AnnotationKeyPoint(x, y, 'star', careless)
+            for x, y in rng.normal(loc=3, scale=2, size=(3, 2))
+        ]
+        subjects.append(
+            Subject(id=subjectId, annotations=Annotations(annotations)))
+    careful.skills = {True: 0.9}
+
+    results = KeyPointAggregator(KeyPointClusterer(radius=8))(
+        subjects, classifiers=[careful, careless])
+
+    assert careful.keyPointSkills['variance'] < careless.keyPointSkills[
+        'variance']
+    # Label skills are untouched.
+    assert careful.skills == {True: 0.9}
+    for subject in subjects.items():
+        clusters = results[subject.id]
+        assert clusters.numMarks.tolist() == [6]
+        unweighted = KeyPointClusterer(radius=8).clusterAnnotations(
+            subject.annotations.items())
+        # Weighted centres lie nearer the careful classifier's marks.
+        assert np.linalg.norm(clusters.centres) < np.linalg.norm(
+            unweighted.centres)
@@ -0,0 +1,112 @@
+import itertools
+import threading
+
+import pytest
+
+from Pipeline import Pipeline
+
+
+class BatchSource():
+    """Callable returning the given batches in turn, then empty batches.
+    """
+
+    def __init__(self, batches):
+        self._batches = iter(batches)
+        self.numCalls = 0
+
+    def __call__(self):
+        self.numCalls += 1
+        return next(self._batches, [])
+
+
+def testUpdatesEveryBatchInOrder():
+    batches = [[1, 2], [], [3], [4, 5, 6], []]
+    updated = []
+    pipeline = Pipeline(
+        BatchSource(batches), updated.append, maxIdlePolls=3)
+
+    pipeline.run()
+
+    assert updated == [[1, 2], [3], [4, 5, 6]]
+    assert pipeline.receiverStats.numBatches == 7
+    assert pipeline.updaterStats.numBatches == 3
+    assert pipeline.updaterStats.numItems == 6
+    assert not pipeline.running
+
+
+def testBackpressureBoundsReceivedBatches():
+    receive = BatchSource([batch] for batch in itertools.count())
+    release = threading.Event()
+    updated = []
+
+    def update(batch):
+        release.wait()
+        updated.append(batch)
+
+    pipeline = Pipeline(receive, update, maxQueueSize=2, maxBatches=10)
+    pipeline.start()
+    assert not pipeline.join(timeout=0.5)
+    # One batch is being updated, two are queued and one awaits a free slot.
+    assert receive.numCalls == 4
+    assert pipeline.maxQueueDepth == pipeline.maxQueueSize
+    release.set()
+
+    assert pipeline.join(timeout=10)
+    assert updated == [[batch] for batch in range(10)]
+    assert receive.numCalls == 10
+
+
+def testSizeOfCountsItems():
+    batches = [('a', [1, 2, 3]), ('b', []), ('c', [4])]
+    updated = []
+    pipeline = Pipeline(
+        BatchSource(batches),
+        updated.append,
+        sizeOf=lambda batch: len(batch[1]) if batch else 0,
+        maxIdlePolls=2)
+
+    pipeline.run()
+
+    assert [name for name, _ in updated] == ['a', 'c']
+    assert pipeline.updaterStats.numItems == 4
+
+
+def testUpdateErrorPropagates():
+    receive = BatchSource([batch] for batch in itertools.count())
+
+    def update(batch):
+        if batch == [3]:
+            raise KeyError(batch)
+
+    pipeline = Pipeline(receive, update)
+    pipeline.start()
+
+    with pytest.raises(KeyError):
+        pipeline.join(timeout=10)
+    # The receiver stops rather than polling indefinitely.
+    assert not pipeline.running
+    assert pipeline.updaterStats.numBatches == 3
+
+
+def testReceiveErrorPropagates():
+    def receive():
+        raise ConnectionError('Unreachable.')
+
+    updated = []
+    pipeline = Pipeline(receive, updated.append)
+
+    with pytest.raises(ConnectionError):
+        pipeline.run()
+    assert not updated
+    assert not pipeline.running
+
+
+def testStartWhileRunning():
+    release = threading.Event()
+    pipeline = Pipeline(BatchSource([[1]]), lambda batch: release.wait(),
+                        maxBatches=1)
+    pipeline.start()
+    with pytest.raises(RuntimeError):
+        pipeline.start()
+    release.set()
+    assert pipeline.join(timeout=10)
@@ -0,0 +1,161 @@
+import numpy as np
+import pytest
+
+from AnnotationModels import (AnnotationModelBinary,
+                              AnnotationModelCategorical,
+                              AnnotationPriorBinary,
+                              AnnotationPriorCategorical)
+from AnnotationStore import AnnotationStore
+from Classifiers import Classifier
+from ClassifierSkillModels import (ClassifierSkillEngineBinary,
+                                   ClassifierSkillEngineCategorical)
+from Posteriors import PosteriorEngineBinary, PosteriorEngineCategorical
+from Risk import LossModelBinary, LossModelCategorical, Risk
+
+
+def objectResults(subjects, annotationModel, annotationPriorModel, lossModel):
+    """Label each subject with Subject.computeTrueLabel and evaluate its risk
+    with Risk, one subject at a time.
+
+    Returns: Tuple of (list of MAP labels, array of risks).
+    """
+    riskEvaluator = Risk()
+    mapLabels, risks = [], []
+    for subject in subjects.items():
+        subject.computeTrueLabel(
+            annotationModel=annotationModel,
+            annotationPriorModel=annotationPriorModel)
+        mapLabels.append(subject.trueLabel)
+        risks.append(
+            riskEvaluator(
+                annotations=subject.annotations,
+                subject=subject,
+                lossModel=lossModel,
+                annotationModel=annotationModel,
+                annotationPriorModel=annotationPriorModel))
+    return mapLabels, np.array(risks)
+
+
+def testBinaryEngineMatchesObjectModels(simulatedSubjects):
+    subjects, classifiers = simulatedSubjects
+    ClassifierSkillEngineBinary().computeSkills(
+        subjects, classifiers=classifiers.items())
+    annotationPriorModel = AnnotationPriorBinary(successProb=0.6)
+    lossModel = LossModelBinary(falsePosLoss=1, falseNegLoss=2)
+
+    summary = PosteriorEngineBinary().computeTrueLabels(
+        subjects, annotationPriorModel, lossModel)
+    engineLabels = [subject.trueLabel for subject in subjects.items()]
+    mapLabels, risks = objectResults(subjects, AnnotationModelBinary(),
+                                     annotationPriorModel, lossModel)
+
+    assert engineLabels == mapLabels
+    np.testing.assert_allclose(summary.risks, risks, rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(summary.posteriors.sum(axis=1), 1.0)
+
+
+def testBinaryEngineDoesNotUnderflow():
+    store = AnnotationStore(labels=[False, True])
+    numAnnotations = 3000
+    store.extend(
+        np.arange(numAnnotations), [0] * numAnnotations,
+        np.arange(numAnnotations).tolist(),
+        (np.arange(numAnnotations) % 10 != 0).tolist())
+    skills = np.full((numAnnotations, 2), 0.9)
+
+    summary = PosteriorEngineBinary()(store, skills, AnnotationPriorBinary(),
+                                      LossModelBinary())
+
+    assert np.all(np.isfinite(summary.posteriors))
+    assert summary.mapLabels == [True]
+    assert np.isfinite(summary.risks[0])
+    assert summary.risks[0] < 1e-100
+
+
+def categoricalStore(labels, numSubjects=150, numClassifiers=25, seed=0):
+    """Return a store of simulated answers to a question with the given
+    labels, in which each classifier answers correctly with its own
+    probability and otherwise picks another label at random.
+    """
+    rng = np.random.default_rng(seed)
+    numLabels = len(labels)
+    accuracies = rng.uniform(0.5, 0.95, size=numClassifiers)
+    subjectIndex = np.repeat(np.arange(numSubjects), 12)
+    classifierIndex = rng.integers(numClassifiers, size=subjectIndex.size)
+    trueLabelCodes = rng.integers(numLabels, size=numSubjects)
+    correct = rng.random(subjectIndex.size) < accuracies[classifierIndex]
+    labelCodes = np.where(
+        correct, trueLabelCodes[subjectIndex],
+        (trueLabelCodes[subjectIndex] +
+         rng.integers(1, numLabels, size=subjectIndex.size)) % numLabels)
+    store = AnnotationStore(labels=labels)
+    store.extend(
+        np.arange(subjectIndex.size), subjectIndex.tolist(),
+        classifierIndex.tolist(), [labels[code] for code in labelCodes])
+    store.setTrueLabelCodes(trueLabelCodes.astype(np.int16))
+    return store
+
+
+def testCategoricalEngineMatchesObjectModels():
+    labels = ['a', 'b', 'c', 'd']
+    store = categoricalStore(labels)
+    skillEngine = ClassifierSkillEngineCategorical()
+    priors = skillEngine.priors(store)
+    skills = skillEngine(store, priors=priors)
+    annotationPriorModel = AnnotationPriorCategorical(
+        labels, probs=[0.4, 0.3, 0.2, 0.1])
+    lossModel = LossModelCategorical(losses={('a', 'd'): 3})
+
+    summary = PosteriorEngineCategorical()(store, skills,
+                                           annotationPriorModel, lossModel)
+    classifiers = [Classifier(id=classifierId)
+                   for classifierId in store.classifierIds]
+    skillEngine.assign(store, skills, priors, classifiers)
+    subjects = store.toSubjects(classifiers)
+    mapLabels, risks = objectResults(subjects,
+                                     AnnotationModelCategorical(labels),
+                                     annotationPriorModel, lossModel)
+
+    np.testing.assert_allclose(skills.sum(axis=2), 1.0)
+    assert summary.mapLabels == mapLabels
+    np.testing.assert_allclose(summary.risks, risks, rtol=1e-9, atol=1e-12)
+
+
+def testCategoricalEngineReducesToBinary(simulated):
+    _, store = simulated
+    # Every classifier has used both labels, so no binary skill is missing.
+    assert np.all(ClassifierSkillEngineBinary().counts(store)[2] > 0)
+    annotationPriorModel = AnnotationPriorBinary(successProb=0.6)
+    lossModel = LossModelBinary(falsePosLoss=1, falseNegLoss=2)
+
+    binarySkills = ClassifierSkillEngineBinary()(store, nBeta=4.0)
+    binary = PosteriorEngineBinary()(store, binarySkills, annotationPriorModel,
+                                     lossModel)
+    categoricalSkills = ClassifierSkillEngineCategorical()(store,
+                                                           nDirichlet=4.0)
+    categorical = PosteriorEngineCategorical()(
+        store, categoricalSkills, annotationPriorModel, lossModel)
+
+    np.testing.assert_allclose(
+        np.diagonal(categoricalSkills, axis1=1, axis2=2), binarySkills)
+    np.testing.assert_allclose(categorical.posteriors, binary.posteriors)
+    np.testing.assert_array_equal(categorical.mapLabelCodes,
+                                  binary.mapLabelCodes)
+    np.testing.assert_allclose(categorical.risks, binary.risks)
+
+
+@pytest.mark.parametrize('numLabels', [3, 20])
+def testCategoricalEngineEvaluatesSubsets(numLabels):
+    labels = list(range(numLabels))
+    store = categoricalStore(labels, seed=numLabels)
+    skills = ClassifierSkillEngineCategorical()(store)
+    annotationPriorModel = AnnotationPriorCategorical(labels)
+    engine = PosteriorEngineCategorical()
+
+    full = engine(store, skills, annotationPriorModel)
+    subjectCodes = np.array([5, 0, 42])
+    subset = engine(
+        store, skills, annotationPriorModel, subjectCodes=subjectCodes)
+
+    np.testing.assert_allclose(subset.posteriors,
+                               full.posteriors[subjectCodes])
@@ -0,0 +1,126 @@
+import hashlib
+import json
+
+import pytest
+
+from Queues import LocalQueueBackend, loadExtracts
+
+
+class Clock():
+    """Manually advanced clock for LocalQueueBackend.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def receive(queue, maxMessages=10, **kwargs):
+    return queue.receive_message(MaxNumberOfMessages=maxMessages,
+                                 **kwargs).get('Messages', [])
+
+
+def testReceiveLimitsAndChecksums():
+    queue = LocalQueueBackend()
+    for body in range(15):
+        queue.send_message(MessageBody=str(body))
+
+    messages = receive(queue)
+
+    assert [message['Body'] for message in messages] == [
+        str(body) for body in range(10)
+    ]
+    assert all(message['MD5OfBody'] == hashlib.md5(
+        message['Body'].encode()).hexdigest() for message in messages)
+    assert queue.numVisible == 5 and queue.numInFlight == 10
+    with pytest.raises(ValueError):
+        receive(queue, maxMessages=11)
+    assert len(receive(queue)) == 5
+    assert receive(queue) == []
+
+
+def testUndeletedMessagesAreRedelivered():
+    clock = Clock()
+    queue = LocalQueueBackend(visibilityTimeout=30, clock=clock)
+    queue.send_message(MessageBody='a')
+    queue.send_message(MessageBody='b')
+    first = receive(queue)
+    queue.delete_message(ReceiptHandle=first[0]['ReceiptHandle'])
+
+    clock.now = 29.0
+    assert receive(queue) == []
+    clock.now = 30.0
+    second = receive(queue)
+
+    assert [message['Body'] for message in second] == ['b']
+    assert second[0]['Attributes']['ApproximateReceiveCount'] == '2'
+    assert queue.numRedelivered == 1
+    # Only the latest receipt handle of a message deletes it.
+    with pytest.raises(ValueError):
+        queue.delete_message(ReceiptHandle=first[1]['ReceiptHandle'])
+    response = queue.delete_message_batch(Entries=[{
+        'Id': 'stale',
+        'ReceiptHandle': first[1]['ReceiptHandle']
+    }, {
+        'Id': 'latest',
+        'ReceiptHandle': second[0]['ReceiptHandle']
+    }])
+    assert [entry['Id'] for entry in response['Successful']] == ['latest']
+    assert [entry['Code'] for entry in response['Failed']
+            ] == ['ReceiptHandleIsInvalid']
+
+    clock.now = 100.0
+    assert receive(queue) == []
+    assert queue.numDeleted == 2 and queue.numRedelivered == 1
+    assert queue.numVisible == 0 and queue.numInFlight == 0
+
+
+def testVisibilityTimeoutArgument():
+    clock = Clock()
+    queue = LocalQueueBackend(visibilityTimeout=30, clock=clock)
+    queue.send_message(MessageBody='a')
+    receive(queue, VisibilityTimeout=5)
+
+    clock.now = 5.0
+    assert [message['Body'] for message in receive(queue)] == ['a']
+
+
+def testDuplicatesBecomeVisibleAfterDelay():
+    clock = Clock()
+    queue = LocalQueueBackend(
+        duplicateProb=1.0, duplicateDelay=10, seed=0, clock=clock)
+    queue.send_message_batch(Entries=[{
+        'Id': str(body),
+        'MessageBody': str(body)
+    } for body in range(3)])
+
+    assert queue.numSent == 6
+    assert [message['Body'] for message in receive(queue)] == ['0', '1', '2']
+    clock.now = 10.0
+    duplicates = receive(queue)
+
+    assert sorted(message['Body'] for message in duplicates) == ['0', '1', '2']
+    assert len({message['MessageId'] for message in duplicates}) == 3
+    # Delayed duplicates are not redeliveries.
+    assert queue.numRedelivered == 0
+
+
+def testReplayAndLoadExtracts(tmp_path):
+    extracts = [{'classification_id': classificationId}
+                for classificationId in range(4)]
+    path = tmp_path / 'extracts.json'
+    path.write_text(json.dumps(extracts))
+    queue = LocalQueueBackend()
+
+    assert queue.replay(str(path)) == 4
+    assert loadExtracts(str(path)) == [
+        json.dumps(extract) for extract in extracts
+    ]
+    path.write_text('\n'.join(json.dumps(extract) for extract in extracts))
+    assert loadExtracts(str(path)) == [
+        json.dumps(extract) for extract in extracts
+    ]
+    assert [json.loads(message['Body']) for message in receive(queue)
+            ] == extracts
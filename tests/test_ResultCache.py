@@ -0,0 +1,121 @@
+import pytest
+
+from AnnotationModels import AnnotationModelBinary, AnnotationPriorBinary
+from ClassifierSkillModels import ClassifierSkillEngineBinary
+from EMEngine import EMEngine
+from ResultCache import SubjectResult, SubjectResultCache
+from Risk import LossModelBinary, Risk
+from Subjects import Subject
+
+
+def testLeastRecentlyUsedEviction():
+    cache = SubjectResultCache(maxSize=2)
+    subjects = [Subject(id=subjectId) for subjectId in range(3)]
+    for subject in subjects[:2]:
+        cache.put(subject, SubjectResult({True: 1.0}, True, None))
+    assert cache.get(subjects[0]) is not None
+
+    cache.put(subjects[2], SubjectResult({False: 1.0}, False, 0.5))
+
+    assert 1 not in cache and 0 in cache and 2 in cache
+    assert cache.evictions == 1
+    assert cache.get(subjects[1]) is None
+    # A result without a risk does not satisfy a risk lookup.
+    assert cache.get(subjects[0], requireRisk=True) is None
+    assert cache.get(subjects[2], requireRisk=True).risk == 0.5
+    assert (cache.hits, cache.misses) == (2, 2)
+    assert cache.hitRate == 0.5
+
+
+def testSubjectChangesInvalidate(simulatedSubjects):
+    subjects, _ = simulatedSubjects
+    cache = SubjectResultCache()
+    subject = subjects.subjects[0]
+    cache.put(subject, SubjectResult({True: 1.0}, True, 0.0))
+    assert cache.get(subject) is not None
+
+    subject.trueLabel = not subject.trueLabel
+    assert cache.get(subject) is None
+    cache.put(subject, SubjectResult({True: 1.0}, True, 0.0))
+    subject.markModified()
+    assert cache.get(subject) is None
+
+
+@pytest.mark.parametrize('useRegistry', [False, True])
+def testInvalidateChangedClassifiers(simulatedSubjects, useRegistry):
+    subjects, classifiers = simulatedSubjects
+    ClassifierSkillEngineBinary().computeSkills(
+        subjects, classifiers=classifiers.items())
+    if useRegistry:
+        classifiers.indexSubjects(subjects)
+    cache = SubjectResultCache()
+    assert cache.invalidateClassifiers(classifiers, subjects) == len(
+        classifiers.classifiers)
+    args = dict(
+        annotationModel=AnnotationModelBinary(),
+        annotationPriorModel=AnnotationPriorBinary())
+    for subject in subjects.items():
+        subject.computeTrueLabel(cache=cache, **args)
+    assert len(cache) == len(subjects)
+
+    classifier = next(classifiers.items())
+    classifier.skills = {False: 0.5, True: 0.5}
+    assert cache.invalidateClassifiers(classifiers, subjects) == 1
+
+    annotated = {
+        subject.id for subject in subjects.items()
+        if any(annotation.classifier is classifier
+               for annotation in subject.annotations.items())
+    }
+    assert annotated
+    assert {subject.id for subject in subjects.items()
+            if subject.id not in cache} == annotated
+    assert cache.invalidateClassifiers(classifiers, subjects) == 0
+
+
+def testSkillUpdatesInvalidate(simulatedSubjects):
+    subjects, classifiers = simulatedSubjects
+    classifiers.indexSubjects(subjects)
+    cache = SubjectResultCache()
+    engine = EMEngine(AnnotationPriorBinary(), LossModelBinary())
+
+    summary = engine.run(subjects, classifiers=classifiers, cache=cache)
+
+    # The run caches its results for every subject.
+    assert len(cache) == len(subjects)
+    for subject, risk in zip(subjects.items(), summary.risks.tolist()):
+        result = cache.get(subject, requireRisk=True)
+        assert result.mapLabel == subject.trueLabel
+        assert result.risk == risk
+    # Recomputing the same skills keeps the results.
+    classifiers.computeSkills(subjects, cache=cache)
+    assert len(cache) == len(subjects)
+
+    # A new label changes the shared skill priors, and so every skill. The
+    # results of the other subjects would be stale despite their versions.
+    subject = subjects.subjects[0]
+    subject.trueLabel = not subject.trueLabel
+    classifiers.computeSkills(subjects, cache=cache)
+
+    assert len(cache) == 0
+
+
+def testRiskUsesCache(simulatedSubjects):
+    subjects, classifiers = simulatedSubjects
+    ClassifierSkillEngineBinary().computeSkills(
+        subjects, classifiers=classifiers.items())
+    args = dict(
+        lossModel=LossModelBinary(),
+        annotationModel=AnnotationModelBinary(),
+        annotationPriorModel=AnnotationPriorBinary())
+    cache = SubjectResultCache()
+    risk = Risk(cache=cache)
+    subject = subjects.subjects[0]
+
+    first = risk(subject.annotations, subject, **args)
+    assert cache.misses == 1 and cache.hits == 0
+    assert risk(subject.annotations, subject, **args) == first
+    assert cache.hits == 1
+    assert Risk()(subject.annotations, subject, **args) == pytest.approx(first)
+    with pytest.raises(TypeError):
+        Risk(cache={})
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from Retirement import RetirementDecision, RetirementEngine
+
+
+def decisionsById(decisions):
+    return {decision.subjectId: decision for decision in decisions}
+
+
+def testRulesInOrderOfPrecedence():
+    engine = RetirementEngine(
+        riskThreshold=0.1,
+        maxAnnotations=10,
+        minAnnotations=3,
+        goldStandard={'goldRetire': 'retire', 'goldContinue': 'continue'})
+
+    decisions = decisionsById(
+        engine.update(
+            ['low', 'high', 'few', 'many', 'goldRetire', 'goldContinue'],
+            [0.01, 0.5, 0.01, 0.5, 0.9, 0.01], [5, 5, 2, 10, 1, 10]))
+
+    assert decisions['low'] == RetirementDecision('low', 'retire', 0.01, 5,
+                                                  'risk')
+    assert decisions['high'] == RetirementDecision('high', 'continue', 0.5, 5,
+                                                   None)
+    # The risk rule waits for minAnnotations.
+    assert decisions['few'].decision == 'continue'
+    assert decisions['many'].reason == 'maxAnnotations'
+    assert decisions['goldRetire'].reason == 'goldStandard'
+    # A gold-standard 'continue' overrides both the risk and count rules.
+    assert decisions['goldContinue'].decision == 'continue'
+    assert set(engine.retired) == {'low', 'many', 'goldRetire'}
+    assert engine.numActive == 3
+
+
+def testOnlyChangedSubjectsAreDecided():
+    engine = RetirementEngine(riskThreshold=0.1, minAnnotations=3)
+    engine.update(['a', 'b', 'c'], [0.5, 0.5, 0.05], [3, 3, 1])
+
+    # Unchanged subjects are skipped, and retired ones ignored.
+    assert engine.update(['a', 'b'], [0.5, 0.5], [3, 3]) == []
+    decisions = engine.update(['a', 'b', 'c'], [0.05, 0.5, 0.05], [4, 3, 3])
+    assert [(decision.subjectId, decision.decision)
+            for decision in decisions] == [('a', 'retire'), ('c', 'retire')]
+    assert engine.update(['a'], [0.9], [5]) == []
+    assert engine.retired['a'].numAnnotations == 4
+
+
+def testExemptSubjectsAreReconsidered():
+    engine = RetirementEngine(riskThreshold=0.1, minAnnotations=3)
+    engine.update(['a'], [0.01], [1])
+    assert engine.update(['a'], [0.01], [2])[0].decision == 'continue'
+
+    engine.setGoldStandard('a', 'retire')
+    decisions = engine.update([], [], [])
+
+    assert [decision.reason for decision in decisions] == ['goldStandard']
+    with pytest.raises(ValueError):
+        engine.setGoldStandard('b', 'maybe')
+
+
+def testNearestRetirement():
+    engine = RetirementEngine(riskThreshold=0.01)
+    rng = np.random.default_rng(0)
+    risks = rng.uniform(0.1, 1, size=50)
+    engine.update(list(range(50)), risks, np.full(50, 5))
+    engine.update([3], [0.05], [6])
+
+    risks[3] = 0.05
+    nearest = engine.nearestRetirement(5)
+
+    assert nearest == np.argsort(risks)[:5].tolist()
+    assert nearest[0] == 3
+    # Peeking leaves the engine unchanged.
+    assert engine.nearestRetirement(5) == nearest
+    assert engine.numActive == 50
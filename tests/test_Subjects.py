@@ -0,0 +1,69 @@
+from Annotations import AnnotationBinary, Annotations
+from Classifiers import Classifier, SharedSkillPriors
+from ClassifierSkillModels import ClassifierSkillPriorBinary
+from Subjects import Subject, Subjects
+
+
+def binarySubject(subjectId, labels, classifier):
+    zooniverseAnnotations = [{
+        'T0': [{'value': int(label)}]
+    } for label in labels]
+    return Subject(
+        id=subjectId,
+        annotations=Annotations([
+            AnnotationBinary(
+                '{}-{}'.format(subjectId, position),
+                classifier=classifier,
+                zooniverseAnnotations=annotations,
+                taskName='T0',
+                trueValue=1,
+                falseValue=0)
+            for position, annotations in enumerate(zooniverseAnnotations)
+        ]))
+
+
+def testVersionFollowsMemberChanges():
+    classifier = Classifier(id=1)
+    known = Subjects([binarySubject(0, [True], classifier)])
+    batch = Subjects([
+        binarySubject(0, [False], classifier),
+        binarySubject(1, [True, True], classifier)
+    ])
+    known.merge(batch)
+    newSubject = known.get(1)
+    subset = known.subset(id=1)
+
+    versions = (known.version, batch.version, subset.version)
+    newSubject.trueLabel = True
+    assert known.version != versions[0]
+    # The merged batch and the subset share the subject without owning it.
+    assert batch.version != versions[1]
+    assert subset.version != versions[2]
+
+    versions = (known.version, batch.version, subset.version)
+    known.get(0).trueLabel = False
+    assert known.version != versions[0]
+    assert (batch.version, subset.version) == versions[1:]
+    # Unchanged labels leave the version alone.
+    versions = known.version
+    newSubject.trueLabel = True
+    assert known.version == versions
+    assert '_parent' not in str(newSubject)
+
+
+def testSharedSkillPriorsFollowVersion():
+    classifier = Classifier(id=1)
+    subjects = Subjects([
+        binarySubject(subjectId, [True, subjectId % 2 == 0], classifier)
+        for subjectId in range(4)
+    ])
+    for subject in subjects.items():
+        subject.trueLabel = True
+    sharedSkillPriors = SharedSkillPriors(ClassifierSkillPriorBinary())
+
+    priors = dict(sharedSkillPriors.compute(subjects))
+    assert sharedSkillPriors.compute(subjects) == priors
+    assert sharedSkillPriors.version == 1
+    subjects.get(2).trueLabel = False
+    assert sharedSkillPriors.compute(subjects) != priors
+    assert sharedSkillPriors.version == 2